@@ -0,0 +1,297 @@
+"""
+Contabilidade de consumo por tenant: tokens, chamadas LLM, ferramentas e tempo.
+
+Cada execução terminada (resumo do instrumentation.finish_request) vira uma
+linha em SQLite (WAL) com tenant, canal e conversa (destinatário). Uma thread
+consolida as linhas periodicamente em totais por hora, dia e mês
+(tenant x canal) e apaga as linhas individuais depois de
+ACCOUNTING_RAW_RETENTION_DAYS: o arquivo fica pequeno e as consultas por
+período não dependem do volume de conversas. O main.py expõe as consultas em
+GET /accounting.
+
+Orçamentos opcionais por tenant (diário/mensal, em tokens ou custo estimado):
+acima do limite a execução não é bloqueada, mas cai para um caminho mais
+barato: tier "lite" em todas as etapas (economy), engine enxuto (lean) ou os dois.
+
+Configuração:
+    ACCOUNTING_ENABLED=1
+    ACCOUNTING_DB_PATH=data/accounting.db
+    ACCOUNTING_ROLLUP_SECONDS=60
+    ACCOUNTING_RAW_RETENTION_DAYS=7        linhas por conversa (os totais ficam)
+    TENANT_USAGE_BUDGETS='{"instance_1": {"daily_tokens": 2000000, "monthly_cost_usd": 30,
+                                          "on_exceed": "economy"}}'
+    USAGE_BUDGET_DEFAULT='{"monthly_tokens": 50000000}'   orçamento de quem não está na lista
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from datetime import datetime
+
+import metrics
+
+ACCOUNTING_ENABLED = os.getenv("ACCOUNTING_ENABLED", "1") == "1"
+ACCOUNTING_DB_PATH = os.getenv(
+    "ACCOUNTING_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "accounting.db")
+)
+ACCOUNTING_ROLLUP_SECONDS = float(os.getenv("ACCOUNTING_ROLLUP_SECONDS", "60"))
+ACCOUNTING_RAW_RETENTION_DAYS = float(os.getenv("ACCOUNTING_RAW_RETENTION_DAYS", "7"))
+
+# Períodos dos totais: nome -> formato do bucket (strftime, hora local)
+PERIODS = {"hour": "%Y-%m-%dT%H", "day": "%Y-%m-%d", "month": "%Y-%m"}
+# Colunas somadas em todos os níveis
+USAGE_COLUMNS = ("runs", "errors", "llm_calls", "input_tokens", "output_tokens", "tool_calls",
+                 "llm_seconds", "wall_seconds", "cost_usd")
+
+ON_EXCEED_ECONOMY = "economy"   # tier lite em todas as etapas
+ON_EXCEED_LEAN = "lean"         # engine enxuto (menos chamadas LLM por conversa)
+ON_EXCEED_BOTH = "both"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    request_id TEXT,
+    ts REAL NOT NULL,
+    tenant_id TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    conversation TEXT,
+    runs INTEGER NOT NULL DEFAULT 1,
+    errors INTEGER NOT NULL,
+    llm_calls INTEGER NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    tool_calls INTEGER NOT NULL,
+    llm_seconds REAL NOT NULL,
+    wall_seconds REAL NOT NULL,
+    cost_usd REAL NOT NULL,
+    rolled INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_runs_rolled ON runs (rolled, id);
+CREATE INDEX IF NOT EXISTS idx_runs_tenant ON runs (tenant_id, ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    tenant_id TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    runs INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    llm_calls INTEGER NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    tool_calls INTEGER NOT NULL,
+    llm_seconds REAL NOT NULL,
+    wall_seconds REAL NOT NULL,
+    cost_usd REAL NOT NULL,
+    PRIMARY KEY (period, bucket, tenant_id, channel)
+);
+"""
+
+
+def _json_env(name: str, default: dict) -> dict:
+    raw = os.getenv(name, "")
+    if not raw:
+        return default
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError as e:
+        print(f"⚠️ {name} inválido, ignorando: {e}")
+        return default
+
+
+TENANT_USAGE_BUDGETS = _json_env("TENANT_USAGE_BUDGETS", {})
+USAGE_BUDGET_DEFAULT = _json_env("USAGE_BUDGET_DEFAULT", {})
+
+
+def usage_budget_for(tenant_id: str):
+    """Orçamento de consumo do tenant, ou None (sem limite)."""
+    return TENANT_USAGE_BUDGETS.get(tenant_id) or USAGE_BUDGET_DEFAULT or None
+
+
+class Accounting:
+    def __init__(self, path=ACCOUNTING_DB_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ------------------------------------------------------------ gravação
+
+    def record(self, summary: dict):
+        """Listener de RUN_SUMMARY_LISTENERS: uma linha por execução."""
+        if not summary.get("tenant_id"):
+            return
+        row = (
+            summary.get("request_id"), time.time(), summary["tenant_id"], summary.get("channel") or "unknown",
+            summary.get("conversation"), int(bool(summary.get("error"))), summary.get("llm_calls", 0),
+            summary.get("input_tokens", 0), summary.get("output_tokens", 0), summary.get("tool_calls", 0),
+            summary.get("llm_seconds", 0.0), summary.get("wall_seconds", 0.0), summary.get("cost_usd", 0.0),
+        )
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO runs (request_id, ts, tenant_id, channel, conversation, errors, llm_calls, input_tokens, "
+                "output_tokens, tool_calls, llm_seconds, wall_seconds, cost_usd) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+        metrics.inc("accounting_runs_total", channel=row[3])
+        metrics.inc("accounting_tokens_total", row[7] + row[8], channel=row[3])
+
+    def rollup(self):
+        """Soma as linhas ainda não consolidadas nos totais e apaga as antigas."""
+        sums = ", ".join(f"SUM({column})" for column in USAGE_COLUMNS)
+        updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in USAGE_COLUMNS)
+        cutoff = time.time() - ACCOUNTING_RAW_RETENTION_DAYS * 86400
+        with self._lock:
+            last_id = self._conn.execute("SELECT MAX(id) FROM runs WHERE rolled = 0").fetchone()[0]
+            if last_id is None:
+                self._conn.execute("DELETE FROM runs WHERE rolled = 1 AND ts < ?", (cutoff,))
+                return 0
+            self._conn.execute("BEGIN")
+            try:
+                for period, fmt in PERIODS.items():
+                    self._conn.execute(
+                        f"INSERT INTO rollups (period, bucket, tenant_id, channel, {', '.join(USAGE_COLUMNS)}) "
+                        f"SELECT ?, strftime(?, ts, 'unixepoch', 'localtime'), tenant_id, channel, {sums} "
+                        f"FROM runs WHERE rolled = 0 AND id <= ? GROUP BY 2, 3, 4 "
+                        f"ON CONFLICT (period, bucket, tenant_id, channel) DO UPDATE SET {updates}",
+                        (period, fmt, last_id),
+                    )
+                rolled = self._conn.execute("UPDATE runs SET rolled = 1 WHERE rolled = 0 AND id <= ?", (last_id,)).rowcount
+                self._conn.execute("DELETE FROM runs WHERE rolled = 1 AND ts < ?", (cutoff,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        metrics.inc("accounting_rolled_total", rolled)
+        return rolled
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        from instrumentation import RUN_SUMMARY_LISTENERS
+
+        if self.record not in RUN_SUMMARY_LISTENERS:
+            RUN_SUMMARY_LISTENERS.append(self.record)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="accounting-rollup", daemon=True)
+        self._thread.start()
+        print(f"🧾 Contabilidade por tenant iniciada ({ACCOUNTING_DB_PATH})")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.rollup()
+
+    def _loop(self):
+        while not self._stop.wait(ACCOUNTING_ROLLUP_SECONDS):
+            try:
+                self.rollup()
+            except Exception:
+                print(f"❌ Accounting rollup error: {traceback.format_exc()}")
+
+    # ------------------------------------------------------------ consultas
+
+    def usage(self, tenant_id: str, period: str = "day", bucket: str = None) -> dict:
+        """Total do tenant no bucket (padrão: o atual), somando o que ainda não foi consolidado."""
+        fmt = PERIODS[period]
+        bucket = bucket or datetime.now().strftime(fmt)
+        sums = ", ".join(f"COALESCE(SUM({column}), 0)" for column in USAGE_COLUMNS)
+        with self._lock:
+            rolled = self._conn.execute(
+                f"SELECT {sums} FROM rollups WHERE period = ? AND bucket = ? AND tenant_id = ?",
+                (period, bucket, tenant_id),
+            ).fetchone()
+            pending = self._conn.execute(
+                f"SELECT {sums} FROM runs WHERE rolled = 0 AND tenant_id = ? "
+                f"AND strftime(?, ts, 'unixepoch', 'localtime') = ?",
+                (tenant_id, fmt, bucket),
+            ).fetchone()
+        return {column: a + b for column, a, b in zip(USAGE_COLUMNS, rolled, pending)}
+
+    def query(self, period: str = "day", tenant_id: str = None, channel: str = None,
+              since: str = None, until: str = None, limit: int = 500) -> list:
+        """
+        Totais por período (hour/day/month) ou, com period="conversation", por
+        conversa (dentro da retenção das linhas individuais). since/until são
+        buckets no mesmo formato do período ("2026-10", "2026-10-19"...).
+        """
+        if period == "conversation":
+            return self._conversations(tenant_id, channel, since, until, limit)
+        self.rollup()
+        clauses, params = ["period = ?"], [period]
+        for column, op, value in (("tenant_id", "=", tenant_id), ("channel", "=", channel),
+                                  ("bucket", ">=", since), ("bucket", "<=", until)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT bucket, tenant_id, channel, {', '.join(USAGE_COLUMNS)} FROM rollups "
+                f"WHERE {' AND '.join(clauses)} ORDER BY bucket DESC, tenant_id, channel LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return [dict(zip(("bucket", "tenant_id", "channel", *USAGE_COLUMNS), row)) for row in rows]
+
+    def _conversations(self, tenant_id, channel, since, until, limit):
+        sums = ", ".join(f"SUM({column})" for column in USAGE_COLUMNS)
+        day = "strftime('%Y-%m-%d', ts, 'unixepoch', 'localtime')"
+        clauses, params = ["conversation IS NOT NULL"], []
+        for column, op, value in (("tenant_id", "=", tenant_id), ("channel", "=", channel),
+                                  (day, ">=", since), (day, "<=", until)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT tenant_id, channel, conversation, MAX(ts), {sums} FROM runs WHERE {' AND '.join(clauses)} "
+                f"GROUP BY tenant_id, channel, conversation ORDER BY MAX(ts) DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        keys = ("tenant_id", "channel", "conversation", "last_run_at", *USAGE_COLUMNS)
+        return [dict(zip(keys, row)) for row in rows]
+
+    # ----------------------------------------------------------- orçamentos
+
+    def exceeded(self, tenant_id: str):
+        """Primeiro limite do orçamento do tenant já ultrapassado (ex: "daily_tokens"), ou None."""
+        budget = usage_budget_for(tenant_id)
+        if not budget:
+            return None
+        for period, prefix in (("day", "daily"), ("month", "monthly")):
+            limits = {key: budget.get(f"{prefix}_{key}") for key in ("tokens", "cost_usd")}
+            if not any(limits.values()):
+                continue
+            used = self.usage(tenant_id, period)
+            used_tokens = used["input_tokens"] + used["output_tokens"]
+            if limits["tokens"] and used_tokens >= limits["tokens"]:
+                return f"{prefix}_tokens"
+            if limits["cost_usd"] and used["cost_usd"] >= limits["cost_usd"]:
+                return f"{prefix}_cost_usd"
+        return None
+
+    def downgrade_for(self, tenant_id: str):
+        """(limite ultrapassado, ação on_exceed) se o tenant passou do orçamento, senão None."""
+        limit = self.exceeded(tenant_id)
+        if limit is None:
+            return None
+        action = (usage_budget_for(tenant_id) or {}).get("on_exceed", ON_EXCEED_ECONOMY)
+        metrics.inc("accounting_budget_downgrades_total", limit=limit, action=action)
+        return limit, action
+
+
+_accounting = None
+_accounting_lock = threading.Lock()
+
+
+def get_accounting() -> Accounting:
+    global _accounting
+    with _accounting_lock:
+        if _accounting is None:
+            _accounting = Accounting()
+        return _accounting
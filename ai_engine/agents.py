@@ -1,35 +1,79 @@
 from crewai import Agent, LLM
-from tools import WhatsAppSendTool, InstagramSendTool, WhatsAppSendAudioTool, GoogleCalendarTool, GoogleCalendarRescheduleTool, GoogleCalendarCheckAvailabilityTool, GoogleCalendarCancelTool, GoogleCalendarListDaySlotsTool
+from tools import WhatsAppSendTool, InstagramSendTool, WhatsAppSendAudioTool, GoogleCalendarTool, GoogleCalendarRescheduleTool, GoogleCalendarCheckAvailabilityTool, GoogleCalendarCancelTool, GoogleCalendarListDaySlotsTool, GoogleCalendarBatchQueryTool
+from instrumentation import instrument_llm, note_tool_definitions
+from hedging import HEDGE_FALLBACK_API_KEY, HEDGE_FALLBACK_MODEL
+from budgets import budget_for
+from llm_transport import share_transport
 import os
 
-def get_agents(user_id, custom_prompt=None, user_email=None, appointment_duration=60, calendar_connected=False, target_remote_jid=None, request_id=None, api_key=None):
+# Safety settings for LiteLLM/Gemini - passed directly as parameter
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+
+
+def routed_llm_kwargs(llm_kwargs, route=None):
     """
-    Create CrewAI agents with Gemini LLM.
-    user_id is actually the session_id (instance_1, instance_2, etc)
-    user_email is the user's email for Google Calendar integration
-    appointment_duration is the default duration for appointments in minutes
-    calendar_connected indicates if Google Calendar is connected for this user
-    target_remote_jid is the specific user phone number we are talking to (used to lock security)
-    request_id is a unique ID to track if message was sent (passed to tools)
-    api_key is the user's Gemini API Key
+    LLM kwargs for the main llm (wording tier) and the function_calling_llm (tool_args tier).
+    Without a route both use the profile's model, as before model routing existed.
+    """
+    if route is None:
+        return llm_kwargs, {**llm_kwargs, "temperature": 0.1}
+    return (
+        {**llm_kwargs, "model": route.model("wording")},
+        {**llm_kwargs, "model": route.model("tool_args"), "temperature": 0.1},
+    )
+
+
+def build_llms(profile, request_id):
+    """
+    Instrumented main LLM plus a function_calling_llm only when the route puts tool
+    arguments on a different model than the wording (otherwise one LLM per agent).
+    """
+    llm = instrument_llm(make_llm(profile["llm_kwargs"]), request_id, hedge_llm(profile["llm_kwargs"]))
+    tool_args_kwargs = profile["function_calling_llm_kwargs"]
+    if tool_args_kwargs["model"] == profile["llm_kwargs"]["model"]:
+        return llm, None
+    return llm, instrument_llm(make_llm(tool_args_kwargs), request_id, hedge_llm(tool_args_kwargs))
+
+
+def make_llm(llm_kwargs):
+    """CrewAI LLM on the process-wide keep-alive transport (llm_transport.py), not a fresh connection pool."""
+    return share_transport(LLM(**llm_kwargs), llm_kwargs.get("api_key"))
+
+
+def hedge_llm(llm_kwargs):
+    """
+    Uninstrumented LLM that receives hedged duplicates (hedging.py), when a fallback
+    model/key is configured. None means duplicates go to the same model and key.
+    """
+    if not (HEDGE_FALLBACK_MODEL or HEDGE_FALLBACK_API_KEY):
+        return None
+    kwargs = {**llm_kwargs}
+    if HEDGE_FALLBACK_MODEL:
+        kwargs["model"] = HEDGE_FALLBACK_MODEL
+    if HEDGE_FALLBACK_API_KEY:
+        kwargs["api_key"] = HEDGE_FALLBACK_API_KEY
+    return make_llm(kwargs)
+
+
+def get_whatsapp_profile(user_id, custom_prompt=None, user_email=None, appointment_duration=60, calendar_connected=False, target_remote_jid=None, request_id=None, api_key=None, route=None):
+    """
+    Everything that defines the WhatsApp commercial agent (role, goal, backstory, tools, LLM settings),
+    independent of the execution engine. Used by get_agents (CrewAI) and lean_engine (Gemini native).
+    Same arguments as get_agents.
     """
     
     # Configure Gemini LLM using CrewAI's native format
     # IMPORTANT: safety_settings must be passed directly, NOT inside 'config'
     # Otherwise LiteLLM uses default aggressive filters which silently block responses
-    
-    # Safety settings for LiteLLM/Gemini - passed directly as parameter
-    safety_settings = [
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-    ]
-    
     llm_kwargs = {
         "model": "gemini/gemini-2.5-flash",
         "temperature": 0.7,
-        "safety_settings": safety_settings,  # FIXED: Direct parameter, not inside config
+        "safety_settings": SAFETY_SETTINGS,  # FIXED: Direct parameter, not inside config
     }
     
     if api_key:
@@ -38,19 +82,18 @@ def get_agents(user_id, custom_prompt=None, user_email=None, appointment_duratio
     else:
         print(f"⚠️ Using Environment API Key for session {user_id}")
 
-    gemini_llm = LLM(**llm_kwargs)
-    
     # WhatsApp Tool with correct session_id and locked recipient
     whats_tool = WhatsAppSendTool(session_id=user_id, default_recipient=target_remote_jid, request_id=request_id)
     whats_audio_tool = WhatsAppSendAudioTool(session_id=user_id, default_recipient=target_remote_jid, request_id=request_id)
     
     # Google Calendar Tools - uses user's email for Composio connection
     # Pass appointment_duration for scheduling
-    calendar_tool = GoogleCalendarTool(user_id=user_email or user_id, appointment_duration=appointment_duration)
-    reschedule_tool = GoogleCalendarRescheduleTool(user_id=user_email or user_id, appointment_duration=appointment_duration)
-    availability_tool = GoogleCalendarCheckAvailabilityTool(user_id=user_email or user_id)
-    cancel_tool = GoogleCalendarCancelTool(user_id=user_email or user_id)
-    list_slots_tool = GoogleCalendarListDaySlotsTool(user_id=user_email or user_id)
+    calendar_tool = GoogleCalendarTool(user_id=user_email or user_id, appointment_duration=appointment_duration, request_id=request_id)
+    reschedule_tool = GoogleCalendarRescheduleTool(user_id=user_email or user_id, appointment_duration=appointment_duration, request_id=request_id)
+    availability_tool = GoogleCalendarCheckAvailabilityTool(user_id=user_email or user_id, request_id=request_id)
+    cancel_tool = GoogleCalendarCancelTool(user_id=user_email or user_id, request_id=request_id)
+    list_slots_tool = GoogleCalendarListDaySlotsTool(user_id=user_email or user_id, request_id=request_id)
+    batch_query_tool = GoogleCalendarBatchQueryTool(user_id=user_email or user_id, request_id=request_id)
 
     # Define dynamic backstory based on user prompt
     comercial_backstory = 'Vendedor experiente, empático e focado em fechamento.'
@@ -106,6 +149,9 @@ Execute esta fase APENAS após o cliente dizer "Sim" para o resumo da FASE 2.
 - Se o cliente não confirmou, NÃO agende.
 - Pergunte novamente se necessário: "Posso confirmar?"
 
+CONSULTAS MÚLTIPLAS:
+- Para consultar mais de uma data/horário de uma vez, use 'Consultar Agenda em Lote' (uma única chamada).
+
 REGRAS DE REAGENDAMENTO:
 1. Use 'Reagendar Compromisso' passando APENAS email e nova data.
 2. Se a ferramenta retornar uma LISTA numerada, apresente ao cliente e pergunte qual número.
@@ -125,18 +171,54 @@ REGRAS DE CANCELAMENTO:
     agent_tools = [whats_tool, whats_audio_tool]
     
     if calendar_connected:
-        agent_tools.extend([calendar_tool, reschedule_tool, availability_tool, cancel_tool, list_slots_tool])
+        agent_tools.extend([calendar_tool, reschedule_tool, availability_tool, cancel_tool, list_slots_tool, batch_query_tool])
         print(f"📅 Calendar tools ENABLED for this agent")
     else:
         print(f"⚠️ Calendar tools DISABLED (Google Calendar not connected)")
 
+    note_tool_definitions(request_id, agent_tools)
+    wording_kwargs, tool_args_kwargs = routed_llm_kwargs(llm_kwargs, route)
+    return {
+        "role": 'Gerente Comercial / Atendente',
+        "goal": comercial_goal,
+        "backstory": comercial_backstory,
+        "tools": agent_tools,
+        "llm_kwargs": wording_kwargs,
+        "function_calling_llm_kwargs": tool_args_kwargs,
+        "budget": budget_for(user_id),
+    }
+
+
+def get_agents(user_id, custom_prompt=None, user_email=None, appointment_duration=60, calendar_connected=False, target_remote_jid=None, request_id=None, api_key=None, route=None):
+    """
+    Create CrewAI agents with Gemini LLM.
+    user_id is actually the session_id (instance_1, instance_2, etc)
+    user_email is the user's email for Google Calendar integration
+    appointment_duration is the default duration for appointments in minutes
+    calendar_connected indicates if Google Calendar is connected for this user
+    target_remote_jid is the specific user phone number we are talking to (used to lock security)
+    request_id is a unique ID to track if message was sent (passed to tools)
+    api_key is the user's Gemini API Key
+    route is the ModelRoute (model_router.py) choosing the model tier of each step
+    """
+    profile = get_whatsapp_profile(
+        user_id, custom_prompt=custom_prompt, user_email=user_email, appointment_duration=appointment_duration,
+        calendar_connected=calendar_connected, target_remote_jid=target_remote_jid, request_id=request_id, api_key=api_key,
+        route=route,
+    )
+    # LLM separado (tier tool_args) para preencher argumentos das ferramentas, se o tier for outro
+    gemini_llm, function_calling_llm = build_llms(profile, request_id)
+
     # Commercial Agent (Uses WhatsApp + Calendar if connected)
     comercial = Agent(
-        role='Gerente Comercial / Atendente',
-        goal=comercial_goal,
-        backstory=comercial_backstory,
-        tools=agent_tools,
+        role=profile["role"],
+        goal=profile["goal"],
+        backstory=profile["backstory"],
+        tools=profile["tools"],
         llm=gemini_llm,
+        function_calling_llm=function_calling_llm,
+        max_iter=profile["budget"].llm_calls,
+        max_execution_time=profile["budget"].execution_seconds,
         verbose=True
     )
 
@@ -163,46 +245,24 @@ REGRAS DE CANCELAMENTO:
     return comercial, social_media, trafego
 
 
-def get_instagram_agent(user_id, custom_prompt=None, target_recipient_id=None, request_id=None):
+def get_instagram_profile(user_id, custom_prompt=None, target_recipient_id=None, request_id=None, route=None):
     """
-    Create a single agent for Instagram DM responses.
-    user_id is the user's email (connected account owner)
-    target_recipient_id is the customer ID to lock the tool to
-    request_id is a unique ID to track if message was sent
+    Role, goal, backstory, tools and LLM settings of the Instagram DM agent (engine independent).
+    Same arguments as get_instagram_agent.
     """
-    
-    gemini_llm = LLM(
-        model="gemini/gemini-2.5-flash",
-        temperature=0.7,
-        config={
-            "safety_settings": [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-            ]
-        }
-    )
-    
-    # LLM separado para function calling
-    function_calling_llm = LLM(
-        model="gemini/gemini-2.5-flash",
-        temperature=0.1,
-        config={
-            "safety_settings": [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-            ]
-        }
-    )
+    # Same as WhatsApp: safety_settings as a direct parameter (inside 'config' LiteLLM ignores it)
+    llm_kwargs = {
+        "model": "gemini/gemini-2.5-flash",
+        "temperature": 0.7,
+        "safety_settings": SAFETY_SETTINGS,
+    }
 
     instagram_tool = InstagramSendTool(user_id=user_id, default_recipient=target_recipient_id, request_id=request_id)
-    calendar_tool = GoogleCalendarTool(user_id=user_id)
-    reschedule_tool = GoogleCalendarRescheduleTool(user_id=user_id)
-    availability_tool = GoogleCalendarCheckAvailabilityTool(user_id=user_id)
-    list_slots_tool = GoogleCalendarListDaySlotsTool(user_id=user_id)
+    calendar_tool = GoogleCalendarTool(user_id=user_id, request_id=request_id)
+    reschedule_tool = GoogleCalendarRescheduleTool(user_id=user_id, request_id=request_id)
+    availability_tool = GoogleCalendarCheckAvailabilityTool(user_id=user_id, request_id=request_id)
+    list_slots_tool = GoogleCalendarListDaySlotsTool(user_id=user_id, request_id=request_id)
+    batch_query_tool = GoogleCalendarBatchQueryTool(user_id=user_id, request_id=request_id)
 
     backstory = 'Atendente experiente, empático e focado em ajudar o cliente.'
     goal = 'Atender clientes do Instagram DM com excelência.'
@@ -252,12 +312,40 @@ REAGENDAMENTO:
         backstory = f"Você é um agente de atendimento operando no Instagram DM. SUAS INSTRUÇÕES MESTRAS SÃO: {custom_prompt}. Siga estas instruções acima de tudo. IMPORTANTE: NUNCA use asteriscos (*), negrito (MD) ou bullet points. Para listar itens, use emojis ou apenas quebras de linha. O formato deve ser texto simples e limpo.{scheduling_instructions}"
         goal = "Atender o cliente seguindo estritamente as instruções fornecidas, sem usar formatação markdown."
 
+    agent_tools = [instagram_tool, calendar_tool, reschedule_tool, availability_tool, list_slots_tool, batch_query_tool]
+    note_tool_definitions(request_id, agent_tools)
+    wording_kwargs, tool_args_kwargs = routed_llm_kwargs(llm_kwargs, route)
+    return {
+        "role": 'Atendente Instagram',
+        "goal": goal,
+        "backstory": backstory,
+        "tools": agent_tools,
+        "llm_kwargs": wording_kwargs,
+        "function_calling_llm_kwargs": tool_args_kwargs,
+        "budget": budget_for(user_id),
+    }
+
+
+def get_instagram_agent(user_id, custom_prompt=None, target_recipient_id=None, request_id=None, route=None):
+    """
+    Create a single agent for Instagram DM responses.
+    user_id is the user's email (connected account owner)
+    target_recipient_id is the customer ID to lock the tool to
+    request_id is a unique ID to track if message was sent
+    route is the ModelRoute (model_router.py) choosing the model tier of each step
+    """
+    profile = get_instagram_profile(user_id, custom_prompt=custom_prompt, target_recipient_id=target_recipient_id, request_id=request_id, route=route)
+
+    gemini_llm, function_calling_llm = build_llms(profile, request_id)
+
     return Agent(
-        role='Atendente Instagram',
-        goal=goal,
-        backstory=backstory,
-        tools=[instagram_tool, calendar_tool, reschedule_tool, availability_tool, list_slots_tool],
+        role=profile["role"],
+        goal=profile["goal"],
+        backstory=profile["backstory"],
+        tools=profile["tools"],
         llm=gemini_llm,
         function_calling_llm=function_calling_llm,
+        max_iter=profile["budget"].llm_calls,
+        max_execution_time=profile["budget"].execution_seconds,
         verbose=True
     )
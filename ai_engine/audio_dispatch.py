@@ -0,0 +1,150 @@
+"""
+Envio assíncrono de áudio (TTS) com fallback para texto.
+
+A ferramenta 'Enviar Áudio WhatsApp' só registra o pedido e retorna na hora; a
+síntese e o envio acontecem aqui, fora da thread do agente. O backend recebe um
+deadlineAt: se a síntese terminar depois do orçamento de latência, o Node não
+envia o áudio (responde 409) e nós mandamos a versão em texto. O orçamento conta
+desde o despacho, não desde que um worker pegou o pedido: se ele já se esgotou
+na fila, o texto sai direto, sem tentar o áudio. O resultado de
+cada envio fica consultável em /audio/{id} e pode ser enviado a um callback.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import metrics
+import outbox
+from http_client import BackendCall, send_sync
+
+AUDIO_ASYNC = os.getenv("AUDIO_ASYNC", "1") == "1"
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", "2"))
+# Tempo máximo até o áudio sair; depois disso o cliente recebe o texto
+AUDIO_LATENCY_BUDGET_SECONDS = float(os.getenv("AUDIO_LATENCY_BUDGET_SECONDS", "12"))
+# Folga do timeout HTTP além do orçamento (o Node descarta o áudio atrasado sozinho)
+AUDIO_HTTP_GRACE_SECONDS = 2.0
+# Opcional: URL que recebe POST {id, state, ...} a cada envio concluído
+AUDIO_STATUS_CALLBACK_URL = os.getenv("AUDIO_STATUS_CALLBACK_URL")
+AUDIO_STATUS_RETENTION = 1000
+
+QUEUED, DELIVERED, FALLBACK_TEXT, FAILED = "queued", "delivered", "fallback_text", "failed"
+
+SEND_AUDIO_PATH = "/api/internal/whatsapp/send-audio"
+SEND_TEXT_PATH = "/api/internal/whatsapp/send-text"
+
+
+class AudioDispatcher:
+    def __init__(self):
+        self._pool = ThreadPoolExecutor(max_workers=AUDIO_WORKERS, thread_name_prefix="audio")
+        self._lock = threading.Lock()
+        self._statuses = OrderedDict()
+        # Listeners chamados com (dispatch_id, status) quando o envio termina
+        self.listeners = []
+
+    def dispatch(self, session_id: str, remote_jid: str, message: str, request_id: str = None) -> str:
+        """Agenda o envio do áudio e retorna o id do despacho imediatamente."""
+        dispatch_id = uuid.uuid4().hex[:12]
+        status = {
+            "id": dispatch_id,
+            "request_id": request_id,
+            "session_id": session_id,
+            "remote_jid": remote_jid,
+            "state": QUEUED,
+            "queued_at": time.time(),
+            "finished_at": None,
+            "error": None,
+        }
+        with self._lock:
+            self._statuses[dispatch_id] = status
+            while len(self._statuses) > AUDIO_STATUS_RETENTION:
+                self._statuses.popitem(last=False)
+        metrics.inc("audio_dispatched_total")
+        self._pool.submit(self._deliver, dispatch_id, session_id, remote_jid, message, request_id,
+                          status["queued_at"])
+        return dispatch_id
+
+    def status(self, dispatch_id: str):
+        with self._lock:
+            status = self._statuses.get(dispatch_id)
+            return dict(status) if status else None
+
+    def _deliver(self, dispatch_id, session_id, remote_jid, message, request_id, queued_at):
+        deadline_at = queued_at + AUDIO_LATENCY_BUDGET_SECONDS
+        remaining = deadline_at - time.time()
+        metrics.observe("audio_queue_wait_seconds", time.time() - queued_at)
+        if remaining <= 0:
+            metrics.inc("audio_expired_in_queue_total")
+            error = "orçamento de latência esgotado na fila"
+        else:
+            error = None
+            try:
+                response = send_sync(BackendCall("POST", SEND_AUDIO_PATH, json={
+                    "userId": session_id,
+                    "phoneNumber": remote_jid,
+                    "message": message,
+                    "deadlineAt": int(deadline_at * 1000),
+                }, timeout=remaining + AUDIO_HTTP_GRACE_SECONDS))
+                if response.status_code == 200:
+                    metrics.observe("audio_delivery_seconds", time.time() - queued_at)
+                    self._finish(dispatch_id, DELIVERED)
+                    return
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+            except Exception as e:
+                error = str(e)
+
+        print(f"⚠️ Áudio para {remote_jid} não saiu ({error}). Enviando versão em texto.")
+        self._finish(dispatch_id, self._send_text(session_id, remote_jid, message, request_id), error)
+
+    def _send_text(self, session_id, remote_jid, message, request_id) -> str:
+        payload = {"userId": session_id, "phoneNumber": remote_jid, "message": message}
+        try:
+            if outbox.OUTBOX_ENABLED:
+                outbox.get_outbox().enqueue("whatsapp", SEND_TEXT_PATH, f"whatsapp:{session_id}:{remote_jid}",
+                                            payload, request_id=request_id)
+            else:
+                response = send_sync(BackendCall("POST", SEND_TEXT_PATH, json=payload, timeout=30))
+                if response.status_code != 200:
+                    return FAILED
+            return FALLBACK_TEXT
+        except Exception as e:
+            print(f"❌ Fallback em texto também falhou para {remote_jid}: {e}")
+            return FAILED
+
+    def _finish(self, dispatch_id, state, error=None):
+        with self._lock:
+            status = self._statuses.get(dispatch_id)
+            if status is None:
+                return
+            status.update(state=state, finished_at=time.time(), error=error)
+            status = dict(status)
+        metrics.inc(f"audio_{state}_total")
+        for listener in list(self.listeners):
+            try:
+                listener(dispatch_id, status)
+            except Exception as e:
+                print(f"⚠️ Audio listener falhou: {e}")
+        if AUDIO_STATUS_CALLBACK_URL:
+            try:
+                requests.post(AUDIO_STATUS_CALLBACK_URL, json=status, timeout=5)
+            except Exception as e:
+                print(f"⚠️ Callback de status do áudio falhou: {e}")
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_audio_dispatcher() -> AudioDispatcher:
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = AudioDispatcher()
+        return _dispatcher
@@ -0,0 +1,143 @@
+"""
+Benchmark lado a lado: CrewAI x engine enxuto (lean_engine.py).
+
+Roda as mesmas mensagens gravadas (ver recorder.py) pelos dois engines com o
+Gemini REAL e as ferramentas servidas pela gravação (nada é enviado ao cliente
+nem escrito no calendário). Compara latência, chamadas ao LLM, tokens e taxa de
+sucesso (mensagem enviada ao cliente, sem erro).
+
+Uso:
+    GEMINI_API_KEY=... python benchmark_engines.py recordings/*.jsonl
+    GEMINI_API_KEY=... python benchmark_engines.py recordings/*.jsonl --repeat 3 --json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+if not (os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")):
+    sys.exit("benchmark_engines.py usa o Gemini real: defina GEMINI_API_KEY")
+
+# Nada sai do processo: avisos do engine e fallbacks não vão para o outbox, nem as execuções são gravadas
+os.environ.setdefault("OUTBOX_ENABLED", "0")
+os.environ.setdefault("RECORD_CONVERSATIONS", "0")
+os.environ.setdefault("OVERLOAD_CONTROL", "0")
+
+import instrumentation
+import lean_engine
+import tools
+from recorder import load_recording, replay_payload
+from replay import ReplayStubs
+
+ENGINES = (lean_engine.ENGINE_CREWAI, lean_engine.ENGINE_LEAN)
+
+
+async def run_once(path, engine):
+    from main import handle_whatsapp_message, handle_instagram_message, MessageInput, InstagramMessageInput
+
+    events = load_recording(path)
+    payload = replay_payload(events)
+    stubs = ReplayStubs(events)
+    summaries = []
+
+    lean_engine.FORCE_ENGINE = engine
+    tools.TOOL_STUB = stubs.tool
+    instrumentation.RUN_SUMMARY_LISTENERS.append(summaries.append)
+    started = time.monotonic()
+    error = None
+    try:
+        if "senderId" in payload:
+            await handle_instagram_message(InstagramMessageInput(**payload))
+        else:
+            await handle_whatsapp_message(MessageInput(**payload))
+    except Exception as e:
+        error = getattr(e, "detail", None) or str(e)
+    finally:
+        lean_engine.FORCE_ENGINE = None
+        tools.TOOL_STUB = None
+        instrumentation.RUN_SUMMARY_LISTENERS.remove(summaries.append)
+
+    summary = summaries[-1] if summaries else {}
+    return {
+        "file": os.path.basename(path),
+        "engine": engine,
+        "wall_seconds": round(time.monotonic() - started, 3),
+        "llm_calls": summary.get("llm_calls", 0),
+        "input_tokens": summary.get("input_tokens", 0),
+        "output_tokens": summary.get("output_tokens", 0),
+        "tool_calls": summary.get("tool_calls", 0),
+        "success": bool(summary.get("sent")) and not error,
+        "error": str(error)[:200] if error else None,
+    }
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))] if values else None
+
+
+def aggregate(rows):
+    report = {}
+    for engine in ENGINES:
+        runs = [r for r in rows if r["engine"] == engine]
+        if not runs:
+            continue
+        walls = [r["wall_seconds"] for r in runs]
+        report[engine] = {
+            "runs": len(runs),
+            "success_rate": round(sum(r["success"] for r in runs) / len(runs), 3),
+            "wall_p50": _percentile(walls, 50),
+            "wall_p95": _percentile(walls, 95),
+            "wall_avg": round(sum(walls) / len(walls), 3),
+            "llm_calls_avg": round(sum(r["llm_calls"] for r in runs) / len(runs), 2),
+            "input_tokens_avg": round(sum(r["input_tokens"] for r in runs) / len(runs)),
+            "output_tokens_avg": round(sum(r["output_tokens"] for r in runs) / len(runs)),
+        }
+    return report
+
+
+def print_report(rows, report):
+    header = f"{'conversa':<32} {'engine':<7} {'wall_s':>7} {'llm':>4} {'in_tok':>8} {'out_tok':>8} {'tools':>5}  status"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        status = "ok" if r["success"] else f"FALHA: {r['error'] or 'mensagem não enviada'}"[:60]
+        print(f"{r['file'][:32]:<32} {r['engine']:<7} {r['wall_seconds']:>7} {r['llm_calls']:>4} "
+              f"{r['input_tokens']:>8} {r['output_tokens']:>8} {r['tool_calls']:>5}  {status}")
+    print("-" * len(header))
+    for engine, stats in report.items():
+        print(f"{engine:<7} runs={stats['runs']} sucesso={stats['success_rate']:.0%} "
+              f"wall p50={stats['wall_p50']}s p95={stats['wall_p95']}s "
+              f"llm/run={stats['llm_calls_avg']} tokens/run={stats['input_tokens_avg']}/{stats['output_tokens_avg']}")
+    if len(report) == 2:
+        crew, lean = report[lean_engine.ENGINE_CREWAI], report[lean_engine.ENGINE_LEAN]
+        if crew["wall_p50"] and crew["input_tokens_avg"]:
+            print(f"lean vs crewai: wall p50 {lean['wall_p50'] / crew['wall_p50']:.2f}x | "
+                  f"tokens entrada {lean['input_tokens_avg'] / crew['input_tokens_avg']:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CrewAI x engine enxuto sobre conversas gravadas")
+    parser.add_argument("recordings", nargs="+")
+    parser.add_argument("--repeat", type=int, default=1, help="Execuções por conversa e engine")
+    parser.add_argument("--json", action="store_true", help="Imprime o resultado em JSON")
+    args = parser.parse_args()
+
+    rows = []
+    for path in args.recordings:
+        for _ in range(args.repeat):
+            # Alterna a ordem para não favorecer o engine que roda com conexões já aquecidas
+            for engine in (ENGINES if len(rows) % 4 == 0 else reversed(ENGINES)):
+                rows.append(asyncio.run(run_once(path, engine)))
+
+    report = aggregate(rows)
+    if args.json:
+        json.dump({"runs": rows, "summary": report}, sys.stdout, ensure_ascii=False, indent=2)
+    else:
+        print_report(rows, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Benchmark da primeira chamada LLM de cada conversa: pool novo x transporte compartilhado.
+
+Sobe um servidor HTTPS local (certificado autoassinado gerado com o openssl) que
+imita o generateContent do Gemini, com atraso de rede simulado: cada conexão
+nova paga 2 RTTs (TCP + TLS 1.3) e cada requisição 1 RTT mais o tempo de
+"geração". Mede, para N conversas seguidas, a latência da primeira chamada:
+
+  - fresh:  cliente httpx novo por conversa (o que acontecia com LLMs montados
+            por requisição): handshake TCP+TLS no caminho crítico;
+  - shared: o pool do processo (llm_transport.client_options), já aquecido: a
+            conexão ociosa é reaproveitada.
+
+O servidor local só fala HTTP/1.1; o ganho do HTTP/2 (multiplexar chamadas
+paralelas numa conexão) não aparece aqui.
+
+Uso:
+    python benchmark_transport.py
+    python benchmark_transport.py --conversations 50 --rtt-ms 60 --json
+"""
+import argparse
+import json
+import os
+import shutil
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import llm_transport
+
+if llm_transport.httpx is None:
+    sys.exit("benchmark_transport.py precisa do httpx (pip install httpx)")
+if shutil.which("openssl") is None:
+    sys.exit("benchmark_transport.py precisa do openssl para gerar o certificado local")
+
+import httpx
+
+GEMINI_RESPONSE = {
+    "candidates": [{"content": {"role": "model", "parts": [{"text": "Olá! Como posso ajudar?"}]}, "finishReason": "STOP"}],
+    "usageMetadata": {"promptTokenCount": 900, "candidatesTokenCount": 12, "totalTokenCount": 912},
+}
+
+
+def make_certificate(directory: str):
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+         "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1", "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+class _GeminiStandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(self.server.rtt + self.server.generation)
+        body = json.dumps(GEMINI_RESPONSE).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _TLSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, context, rtt, generation):
+        super().__init__(("127.0.0.1", 0), _GeminiStandIn)
+        self.context = context
+        self.rtt = rtt
+        self.generation = generation
+        self.connections = 0
+
+    def get_request(self):
+        sock, address = self.socket.accept()
+        self.connections += 1
+        # Conexão nova: 1 RTT do TCP + 1 RTT do TLS 1.3 antes do handshake local
+        time.sleep(2 * self.rtt)
+        return self.context.wrap_socket(sock, server_side=True), address
+
+
+def start_server(cert, key, rtt, generation):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server = _TLSServer(context, rtt, generation)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def first_call(client, url) -> float:
+    started = time.perf_counter()
+    response = client.post(url, json={"contents": [{"role": "user", "parts": [{"text": "Oi"}]}]})
+    response.raise_for_status()
+    return time.perf_counter() - started
+
+
+def run(mode, url, cert, conversations):
+    options = llm_transport.client_options(verify=cert)
+    latencies = []
+    if mode == "fresh":
+        for _ in range(conversations):
+            with httpx.Client(**options) as client:
+                latencies.append(first_call(client, url))
+        return latencies
+    with httpx.Client(**options) as client:
+        first_call(client, url)   # o pool do processo já está aquecido quando a conversa chega
+        for _ in range(conversations):
+            latencies.append(first_call(client, url))
+    return latencies
+
+
+def summarize(latencies) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 1),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latência da primeira chamada LLM: pool novo x compartilhado")
+    parser.add_argument("--conversations", type=int, default=30)
+    parser.add_argument("--rtt-ms", type=float, default=40, help="RTT simulado até o endpoint")
+    parser.add_argument("--generation-ms", type=float, default=0, help="Tempo de geração simulado por chamada")
+    parser.add_argument("--json", action="store_true", help="Imprime o resultado em JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_certificate(directory)
+        server = start_server(cert, key, args.rtt_ms / 1000, args.generation_ms / 1000)
+        url = f"https://localhost:{server.server_address[1]}/v1beta/models/gemini-2.5-flash:generateContent"
+        report = {}
+        try:
+            for mode in ("fresh", "shared"):
+                before = server.connections
+                report[mode] = {**summarize(run(mode, url, cert, args.conversations)),
+                                "connections": server.connections - before}
+        finally:
+            server.shutdown()
+
+    report["saved_p50_ms"] = round(report["fresh"]["p50_ms"] - report["shared"]["p50_ms"], 1)
+    report["rtt_ms"] = args.rtt_ms
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        return
+    print(f"{'modo':<8} {'conexões':>9} {'média':>9} {'p50':>9} {'p95':>9}  (primeira chamada, RTT {args.rtt_ms}ms)")
+    for mode in ("fresh", "shared"):
+        stats = report[mode]
+        print(f"{mode:<8} {stats['connections']:>9} {stats['mean_ms']:>8}ms {stats['p50_ms']:>8}ms {stats['p95_ms']:>8}ms")
+    print(f"Economia na primeira chamada (p50): {report['saved_p50_ms']}ms por conversa")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Orçamentos por execução: chamadas ao LLM, tokens e chamadas por ferramenta.
+
+Um agente confuso pode repetir consultas de disponibilidade até o timeout e
+ainda ser retentado. Cada requisição recebe um RunBudget (ver budget_for) que
+vale para a execução inteira, incluindo tentativas e o crew de retry forçado:
+  - chamadas LLM e tokens: ao estourar, a próxima chamada levanta
+    BudgetExceeded e a execução é abortada (main.py avisa o cliente);
+  - chamadas por ferramenta: ao estourar, a ferramenta não roda e devolve ao
+    agente uma instrução para responder com o que já sabe.
+O Agent do CrewAI também recebe max_iter e max_execution_time do orçamento.
+
+Configuração:
+    RUN_MAX_LLM_CALLS=12
+    RUN_MAX_TOKENS=80000                  entrada + saída
+    RUN_MAX_TOOL_CALLS=6                  por ferramenta
+    RUN_MAX_EXECUTION_SECONDS=90          max_execution_time do Agent
+    TENANT_RUN_BUDGETS='{"instance_1": {"llm_calls": 8, "tool_calls": {"Verificar Disponibilidade": 3}}}'
+"""
+import json
+import os
+from dataclasses import dataclass, field, replace
+
+import metrics
+
+RUN_MAX_LLM_CALLS = int(os.getenv("RUN_MAX_LLM_CALLS", "12"))
+RUN_MAX_TOKENS = int(os.getenv("RUN_MAX_TOKENS", "80000"))
+RUN_MAX_TOOL_CALLS = int(os.getenv("RUN_MAX_TOOL_CALLS", "6"))
+RUN_MAX_EXECUTION_SECONDS = int(os.getenv("RUN_MAX_EXECUTION_SECONDS", "90"))
+
+# Fração do orçamento a partir da qual o resumo da execução é destacado no log
+BUDGET_WARN_RATIO = 0.8
+
+BUDGET_ABORT_MESSAGE = os.getenv(
+    "BUDGET_ABORT_MESSAGE",
+    "Desculpe, não consegui concluir seu atendimento agora. Pode me enviar sua última mensagem novamente?",
+)
+
+
+@dataclass(frozen=True)
+class RunBudget:
+    llm_calls: int = RUN_MAX_LLM_CALLS
+    tokens: int = RUN_MAX_TOKENS
+    tool_calls: int = RUN_MAX_TOOL_CALLS
+    per_tool: dict = field(default_factory=dict)   # nome da ferramenta -> limite próprio
+    execution_seconds: int = RUN_MAX_EXECUTION_SECONDS
+
+    def tool_limit(self, name: str) -> int:
+        return self.per_tool.get(name, self.tool_calls)
+
+
+class BudgetExceeded(Exception):
+    """A execução consumiu todo o orçamento de chamadas LLM ou de tokens."""
+
+    def __init__(self, kind: str, used=None, limit=None):
+        detail = f" {used}/{limit}" if limit is not None else ""
+        super().__init__(f"Orçamento da execução esgotado: {kind}{detail}")
+        self.kind = kind
+
+
+def _load_tenant_budgets() -> dict:
+    raw = os.getenv("TENANT_RUN_BUDGETS", "")
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError as e:
+        print(f"⚠️ TENANT_RUN_BUDGETS inválido, usando os limites padrão: {e}")
+        return {}
+
+
+TENANT_RUN_BUDGETS = _load_tenant_budgets()
+
+
+def budget_for(tenant_id: str) -> RunBudget:
+    custom = TENANT_RUN_BUDGETS.get(tenant_id) or {}
+    budget = RunBudget()
+    if "llm_calls" in custom:
+        budget = replace(budget, llm_calls=int(custom["llm_calls"]))
+    if "tokens" in custom:
+        budget = replace(budget, tokens=int(custom["tokens"]))
+    if "execution_seconds" in custom:
+        budget = replace(budget, execution_seconds=int(custom["execution_seconds"]))
+    tool_calls = custom.get("tool_calls")
+    if isinstance(tool_calls, dict):
+        budget = replace(budget, per_tool={name: int(limit) for name, limit in tool_calls.items()})
+    elif tool_calls is not None:
+        budget = replace(budget, tool_calls=int(tool_calls))
+    return budget
+
+
+def _exceeded(state: dict, kind: str, used, limit):
+    if not state.get("budget_exceeded"):
+        state["budget_exceeded"] = kind
+        metrics.inc("run_budget_exceeded_total", kind=kind, channel=state.get("channel") or "unknown")
+        print(f"⛔ Orçamento da execução esgotado: {kind} {used}/{limit}")
+
+
+def check_llm(state: dict):
+    """Antes de cada chamada LLM: levanta BudgetExceeded se não sobra orçamento."""
+    budget = state.get("budget") if state else None
+    if budget is None:
+        return
+    tokens = state.get("input_tokens", 0) + state.get("output_tokens", 0)
+    if state.get("llm_calls", 0) >= budget.llm_calls:
+        _exceeded(state, "llm_calls", state["llm_calls"], budget.llm_calls)
+        raise BudgetExceeded("llm_calls", state["llm_calls"], budget.llm_calls)
+    if tokens >= budget.tokens:
+        _exceeded(state, "tokens", tokens, budget.tokens)
+        raise BudgetExceeded("tokens", tokens, budget.tokens)
+
+
+def reserve_tool(state: dict, name: str):
+    """
+    Antes de cada ferramenta: conta a chamada e devolve None, ou a mensagem para o
+    agente quando o limite da ferramenta já foi atingido (a ferramenta não roda).
+    """
+    budget = state.get("budget") if state else None
+    if budget is None:
+        return None
+    counts = state.setdefault("tool_counts", {})
+    limit = budget.tool_limit(name)
+    if counts.get(name, 0) >= limit:
+        metrics.inc("run_tool_budget_refused_total", tool=name)
+        if not state.get("tool_budget_exceeded"):
+            state["tool_budget_exceeded"] = name
+            print(f"⛔ Limite de chamadas de '{name}' atingido ({limit}) nesta execução")
+        return (
+            f"⛔ Limite de uso da ferramenta '{name}' atingido nesta conversa. NÃO use esta ferramenta "
+            "novamente: responda ao cliente agora com as informações que você já tem."
+        )
+    counts[name] = counts.get(name, 0) + 1
+    return None
+
+
+def usage(state: dict) -> dict:
+    """Consumo da execução contra o orçamento (para o resumo da execução)."""
+    budget = state.get("budget")
+    if budget is None:
+        return {}
+    counts = state.get("tool_counts", {})
+    tokens = state.get("input_tokens", 0) + state.get("output_tokens", 0)
+    top_tool = max(counts, key=lambda name: counts[name] / max(budget.tool_limit(name), 1), default=None)
+    ratios = [state.get("llm_calls", 0) / max(budget.llm_calls, 1), tokens / max(budget.tokens, 1)]
+    if top_tool:
+        ratios.append(counts[top_tool] / max(budget.tool_limit(top_tool), 1))
+    return {
+        "llm_calls": f"{state.get('llm_calls', 0)}/{budget.llm_calls}",
+        "tokens": f"{tokens}/{budget.tokens}",
+        "top_tool": f"{top_tool} {counts[top_tool]}/{budget.tool_limit(top_tool)}" if top_tool else None,
+        "max_ratio": round(max(ratios), 3),
+    }
@@ -0,0 +1,265 @@
+"""
+Bulkheads: vagas de concorrência isoladas por dependência do backend Node.
+
+Todas as chamadas das ferramentas disputavam as mesmas threads e o mesmo pool
+de conexões: quando o Google Calendar ficava lento, as conversas de agendamento
+prendiam tudo e até a resposta de um "oi" pelo send-text ficava parada. Agora
+cada BackendCall passa pelo bulkhead da sua dependência (http_client):
+
+  - messaging:       send-text / send-dm (ferramentas, outbox, envio forçado)
+  - calendar_read:   consultas à agenda (disponibilidade, horários, eventos, regras)
+  - calendar_write:  agendar, reagendar, cancelar
+  - audio:           send-audio
+  - backend:         o resto
+
+Cada um tem limite de chamadas simultâneas, fila limitada, espera máxima na
+fila (também limitada pelo prazo da requisição), timeout HTTP padrão e um pool
+de conexões síncrono próprio. Fila cheia ou espera esgotada falham na hora com
+BulkheadFull, cuja mensagem o agente transforma em "tente de novo em instantes";
+nada foi enviado ao backend.
+
+Configuração:
+    BULKHEADS='{"calendar_read": {"max_concurrent": 4, "max_queue": 8}}'
+        por bulkhead: max_concurrent, max_queue, queue_timeout (s), timeout (s)
+"""
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+
+MESSAGING = "messaging"
+CALENDAR_READ = "calendar_read"
+CALENDAR_WRITE = "calendar_write"
+AUDIO = "audio"
+BACKEND = "backend"
+
+DEFAULT_BULKHEADS = {
+    MESSAGING: {"max_concurrent": 16, "max_queue": 64, "queue_timeout": 2.0, "timeout": 15.0},
+    CALENDAR_READ: {"max_concurrent": 8, "max_queue": 16, "queue_timeout": 1.0, "timeout": 10.0},
+    CALENDAR_WRITE: {"max_concurrent": 4, "max_queue": 8, "queue_timeout": 2.0, "timeout": 20.0},
+    AUDIO: {"max_concurrent": 4, "max_queue": 8, "queue_timeout": 2.0, "timeout": 60.0},
+    BACKEND: {"max_concurrent": 8, "max_queue": 32, "queue_timeout": 2.0, "timeout": 15.0},
+}
+
+# O que ficou sem vaga, nas mensagens para o agente
+_LABELS = {
+    MESSAGING: "enviar mensagens",
+    CALENDAR_READ: "consultar a agenda",
+    CALENDAR_WRITE: "alterar a agenda",
+    AUDIO: "enviar áudio",
+    BACKEND: "chamar o serviço",
+}
+
+CALENDAR_PREFIX = "/api/google-calendar/"
+CALENDAR_WRITE_ROUTES = {"schedule-appointment", "reschedule-appointment", "cancel-appointment"}
+MESSAGING_PREFIXES = ("/api/internal/whatsapp/", "/api/internal/instagram/")
+AUDIO_PATHS = {"/api/internal/whatsapp/send-audio"}
+
+
+def _load_config() -> dict:
+    config = {name: dict(limits) for name, limits in DEFAULT_BULKHEADS.items()}
+    raw = os.getenv("BULKHEADS", "")
+    if not raw:
+        return config
+    try:
+        for name, limits in json.loads(raw).items():
+            config[name] = {**config.get(name, DEFAULT_BULKHEADS[BACKEND]), **limits}
+    except (json.JSONDecodeError, AttributeError, TypeError) as e:
+        print(f"⚠️ BULKHEADS inválido, usando o padrão: {e}")
+    return config
+
+
+BULKHEADS = _load_config()
+
+
+def classify(method: str, path: str) -> str:
+    """Bulkhead de uma chamada ao backend pela rota."""
+    if path in AUDIO_PATHS:
+        return AUDIO
+    if path.startswith(CALENDAR_PREFIX):
+        route = path[len(CALENDAR_PREFIX):].split("?")[0]
+        return CALENDAR_WRITE if route in CALENDAR_WRITE_ROUTES else CALENDAR_READ
+    if path.startswith(MESSAGING_PREFIXES):
+        return MESSAGING
+    return BACKEND
+
+
+class BulkheadFull(ConnectionError):
+    """Sem vaga no bulkhead (fila cheia ou espera esgotada): a chamada nem foi feita."""
+
+    def __init__(self, name: str, reason: str, retry_after: float):
+        super().__init__(
+            f"Sem capacidade agora para {_LABELS.get(name, _LABELS[BACKEND])}: a ação NÃO foi feita. "
+            f"Tente de novo em instantes; se precisar, diga ao cliente que já vai verificar."
+        )
+        self.bulkhead = name
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("event", "loop", "future", "granted")
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.future = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+        self.granted = False
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class Bulkhead:
+    """Semáforo com fila limitada, usado tanto por threads quanto pelo event loop (ordem de chegada)."""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float, timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.in_flight = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _publish(self):
+        metrics.set_gauge("bulkhead_in_flight", self.in_flight, bulkhead=self.name)
+        metrics.set_gauge("bulkhead_queued", len(self._waiters), bulkhead=self.name)
+
+    def _reject(self, reason: str):
+        metrics.inc("bulkhead_rejected_total", bulkhead=self.name, reason=reason)
+        raise BulkheadFull(self.name, reason, self.queue_timeout)
+
+    def _enter(self, waiter: _Waiter) -> bool:
+        """True se pegou vaga na hora; False se entrou na fila. Fila cheia: BulkheadFull."""
+        with self._lock:
+            if self.in_flight < self.max_concurrent and not self._waiters:
+                self.in_flight += 1
+                entered = True
+            elif len(self._waiters) >= self.max_queue:
+                entered = None
+            else:
+                self._waiters.append(waiter)
+                entered = False
+        self._publish()
+        if entered is None:
+            self._reject("queue_full")
+        return entered
+
+    def _leave_queue(self, waiter: _Waiter) -> bool:
+        """Desiste da espera; False se a vaga já tinha sido entregue a este waiter."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._waiters.remove(waiter)
+        self._publish()
+        return True
+
+    def release(self):
+        with self._lock:
+            waiter = self._waiters.popleft() if self._waiters else None
+            if waiter is None:
+                self.in_flight -= 1
+            else:
+                waiter.granted = True   # a vaga passa direto para o próximo da fila
+        self._publish()
+        if waiter is not None:
+            try:
+                waiter.wake()
+            except RuntimeError:
+                # Loop do waiter já fechou: ninguém vai usar a vaga
+                self.release()
+
+    def acquire(self, wait: float = None):
+        """Pega uma vaga esperando até `wait` segundos (padrão: queue_timeout)."""
+        wait = self.queue_timeout if wait is None else wait
+        started = time.monotonic()
+        waiter = _Waiter()
+        if not self._enter(waiter):
+            if not waiter.event.wait(wait) and self._leave_queue(waiter):
+                self._reject("timeout")
+        metrics.observe("bulkhead_wait_seconds", time.monotonic() - started, bulkhead=self.name)
+
+    async def aacquire(self, wait: float = None):
+        wait = self.queue_timeout if wait is None else wait
+        started = time.monotonic()
+        waiter = _Waiter(asyncio.get_running_loop())
+        if not self._enter(waiter):
+            try:
+                await asyncio.wait_for(waiter.future, wait)
+            except asyncio.TimeoutError:
+                if self._leave_queue(waiter):
+                    self._reject("timeout")
+            except asyncio.CancelledError:
+                if not self._leave_queue(waiter):
+                    self.release()
+                raise
+        metrics.observe("bulkhead_wait_seconds", time.monotonic() - started, bulkhead=self.name)
+
+    @contextlib.contextmanager
+    def slot(self, wait: float = None):
+        self.acquire(wait)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    @contextlib.asynccontextmanager
+    async def aslot(self, wait: float = None):
+        await self.aacquire(wait)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        queued = len(self._waiters)
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": queued,
+            "utilization": metrics.ratio(self.in_flight, self.max_concurrent),
+            "saturation": metrics.ratio(self.in_flight + queued, self.max_concurrent),
+            "rejected": {
+                reason: metrics.counter("bulkhead_rejected_total", bulkhead=self.name, reason=reason)
+                for reason in ("queue_full", "timeout")
+            },
+        }
+
+
+_bulkheads = {}
+_bulkheads_lock = threading.Lock()
+
+
+def get_bulkhead(name: str) -> Bulkhead:
+    with _bulkheads_lock:
+        bulkhead = _bulkheads.get(name)
+        if bulkhead is None:
+            limits = BULKHEADS.get(name, BULKHEADS[BACKEND])
+            bulkhead = _bulkheads[name] = Bulkhead(name, **limits)
+        return bulkhead
+
+
+def stats() -> dict:
+    return {name: get_bulkhead(name).stats() for name in BULKHEADS}
+
+
+metrics.register_derived("bulkheads", stats)
@@ -0,0 +1,170 @@
+"""
+Circuit breakers das dependências externas (backend Node e LLM).
+
+Cada breaker guarda os resultados recentes das chamadas (janela de
+CIRCUIT_WINDOW_SECONDS) e abre quando a taxa de erro passa de
+CIRCUIT_ERROR_RATE (com pelo menos CIRCUIT_MIN_CALLS chamadas na janela) ou
+após CIRCUIT_CONSECUTIVE_FAILURES falhas seguidas. Aberto, ele recusa chamadas
+por CIRCUIT_COOLDOWN_SECONDS; depois deixa passar uma chamada de teste
+(half_open) que fecha o circuito se der certo ou o reabre se falhar.
+
+  - backend:<bulkhead>: um por bulkhead do http_client.py (backend:messaging,
+    backend:calendar_read...); com o circuito aberto as chamadas daquela
+    dependência falham na hora com BackendUnavailable (o flow da ferramenta
+    trata como erro de conexão) em vez de esperar o timeout de um backend fora
+    do ar, e as das outras seguem normalmente;
+  - llm: alimentado por instrumentation.record_llm_call; só sinaliza (o /ready do
+    readiness.py fica indisponível), as chamadas continuam com retry/escalada.
+
+Configuração:
+    CIRCUIT_WINDOW_SECONDS=60
+    CIRCUIT_MIN_CALLS=10
+    CIRCUIT_ERROR_RATE=0.5
+    CIRCUIT_CONSECUTIVE_FAILURES=5
+    CIRCUIT_COOLDOWN_SECONDS=30
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))
+CIRCUIT_CONSECUTIVE_FAILURES = int(os.getenv("CIRCUIT_CONSECUTIVE_FAILURES", "5"))
+CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("CIRCUIT_COOLDOWN_SECONDS", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, window: float = CIRCUIT_WINDOW_SECONDS, min_calls: int = CIRCUIT_MIN_CALLS,
+                 error_rate: float = CIRCUIT_ERROR_RATE, consecutive: int = CIRCUIT_CONSECUTIVE_FAILURES,
+                 cooldown: float = CIRCUIT_COOLDOWN_SECONDS):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.max_error_rate = error_rate
+        self.consecutive = consecutive
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._outcomes = deque()   # (monotonic, ok)
+        self._failures_in_row = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._publish()
+
+    def _trim(self, now: float):
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+
+    def _set_state(self, state: str):
+        if state == self._state:
+            return
+        print(f"🔌 Circuito {self.name}: {self._state} -> {state}")
+        metrics.inc("circuit_transitions_total", circuit=self.name, to=state)
+        self._state = state
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge("circuit_open", int(self._state != CLOSED), circuit=self.name)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Se a chamada pode seguir. Em half_open só passa uma chamada de teste por vez."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    metrics.inc("circuit_rejected_total", circuit=self.name)
+                    return False
+                self._set_state(HALF_OPEN)
+            if self._probing:
+                metrics.inc("circuit_rejected_total", circuit=self.name)
+                return False
+            self._probing = True
+            return True
+
+    def record(self, ok: bool):
+        now = time.monotonic()
+        with self._lock:
+            self._outcomes.append((now, ok))
+            self._trim(now)
+            self._failures_in_row = 0 if ok else self._failures_in_row + 1
+            if self._state == OPEN and now - self._opened_at >= self.cooldown:
+                # Breaker só de sinalização (sem allow()): a primeira chamada depois do cooldown é o teste
+                self._set_state(HALF_OPEN)
+            if self._state == HALF_OPEN or self._probing:
+                self._probing = False
+                if ok:
+                    self._outcomes.clear()
+                    self._set_state(CLOSED)
+                else:
+                    self._open(now)
+                return
+            if self._state == CLOSED and not ok and self._tripped():
+                self._open(now)
+
+    def abandon(self):
+        """A chamada liberada por allow() foi cancelada sem resultado."""
+        with self._lock:
+            self._probing = False
+
+    def _tripped(self) -> bool:
+        if self._failures_in_row >= self.consecutive:
+            return True
+        calls = len(self._outcomes)
+        return calls >= self.min_calls and self._errors() / calls >= self.max_error_rate
+
+    def _errors(self) -> int:
+        return sum(1 for _, ok in self._outcomes if not ok)
+
+    def _open(self, now: float):
+        self._opened_at = now
+        self._set_state(OPEN)
+
+    def error_rate(self):
+        """Taxa de erro na janela recente, ou None sem chamadas."""
+        with self._lock:
+            self._trim(time.monotonic())
+            calls = len(self._outcomes)
+            return round(self._errors() / calls, 4) if calls else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._trim(time.monotonic())
+            calls = len(self._outcomes)
+            errors = self._errors()
+        return {
+            "state": self.state,
+            "calls": calls,
+            "errors": errors,
+            "error_rate": round(errors / calls, 4) if calls else None,
+        }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+metrics.register_derived("circuits", lambda: {name: breaker.stats() for name, breaker in list(_breakers.items())})
@@ -0,0 +1,131 @@
+"""
+Cache de histórico por conversa e de configuração por tenant (protocolo delta).
+
+O backend Node só precisa mandar o histórico e a configuração completos na
+primeira mensagem (ou após um cache miss). Nas seguintes ele envia:
+  - historyBaseVersion + historyDrop + historyAppend + historyVersion:
+    o histórico é reconstruído a partir da versão em cache (descarta as
+    `historyDrop` mensagens mais antigas da janela e acrescenta as novas) e
+    conferido contra historyVersion;
+  - configVersion sem os campos de configuração.
+Se a versão não estiver em cache (restart, expiração, divergência), o webhook
+responde 409 {"reason": "cache_miss"} e o Node reenvia o payload completo.
+
+O hash de histórico deve ser idêntico ao de backend/src/utils/webhookDelta.js.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+HISTORY_CACHE_MAX_ENTRIES = int(os.getenv("HISTORY_CACHE_MAX_ENTRIES", "5000"))
+CONFIG_CACHE_MAX_ENTRIES = int(os.getenv("CONFIG_CACHE_MAX_ENTRIES", "1000"))
+DELTA_CACHE_TTL_SECONDS = float(os.getenv("DELTA_CACHE_TTL_SECONDS", str(6 * 3600)))
+
+# Campos do MessageInput que fazem parte da configuração do tenant
+WHATSAPP_CONFIG_FIELDS = (
+    "agentPrompt", "userEmail", "appointmentDuration", "serviceType",
+    "businessAddress", "calendarConnected", "apiKey",
+)
+INSTAGRAM_CONFIG_FIELDS = ("agentPrompt",)
+
+
+class DeltaCacheMiss(Exception):
+    def __init__(self, what: str):
+        super().__init__(f"{what} não está em cache")
+        self.what = what
+
+
+def history_version(items) -> str:
+    """sha256 de 'role\\0content\\1' de cada item, truncado em 16 hex."""
+    digest = hashlib.sha256()
+    for item in items:
+        role = item["role"] if isinstance(item, dict) else item.role
+        content = item["content"] if isinstance(item, dict) else item.content
+        digest.update(f"{role}\u0000{content}\u0001".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+class VersionedCache:
+    """LRU com TTL que guarda uma única versão (hash) por chave."""
+
+    def __init__(self, max_entries: int, ttl: float = DELTA_CACHE_TTL_SECONDS):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or time.monotonic() - entry[2] > self._ttl:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (version, value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_history_cache = VersionedCache(HISTORY_CACHE_MAX_ENTRIES)
+_config_cache = VersionedCache(CONFIG_CACHE_MAX_ENTRIES)
+
+
+def resolve_history(data, conversation_key: str):
+    """Preenche data.history a partir do cache (delta) ou guarda o histórico completo recebido."""
+    if data.historyBaseVersion:
+        base = _history_cache.get(conversation_key, data.historyBaseVersion)
+        if base is None:
+            metrics.inc("webhook_delta_total", kind="history", outcome="miss")
+            raise DeltaCacheMiss("history")
+        history = list(base[data.historyDrop or 0:]) + list(data.historyAppend or [])
+        if data.historyVersion and history_version(history) != data.historyVersion:
+            metrics.inc("webhook_delta_total", kind="history", outcome="mismatch")
+            raise DeltaCacheMiss("history")
+        data.history = history
+        metrics.inc("webhook_delta_total", kind="history", outcome="hit")
+    elif data.history is not None:
+        metrics.inc("webhook_delta_total", kind="history", outcome="full")
+
+    if data.history is not None:
+        version = history_version(data.history)
+        if data.historyVersion and data.historyVersion != version:
+            print(f"⚠️ historyVersion divergente do hash local ({data.historyVersion} != {version}); deltas vão falhar")
+        _history_cache.put(conversation_key, version, list(data.history))
+
+
+def resolve_config(data, tenant_key: str, fields):
+    """Preenche os campos de configuração a partir de configVersion, ou guarda os recebidos."""
+    if not data.configVersion:
+        return
+    sent = [name for name in fields if name in data.model_fields_set]
+    if sent:
+        _config_cache.put(tenant_key, data.configVersion, {name: getattr(data, name) for name in fields})
+        metrics.inc("webhook_delta_total", kind="config", outcome="full")
+        return
+    config = _config_cache.get(tenant_key, data.configVersion)
+    if config is None:
+        metrics.inc("webhook_delta_total", kind="config", outcome="miss")
+        raise DeltaCacheMiss("config")
+    for name, value in config.items():
+        setattr(data, name, value)
+    metrics.inc("webhook_delta_total", kind="config", outcome="hit")
+
+
+def resolve_delta(data, conversation_key: str, tenant_key: str, config_fields):
+    resolve_config(data, tenant_key, config_fields)
+    resolve_history(data, conversation_key)
+
+
+def cache_stats() -> dict:
+    return {"conversations": len(_history_cache), "tenants": len(_config_cache)}
@@ -0,0 +1,132 @@
+"""
+Prazo de ponta a ponta por requisição.
+
+Cada webhook ganha um Deadline (instante absoluto, relógio monotônico) definido
+por, em ordem de prioridade:
+  - deadlineAt do webhook (epoch em ms),
+  - receivedAt do webhook (epoch em ms, quando o Node recebeu a primeira
+    mensagem do buffer) + SLA do tenant,
+  - agora + SLA do tenant.
+
+O prazo é propagado para todas as etapas: tentativas do crew (run_crew_with_retry),
+timeout de cada chamada LLM (instrumentation.instrument_llm), timeout HTTP de
+cada ferramenta (http_client.run_flow/arun_flow) e a decisão do crew de retry
+forçado. Nenhuma etapa começa se não cabe no tempo restante; quando o prazo
+estoura sem resposta enviada, o cliente recebe uma mensagem de espera.
+
+Configuração:
+    REQUEST_DEADLINE_SECONDS=60              SLA padrão
+    TENANT_SLA_SECONDS='{"instance_1": 45}'  SLA por tenant
+"""
+import contextlib
+import contextvars
+import json
+import os
+import time
+
+import metrics
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+
+# Tempo mínimo restante para iniciar cada etapa
+CREW_MIN_ATTEMPT_SECONDS = 8.0
+LLM_MIN_CALL_SECONDS = 2.0
+TOOL_MIN_CALL_SECONDS = 1.0
+# Timeout HTTP das ferramentas quando o BackendCall não define um
+TOOL_HTTP_TIMEOUT_SECONDS = float(os.getenv("TOOL_HTTP_TIMEOUT_SECONDS", "30"))
+
+HOLDING_MESSAGE = os.getenv(
+    "DEADLINE_HOLDING_MESSAGE",
+    "Só um momento, estou verificando as informações e já te respondo! 😊",
+)
+
+
+def _load_tenant_sla() -> dict:
+    raw = os.getenv("TENANT_SLA_SECONDS", "")
+    if not raw:
+        return {}
+    try:
+        return {tenant: float(seconds) for tenant, seconds in json.loads(raw).items()}
+    except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
+        print(f"⚠️ TENANT_SLA_SECONDS inválido, usando {REQUEST_DEADLINE_SECONDS}s: {e}")
+        return {}
+
+
+TENANT_SLA_SECONDS = _load_tenant_sla()
+
+
+class DeadlineExceeded(TimeoutError):
+    """O prazo da requisição não comporta a etapa."""
+
+    def __init__(self, stage: str, remaining: float):
+        super().__init__(f"Prazo da requisição esgotado antes de '{stage}' (restavam {max(remaining, 0):.1f}s)")
+        self.stage = stage
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def fits(self, seconds: float) -> bool:
+        return self.remaining() >= seconds
+
+    def clamp(self, timeout: float = None) -> float:
+        """Menor entre o timeout da etapa e o tempo restante (nunca negativo)."""
+        remaining = max(self.remaining(), 0.0)
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def require(self, stage: str, minimum: float = 0.0):
+        """Levanta DeadlineExceeded se restar menos que minimum para a etapa."""
+        if not self.fits(minimum):
+            metrics.inc("deadline_refused_total", stage=stage)
+            raise DeadlineExceeded(stage, self.remaining())
+
+
+def sla_for(tenant_id: str) -> float:
+    return TENANT_SLA_SECONDS.get(tenant_id, REQUEST_DEADLINE_SECONDS)
+
+
+def deadline_for(tenant_id: str, deadline_at_ms: float = None, received_at_ms: float = None) -> Deadline:
+    """Deadline da requisição a partir dos campos do webhook (epoch em ms) e do SLA do tenant."""
+    now_ms = time.time() * 1000
+    if deadline_at_ms:
+        seconds = (deadline_at_ms - now_ms) / 1000
+    elif received_at_ms:
+        seconds = sla_for(tenant_id) - max(now_ms - received_at_ms, 0) / 1000
+    else:
+        seconds = sla_for(tenant_id)
+    return Deadline(seconds)
+
+
+# Deadline da ferramenta em execução (definido em tools._tracked/_atracked, lido pelo http_client)
+_current = contextvars.ContextVar("request_deadline", default=None)
+
+
+def current():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def bind(deadline):
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def http_timeout(call_timeout: float = None, stage: str = "tool_http"):
+    """Timeout HTTP de uma chamada de ferramenta limitado pelo prazo atual."""
+    timeout = call_timeout if call_timeout is not None else TOOL_HTTP_TIMEOUT_SECONDS
+    deadline = current()
+    if deadline is None:
+        return timeout
+    deadline.require(stage, TOOL_MIN_CALL_SECONDS)
+    return deadline.clamp(timeout)
@@ -0,0 +1,280 @@
+"""
+Índice local dos agendamentos futuros de cada tenant, por e-mail do participante.
+
+Reagendar e cancelar começavam sempre por /api/google-calendar/customer-events,
+que lista a agenda no Google e filtra pelo e-mail a cada chamada. Agora cada
+tenant tem um índice e-mail -> eventos futuros:
+
+  - a primeira consulta faz a sincronização completa (GET /events-sync); as
+    seguintes só trazem o que mudou desde o último syncToken do Google Calendar
+    (sincronização incremental; eventos apagados vêm com status "cancelled").
+    Com menos de EVENT_INDEX_MAX_AGE_SECONDS desde a última, nem vai ao backend;
+  - agendar, reagendar e cancelar atualizam o índice na hora (write-through):
+    o que o próprio bot fez aparece sem esperar a próxima sincronização;
+  - token expirado (410 do Google) descarta o índice e refaz a completa; se a
+    sincronização falhar a consulta devolve None e a ferramenta usa o
+    customer-events como antes.
+
+fake_calendar.py simula a API (tokens, exclusões, expiração) para conferir o
+índice contra a busca completa e medir a latência das consultas.
+
+Configuração:
+    EVENT_INDEX=1
+    EVENT_INDEX_MAX_AGE_SECONDS=30     idade máxima do índice antes de sincronizar
+    EVENT_INDEX_TIMEOUT_SECONDS=10
+    EVENT_INDEX_MAX_TENANTS=500
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+import metrics
+from http_client import BackendCall, arun_flow, run_flow
+from scheduling_rules import localize, parse_datetime, tenant_zone
+
+EVENT_INDEX = os.getenv("EVENT_INDEX", "1") == "1"
+EVENT_INDEX_MAX_AGE_SECONDS = float(os.getenv("EVENT_INDEX_MAX_AGE_SECONDS", "30"))
+EVENT_INDEX_TIMEOUT_SECONDS = float(os.getenv("EVENT_INDEX_TIMEOUT_SECONDS", "10"))
+EVENT_INDEX_MAX_TENANTS = int(os.getenv("EVENT_INDEX_MAX_TENANTS", "500"))
+
+SYNC_PATH = "/api/google-calendar/events-sync"
+SYNC_TOKEN_EXPIRED = "sync_token_expired"
+
+# Campos devolvidos pelo /customer-events (o índice responde no mesmo formato)
+_PUBLIC_FIELDS = ("id", "summary", "start", "end", "status", "meetLink")
+
+
+def _when(value):
+    if isinstance(value, dict):
+        return value.get("dateTime") or value.get("date")
+    return value
+
+
+def normalize(event: dict) -> Optional[dict]:
+    """Evento do Google (cru, como o schedule/reschedule devolvem) ou já normalizado pelo /events-sync."""
+    if not isinstance(event, dict) or not event.get("id"):
+        return None
+    attendees = [a.get("email") if isinstance(a, dict) else a for a in event.get("attendees") or []]
+    entry_points = (event.get("conferenceData") or {}).get("entryPoints") or [{}]
+    return {
+        "id": event["id"],
+        "summary": event.get("summary"),
+        "start": _when(event.get("start")),
+        "end": _when(event.get("end")),
+        "status": event.get("status") or "confirmed",
+        "meetLink": event.get("meetLink") or event.get("hangoutLink") or entry_points[0].get("uri"),
+        "attendees": sorted({a.lower() for a in attendees if a}),
+    }
+
+
+def _moment(value: str):
+    parsed = parse_datetime(value) if value else None
+    return localize(parsed, tenant_zone()) if parsed else None
+
+
+class _TenantIndex:
+    def __init__(self):
+        self.events = {}        # id -> evento normalizado
+        self.by_email = {}      # e-mail -> ids
+        self.sync_token = None
+        self.synced_at = None   # monotonic da última sincronização; None = nunca sincronizado
+
+    def put(self, event: dict):
+        self.drop(event["id"])
+        if event["status"] == "cancelled":
+            return
+        self.events[event["id"]] = event
+        for email in event["attendees"]:
+            self.by_email.setdefault(email, set()).add(event["id"])
+
+    def drop(self, event_id: str):
+        old = self.events.pop(event_id, None)
+        for email in old["attendees"] if old else ():
+            ids = self.by_email.get(email)
+            ids.discard(event_id)
+            if not ids:
+                del self.by_email[email]
+
+    def prune(self, now: datetime):
+        """Tira os eventos que já terminaram (o Google só lista a partir de agora)."""
+        for event in list(self.events.values()):
+            end = _moment(event["end"] or event["start"])
+            if end is not None and end <= now:
+                self.drop(event["id"])
+
+    def lookup(self, email: str, now: datetime) -> list:
+        """Eventos futuros do participante, em ordem de início, como o /customer-events."""
+        found = []
+        for event_id in self.by_email.get(email.lower(), ()):
+            event = self.events[event_id]
+            end = _moment(event["end"] or event["start"])
+            if end is None or end > now:
+                found.append(event)
+        found.sort(key=lambda e: (_moment(e["start"]) or now, e["id"]))
+        return [{field: event[field] for field in _PUBLIC_FIELDS} for event in found]
+
+
+class EventIndex:
+    def __init__(self, max_age: float = EVENT_INDEX_MAX_AGE_SECONDS, max_tenants: int = EVENT_INDEX_MAX_TENANTS):
+        self.max_age = max_age
+        self.max_tenants = max_tenants
+        self._lock = threading.Lock()
+        self._tenants = OrderedDict()
+
+    def _tenant(self, user_id: str) -> _TenantIndex:
+        with self._lock:
+            tenant = self._tenants.get(user_id)
+            if tenant is None:
+                tenant = self._tenants[user_id] = _TenantIndex()
+                while len(self._tenants) > self.max_tenants:
+                    self._tenants.popitem(last=False)
+            self._tenants.move_to_end(user_id)
+            return tenant
+
+    def _synced(self, user_id: str) -> Optional[_TenantIndex]:
+        with self._lock:
+            tenant = self._tenants.get(user_id)
+        return tenant if tenant is not None and tenant.synced_at is not None else None
+
+    def reset(self, user_id: str):
+        with self._lock:
+            self._tenants.pop(user_id, None)
+
+    def sync_flow(self, user_id: str, force: bool = False):
+        """
+        Flow de ferramenta (yield BackendCall) que deixa o índice do tenant em dia:
+        incremental se já há syncToken, completa senão. True se o índice está válido.
+        """
+        tenant = self._tenant(user_id)
+        if not force and tenant.synced_at is not None and time.monotonic() - tenant.synced_at < self.max_age:
+            return True
+
+        for _ in range(2):
+            token = tenant.sync_token if tenant.synced_at is not None else None
+            params = {"userId": user_id}
+            if token:
+                params["syncToken"] = token
+            started = time.monotonic()
+            try:
+                response = yield BackendCall("GET", SYNC_PATH, params=params, timeout=EVENT_INDEX_TIMEOUT_SECONDS)
+                payload = response.json()
+            except Exception as e:
+                payload = {"success": False, "error": str(e)}
+            finally:
+                metrics.observe("event_index_sync_seconds", time.monotonic() - started)
+            if payload.get("success"):
+                break
+            if token and payload.get("reason") == SYNC_TOKEN_EXPIRED:
+                # O Google não aceita mais o token: recomeça do zero
+                metrics.inc("event_index_sync_total", kind="expired")
+                self.reset(user_id)
+                tenant = self._tenant(user_id)
+                continue
+            metrics.inc("event_index_sync_total", kind="failed")
+            print(f"⚠️ Sincronização do índice de eventos falhou ({user_id}): {payload.get('error')}")
+            return False
+        else:
+            return False
+
+        full = token is None or payload.get("fullSync")
+        events = [e for e in map(normalize, payload.get("events") or []) if e]
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            if full:
+                tenant.events, tenant.by_email = {}, {}
+            for event in events:
+                tenant.put(event)
+            tenant.prune(now)
+            tenant.sync_token = payload.get("nextSyncToken")
+            tenant.synced_at = time.monotonic()
+        metrics.inc("event_index_sync_total", kind="full" if full else "incremental")
+        metrics.inc("event_index_sync_changes_total", len(events))
+        return True
+
+    def lookup(self, user_id: str, customer_email: str) -> Optional[list]:
+        """Eventos futuros do cliente a partir do índice (sem sincronizar); None se o tenant não tem índice."""
+        tenant = self._synced(user_id)
+        if tenant is None:
+            return None
+        with self._lock:
+            return tenant.lookup(customer_email, datetime.now(timezone.utc))
+
+    def customer_events_flow(self, user_id: str, customer_email: str):
+        """Flow com o resultado no formato do /customer-events, ou None se o índice não pode responder."""
+        if not EVENT_INDEX or not user_id or not customer_email:
+            return None
+        synced = yield from self.sync_flow(user_id)
+        if not synced:
+            return None
+        started = time.perf_counter()
+        events = self.lookup(user_id, customer_email)
+        metrics.observe("event_index_lookup_seconds", time.perf_counter() - started)
+        if events is None:
+            return None
+        metrics.inc("event_index_lookups_total")
+        return {"success": True, "events": events}
+
+    def load(self, user_id: str, customer_email: str) -> Optional[dict]:
+        return run_flow(self.customer_events_flow(user_id, customer_email))
+
+    async def aload(self, user_id: str, customer_email: str) -> Optional[dict]:
+        return await arun_flow(self.customer_events_flow(user_id, customer_email))
+
+    # Write-through: mudanças feitas pelas ferramentas entram no índice na hora.
+    # Tenant ainda sem índice é ignorado (a sincronização completa já vai trazê-las).
+
+    def apply(self, user_id: str, event: dict):
+        """Evento criado ou alterado (o 'event' devolvido pelo schedule/reschedule)."""
+        event = normalize(event)
+        tenant = self._synced(user_id)
+        if event is None or tenant is None:
+            return
+        with self._lock:
+            tenant.put(event)
+        metrics.inc("event_index_write_through_total", op="upsert")
+
+    def move(self, user_id: str, event_id: str, start: str, end: str):
+        """Reagendamento sem o evento na resposta: só troca o horário."""
+        tenant = self._synced(user_id)
+        if tenant is None:
+            return
+        with self._lock:
+            event = tenant.events.get(event_id)
+            if event is not None:
+                tenant.put({**event, "start": start, "end": end})
+        metrics.inc("event_index_write_through_total", op="move")
+
+    def remove(self, user_id: str, event_id: str):
+        tenant = self._synced(user_id)
+        if tenant is None:
+            return
+        with self._lock:
+            tenant.drop(event_id)
+        metrics.inc("event_index_write_through_total", op="remove")
+
+    def stats(self) -> dict:
+        with self._lock:
+            tenants = list(self._tenants.values())
+        synced = [t for t in tenants if t.synced_at is not None]
+        return {
+            "enabled": EVENT_INDEX,
+            "tenants": len(synced),
+            "events": sum(len(t.events) for t in synced),
+            "incremental": sum(1 for t in synced if t.sync_token),
+        }
+
+
+_index = None
+
+
+def get_event_index() -> EventIndex:
+    global _index
+    if _index is None:
+        _index = EventIndex()
+    return _index
+
+
+metrics.register_derived("event_index", lambda: get_event_index().stats())
@@ -0,0 +1,314 @@
+"""
+Google Calendar falso, em memória, para conferir o event_index.py e medir a latência das consultas.
+
+Imita o que o índice usa da agenda (pelo /events-sync do backend):
+  - listagem completa dos eventos futuros, com nextSyncToken;
+  - listagem incremental com syncToken: só o que mudou depois dele, com os
+    apagados como status "cancelled";
+  - tokens antigos demais expiram (o 410 do Google vira sync_token_expired) e o
+    índice precisa refazer a sincronização completa.
+
+Verificação: uma sequência aleatória de agendamentos, remarcações e
+cancelamentos, parte feita pelo bot (com o write-through das ferramentas) e
+parte direto na agenda (dono do calendário). Depois de cada operação do bot o
+índice, ainda sem sincronizar, tem que bater com a busca completa para aquele
+cliente; depois de cada sincronização, para todos os clientes.
+
+Latência: consulta pelo índice em memória, índice com sincronização incremental
+a cada consulta, e a busca completa do /customer-events (listar e filtrar), com
+RTT simulado até o backend/Google.
+
+Uso:
+    python fake_calendar.py
+    python fake_calendar.py --operations 2000 --customers 40 --rtt-ms 80 --json
+"""
+import argparse
+import itertools
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from event_index import SYNC_PATH, SYNC_TOKEN_EXPIRED, EventIndex
+
+CUSTOMER_EVENTS_PATH = "/api/google-calendar/customer-events"
+TENANT = "loja@example.com"
+
+
+class FakeCalendar:
+    """Agenda de um tenant com a semântica de sincronização do Google Calendar."""
+
+    def __init__(self, token_retention: int = 500):
+        self.events = {}        # id -> evento no formato do Google (apagados ficam como "cancelled")
+        self.seq = 0            # versão da agenda: cada mudança incrementa
+        self.token_floor = 0    # tokens com versão abaixo disto expiraram
+        self.token_retention = token_retention
+        self._ids = itertools.count(1)
+        self.full_syncs = 0
+        self.incremental_syncs = 0
+        self.items_sent = 0
+
+    def _touch(self, event: dict) -> dict:
+        self.seq += 1
+        event["_seq"] = self.seq
+        self.token_floor = max(self.token_floor, self.seq - self.token_retention)
+        return self.public(event)
+
+    @staticmethod
+    def public(event: dict) -> dict:
+        return {k: v for k, v in event.items() if not k.startswith("_")}
+
+    def create(self, email: str, start: datetime, minutes: int = 60) -> dict:
+        event_id = f"evt{next(self._ids)}"
+        self.events[event_id] = {
+            "id": event_id,
+            "summary": f"Agendamento - {email.split('@')[0]}",
+            "start": {"dateTime": start.isoformat()},
+            "end": {"dateTime": (start + timedelta(minutes=minutes)).isoformat()},
+            "status": "confirmed",
+            "attendees": [{"email": email}],
+        }
+        return self._touch(self.events[event_id])
+
+    def move(self, event_id: str, start: datetime) -> dict:
+        event = self.events[event_id]
+        duration = datetime.fromisoformat(event["end"]["dateTime"]) - datetime.fromisoformat(event["start"]["dateTime"])
+        event["start"] = {"dateTime": start.isoformat()}
+        event["end"] = {"dateTime": (start + duration).isoformat()}
+        return self._touch(event)
+
+    def reassign(self, event_id: str, email: str) -> dict:
+        self.events[event_id]["attendees"] = [{"email": email}]
+        return self._touch(self.events[event_id])
+
+    def cancel(self, event_id: str):
+        self.events[event_id] = {"id": event_id, "status": "cancelled"}
+        self._touch(self.events[event_id])
+
+    def expire_tokens(self):
+        self.token_floor = self.seq + 1
+
+    def active(self) -> list:
+        return [e for e in self.events.values() if e["status"] != "cancelled"]
+
+    def sync(self, sync_token: str = None) -> dict:
+        """Resposta do /events-sync."""
+        if sync_token:
+            since = int(sync_token)
+            if since < self.token_floor:
+                return {"success": False, "reason": SYNC_TOKEN_EXPIRED, "error": "410 Gone: fullSyncRequired"}
+            items = [e for e in self.events.values() if e["_seq"] > since]
+            self.incremental_syncs += 1
+        else:
+            now = datetime.now(timezone.utc)
+            items = [e for e in self.active() if datetime.fromisoformat(e["end"]["dateTime"]) > now]
+            self.full_syncs += 1
+        self.items_sent += len(items)
+        return {
+            "success": True,
+            "fullSync": not sync_token,
+            "nextSyncToken": str(self.seq),
+            "events": [self.public(e) for e in items],
+        }
+
+    def customer_events(self, email: str) -> dict:
+        """Resposta do /customer-events: busca completa (a referência para o índice)."""
+        now = datetime.now(timezone.utc)
+        found = [
+            e for e in self.active()
+            if datetime.fromisoformat(e["end"]["dateTime"]) > now
+            and any(a["email"].lower() == email.lower() for a in e["attendees"])
+        ]
+        found.sort(key=lambda e: (datetime.fromisoformat(e["start"]["dateTime"]), e["id"]))
+        return {"success": True, "events": [
+            {"id": e["id"], "summary": e["summary"], "start": e["start"]["dateTime"], "end": e["end"]["dateTime"],
+             "status": e["status"], "meetLink": None}
+            for e in found
+        ]}
+
+
+class FakeBackend:
+    """Serve os BackendCall dos flows com a agenda falsa, com RTT simulado."""
+
+    def __init__(self, calendar: FakeCalendar, rtt: float = 0.0):
+        self.calendar = calendar
+        self.rtt = rtt
+        self.calls = 0
+
+    def handle(self, call):
+        self.calls += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+        if call.path == SYNC_PATH:
+            payload = self.calendar.sync(call.params.get("syncToken"))
+        elif call.path == CUSTOMER_EVENTS_PATH:
+            payload = self.calendar.customer_events(call.params["customerEmail"])
+        else:
+            raise ValueError(f"rota não simulada: {call.path}")
+        return SimpleNamespace(status_code=200, json=lambda: payload)
+
+
+def drive(flow, backend: FakeBackend):
+    """Como o http_client.run_flow, mas respondendo com o FakeBackend."""
+    try:
+        call = next(flow)
+        while True:
+            call = flow.send(backend.handle(call))
+    except StopIteration as stop:
+        return stop.value
+
+
+def customer_events_flow(email: str):
+    response = yield SimpleNamespace(path=CUSTOMER_EVENTS_PATH, params={"userId": TENANT, "customerEmail": email})
+    return response.json()
+
+
+def _random_start(rng: random.Random) -> datetime:
+    base = datetime.now(timezone(timedelta(hours=-3))).replace(minute=0, second=0, microsecond=0)
+    return base + timedelta(days=rng.randint(1, 30), hours=rng.randint(0, 10))
+
+
+def verify(operations: int, customers: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    calendar = FakeCalendar(token_retention=max(operations // 10, 20))
+    backend = FakeBackend(calendar)
+    index = EventIndex(max_age=0)
+    emails = [f"cliente{i}@example.com" for i in range(customers)]
+    mismatches = []
+    pending_external = False   # mudança direto na agenda ainda não sincronizada
+
+    def check(step, email, where):
+        got = index.lookup(TENANT, email)
+        expected = calendar.customer_events(email)["events"]
+        if got != expected:
+            mismatches.append({"step": step, "where": where, "email": email, "index": got, "expected": expected})
+
+    drive(index.sync_flow(TENANT), backend)
+    for step in range(operations):
+        active = calendar.active()
+        roll = rng.random()
+        by_bot = rng.random() < 0.6
+        if roll < 0.4 or not active:
+            email = rng.choice(emails)
+            event = calendar.create(email, _random_start(rng))
+        elif roll < 0.7:
+            target = rng.choice(active)
+            email = target["attendees"][0]["email"]
+            event = calendar.move(target["id"], _random_start(rng))
+        elif roll < 0.9:
+            target = rng.choice(active)
+            email = target["attendees"][0]["email"]
+            calendar.cancel(target["id"])
+            event = None
+            if by_bot:
+                index.remove(TENANT, target["id"])
+        else:
+            # Mudança de participante só acontece direto na agenda
+            target = rng.choice(active)
+            email = rng.choice(emails)
+            calendar.reassign(target["id"], email)
+            by_bot = False
+            event = None
+        if by_bot and event is not None:
+            index.apply(TENANT, event)
+        pending_external = pending_external or not by_bot
+        if by_bot and not pending_external:
+            check(step, email, "write_through")
+        if rng.random() < 0.01:
+            calendar.expire_tokens()
+        if rng.random() < 0.3:
+            drive(index.sync_flow(TENANT), backend)
+            pending_external = False
+            for address in emails:
+                check(step, address, "sync")
+
+    drive(index.sync_flow(TENANT), backend)
+    for address in emails:
+        check(operations, address, "final")
+    return {
+        "operations": operations,
+        "events_active": len(calendar.active()),
+        "full_syncs": calendar.full_syncs,
+        "incremental_syncs": calendar.incremental_syncs,
+        "items_per_sync": round(calendar.items_sent / max(calendar.full_syncs + calendar.incremental_syncs, 1), 1),
+        "mismatches": len(mismatches),
+        "first_mismatch": mismatches[0] if mismatches else None,
+    }
+
+
+def summarize(latencies) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+    }
+
+
+def measure(lookups: int, customers: int, events: int, rtt: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    calendar = FakeCalendar()
+    emails = [f"cliente{i}@example.com" for i in range(customers)]
+    for _ in range(events):
+        calendar.create(rng.choice(emails), _random_start(rng))
+    backend = FakeBackend(calendar, rtt)
+    cached, syncing = EventIndex(max_age=3600), EventIndex(max_age=0)
+    drive(cached.sync_flow(TENANT), backend)
+    drive(syncing.sync_flow(TENANT), backend)
+
+    modes = {
+        "index": lambda email: drive(cached.customer_events_flow(TENANT, email), backend),
+        "index+sync": lambda email: drive(syncing.customer_events_flow(TENANT, email), backend),
+        "customer-events": lambda email: drive(customer_events_flow(email), backend),
+    }
+    report = {}
+    for mode, lookup in modes.items():
+        latencies = []
+        for _ in range(lookups):
+            email = rng.choice(emails)
+            started = time.perf_counter()
+            lookup(email)
+            latencies.append(time.perf_counter() - started)
+        report[mode] = summarize(latencies)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice de eventos por participante contra uma agenda falsa")
+    parser.add_argument("--operations", type=int, default=1000, help="Operações aleatórias na verificação")
+    parser.add_argument("--customers", type=int, default=25)
+    parser.add_argument("--events", type=int, default=400, help="Eventos na agenda da medição de latência")
+    parser.add_argument("--lookups", type=int, default=50)
+    parser.add_argument("--rtt-ms", type=float, default=40, help="RTT simulado até o backend/Google")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="Imprime o resultado em JSON")
+    args = parser.parse_args()
+
+    report = {
+        "verification": verify(args.operations, args.customers, args.seed),
+        "latency": measure(args.lookups, args.customers, args.events, args.rtt_ms / 1000, args.seed),
+        "rtt_ms": args.rtt_ms,
+    }
+    if args.json:
+        json.dump(report, sys.stdout, indent=2, default=str)
+    else:
+        check = report["verification"]
+        print(f"Verificação: {check['operations']} operações, {check['events_active']} eventos ativos, "
+              f"{check['full_syncs']} sincronizações completas, {check['incremental_syncs']} incrementais "
+              f"({check['items_per_sync']} eventos por sincronização)")
+        print(f"Divergências índice x busca completa: {check['mismatches']}")
+        if check["first_mismatch"]:
+            print(f"  primeira: {json.dumps(check['first_mismatch'], default=str)}")
+        print(f"\n{'consulta':<16} {'média':>10} {'p50':>10} {'p95':>10}  (RTT {args.rtt_ms}ms)")
+        for mode, stats in report["latency"].items():
+            print(f"{mode:<16} {stats['mean_ms']:>8}ms {stats['p50_ms']:>8}ms {stats['p95_ms']:>8}ms")
+    if report["verification"]["mismatches"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Hedging de chamadas LLM para cortar a cauda de latência.
+
+Se uma chamada não respondeu dentro de um limiar adaptativo (p95 observado do
+tier, ver metrics.percentile), uma duplicata é disparada - para o mesmo modelo
+ou para o modelo/chave de fallback - e a primeira resposta válida vence.
+
+Só vale para chamadas sem efeito colateral: chamadas com available_functions
+(o LLM do CrewAI executa a ferramenta dentro do call) nunca são duplicadas, e
+ferramentas não passam por aqui. Um orçamento limita a fração de chamadas que
+podem ser duplicadas numa janela deslizante.
+
+Configuração:
+    LLM_HEDGING=1                    liga o hedging (desligado por padrão)
+    LLM_HEDGE_PERCENTILE=95          percentil usado como limiar
+    LLM_HEDGE_DEFAULT_SECONDS=8      limiar enquanto não há amostras suficientes
+    LLM_HEDGE_MAX_RATE=0.05          no máximo 5% das chamadas duplicadas
+    LLM_HEDGE_FALLBACK_MODEL / LLM_HEDGE_FALLBACK_API_KEY   destino da duplicata
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+
+HEDGING_ENABLED = os.getenv("LLM_HEDGING", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+HEDGE_DEFAULT_SECONDS = float(os.getenv("LLM_HEDGE_DEFAULT_SECONDS", "8"))
+HEDGE_MIN_SECONDS = 1.0
+HEDGE_MAX_SECONDS = 30.0
+# Amostras mínimas no histograma antes de confiar no percentil
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", "0.05"))
+HEDGE_BUDGET_WINDOW_SECONDS = 300
+HEDGE_FALLBACK_MODEL = os.getenv("LLM_HEDGE_FALLBACK_MODEL")
+HEDGE_FALLBACK_API_KEY = os.getenv("LLM_HEDGE_FALLBACK_API_KEY")
+
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+
+
+class HedgeBudget:
+    """Permite duplicar no máximo max_rate das chamadas vistas na janela (mais 1 de folga)."""
+
+    def __init__(self, max_rate: float = HEDGE_MAX_RATE, window: float = HEDGE_BUDGET_WINDOW_SECONDS):
+        self.max_rate = max_rate
+        self.window = window
+        self._calls = deque()
+        self._hedges = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        for queue in (self._calls, self._hedges):
+            while queue and now - queue[0] > self.window:
+                queue.popleft()
+
+    def record_call(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._calls.append(now)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            if len(self._hedges) + 1 > self.max_rate * len(self._calls) + 1:
+                return False
+            self._hedges.append(now)
+            return True
+
+
+_budget = HedgeBudget()
+
+
+def hedge_threshold(tier: str) -> float:
+    """Limiar adaptativo: percentil recente da latência do tier (limitado a [1s, 30s])."""
+    count = metrics.histogram_count("llm_call_seconds", tier=tier)
+    if count < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_SECONDS
+    observed = metrics.percentile("llm_call_seconds", HEDGE_PERCENTILE, tier=tier)
+    return min(HEDGE_MAX_SECONDS, max(HEDGE_MIN_SECONDS, observed))
+
+
+def _should_hedge(tier):
+    if _budget.try_acquire():
+        metrics.inc("llm_hedges_total", tier=tier)
+        return True
+    metrics.inc("llm_hedge_skipped_total", tier=tier, reason="budget")
+    return False
+
+
+def hedged_call(primary, hedge, tier: str):
+    """
+    Versão síncrona (LLM do CrewAI, já dentro de uma thread do executor).
+    primary/hedge são callables sem argumentos. A chamada perdedora não pode ser
+    interrompida: termina em background e o resultado é descartado.
+    """
+    _budget.record_call()
+    first = _hedge_executor.submit(contextvars.copy_context().run, primary)
+    done, _ = wait([first], timeout=hedge_threshold(tier))
+    if done or not _should_hedge(tier):
+        return first.result()
+
+    second = _hedge_executor.submit(contextvars.copy_context().run, hedge)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is second:
+                    metrics.inc("llm_hedge_wins_total", tier=tier)
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+async def ahedged_call(primary, hedge, tier: str):
+    """Versão assíncrona (lean_engine): primary/hedge são fábricas de corrotinas; a perdedora é cancelada."""
+    _budget.record_call()
+    first = asyncio.ensure_future(primary())
+    done, _ = await asyncio.wait({first}, timeout=hedge_threshold(tier))
+    if done or not _should_hedge(tier):
+        return await first
+
+    second = asyncio.ensure_future(hedge())
+    pending = {first, second}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        metrics.inc("llm_hedge_wins_total", tier=tier)
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def is_side_effect_free(args, kwargs) -> bool:
+    """LLM.call(messages, tools, callbacks, available_functions, ...): com available_functions o call executa ferramentas."""
+    available_functions = kwargs.get("available_functions") or (args[2] if len(args) > 2 else None)
+    return not available_functions
+
+
+metrics.register_derived("llm_hedge_rate", lambda: metrics.ratio(
+    metrics.counter_total("llm_hedges_total"), metrics.counter_total("llm_tier_calls_total"),
+))
+metrics.register_derived("llm_hedge_win_rate", lambda: metrics.ratio(
+    metrics.counter_total("llm_hedge_wins_total"), metrics.counter_total("llm_hedges_total"),
+))
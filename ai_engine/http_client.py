@@ -0,0 +1,204 @@
+"""
+Transporte HTTP das ferramentas para o backend Node.
+
+As ferramentas descrevem cada chamada como um BackendCall e a lógica de cada uma
+é escrita como um gerador ("flow") que faz `response = yield BackendCall(...)`.
+O mesmo flow é executado de forma síncrona (requests, em _run) ou assíncrona
+(httpx, em _arun), garantindo strings de resultado idênticas nos dois caminhos.
+O timeout de cada chamada respeita o prazo da requisição (deadline.py): quando
+não cabe, o DeadlineExceeded é entregue ao flow como qualquer erro de conexão.
+Cada chamada pega vaga no bulkhead da sua dependência (bulkheads.py): sem vaga
+dentro da espera permitida, falha na hora com BulkheadFull. Depois passa pelo
+circuit breaker do mesmo bulkhead ("backend:<bulkhead>", circuit.py): com a
+dependência fora do ar falha na hora com BackendUnavailable, sem derrubar as
+outras (agenda lenta não bloqueia o envio de mensagens). Timeout de uma chamada
+cujo limite foi encurtado pelo prazo da requisição não conta como falha.
+"""
+import asyncio
+import os
+import threading
+from dataclasses import dataclass, field, replace
+from typing import Optional
+
+import requests
+
+import deadline
+from bulkheads import classify, get_bulkhead
+from circuit import get_breaker
+from deadline import http_timeout
+
+try:
+    import httpx
+except ImportError:  # httpx vem com o crewai/litellm; sem ele o _arun cai para threads
+    httpx = None
+
+_TIMEOUTS = (requests.exceptions.Timeout,) + ((httpx.TimeoutException,) if httpx is not None else ())
+
+
+@dataclass
+class BackendCall:
+    method: str
+    path: str
+    json: Optional[dict] = None
+    params: Optional[dict] = None
+    timeout: Optional[float] = field(default=None)
+    # Bulkhead da chamada (bulkheads.py); None = deduzido da rota
+    bulkhead: Optional[str] = None
+    # Timeout encurtado pelo prazo da requisição (_with_deadline): estourá-lo não diz nada do backend
+    deadline_bound: bool = False
+
+
+class BackendUnavailable(ConnectionError):
+    """Circuito do backend aberto: a chamada nem foi feita."""
+
+
+def backend_url() -> str:
+    return os.getenv("NODE_BACKEND_URL", "http://localhost:3003")
+
+
+# Uma sessão síncrona (keep-alive) por bulkhead, com pool do tamanho do limite dele:
+# chamadas lentas de uma dependência não ocupam as conexões das outras
+_sync_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Um AsyncClient por event loop (uvicorn usa um só; o replay cria um por conversa)
+_async_clients = {}
+_async_lock = threading.Lock()
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    with _async_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+            _async_clients[loop] = client
+            # Descarta clientes de loops já encerrados
+            for other in [l for l in _async_clients if l is not loop and l.is_closed()]:
+                _async_clients.pop(other, None)
+        return client
+
+
+def _session(bulkhead):
+    with _sessions_lock:
+        session = _sync_sessions.get(bulkhead.name)
+        if session is None:
+            session = _sync_sessions[bulkhead.name] = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=bulkhead.max_concurrent)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        return session
+
+
+def _bulkhead(call: BackendCall):
+    return get_bulkhead(call.bulkhead or classify(call.method, call.path))
+
+
+def _queue_wait(bulkhead) -> float:
+    """Espera máxima por uma vaga: a do bulkhead, limitada pelo prazo da requisição."""
+    current = deadline.current()
+    return current.clamp(bulkhead.queue_timeout) if current is not None else bulkhead.queue_timeout
+
+
+def _timeout(call: BackendCall, bulkhead) -> float:
+    return call.timeout if call.timeout is not None else bulkhead.timeout
+
+
+def _breaker(bulkhead):
+    return get_breaker(f"backend:{bulkhead.name}")
+
+
+def _admit(breaker):
+    if not breaker.allow():
+        raise BackendUnavailable("Backend indisponível (circuito aberto)")
+
+
+def _record_error(breaker, call: BackendCall, error: Exception):
+    if call.deadline_bound and isinstance(error, _TIMEOUTS):
+        breaker.abandon()
+    else:
+        breaker.record(False)
+
+
+def send_sync(call: BackendCall):
+    bulkhead = _bulkhead(call)
+    with bulkhead.slot(_queue_wait(bulkhead)):
+        breaker = _breaker(bulkhead)
+        _admit(breaker)
+        try:
+            response = _session(bulkhead).request(
+                call.method, f"{backend_url()}{call.path}", json=call.json, params=call.params,
+                timeout=_timeout(call, bulkhead),
+            )
+        except Exception as e:
+            _record_error(breaker, call, e)
+            raise
+        breaker.record(response.status_code < 500)
+        return response
+
+
+async def send_async(call: BackendCall):
+    if httpx is None:
+        return await asyncio.to_thread(send_sync, call)
+    bulkhead = _bulkhead(call)
+    async with bulkhead.aslot(_queue_wait(bulkhead)):
+        breaker = _breaker(bulkhead)
+        _admit(breaker)
+        client = get_async_client()
+        try:
+            response = await client.request(
+                call.method, f"{backend_url()}{call.path}", json=call.json, params=call.params,
+                timeout=_timeout(call, bulkhead),
+            )
+        except asyncio.CancelledError:
+            # Cancelada (hedge/timeout do crew): não diz nada sobre a saúde do backend
+            breaker.abandon()
+            raise
+        except Exception as e:
+            _record_error(breaker, call, e)
+            raise
+        breaker.record(response.status_code < 500)
+        return response
+
+
+def _with_deadline(call: BackendCall) -> BackendCall:
+    """Timeout da chamada (o do bulkhead, se não definido) limitado pelo prazo da requisição."""
+    timeout = _timeout(call, _bulkhead(call))
+    bounded = http_timeout(timeout)
+    return replace(call, timeout=bounded, deadline_bound=bounded < timeout)
+
+
+def run_flow(flow):
+    """Executa um flow de ferramenta com HTTP síncrono."""
+    try:
+        call = next(flow)
+        while True:
+            try:
+                response = send_sync(_with_deadline(call))
+            except Exception as e:
+                call = flow.throw(e)
+                continue
+            call = flow.send(response)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def arun_flow(flow):
+    """Executa um flow de ferramenta com HTTP assíncrono (cliente compartilhado)."""
+    try:
+        call = next(flow)
+        while True:
+            try:
+                response = await send_async(_with_deadline(call))
+            except Exception as e:
+                call = flow.throw(e)
+                continue
+            call = flow.send(response)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def close_async_clients():
+    for client in list(_async_clients.values()):
+        await client.aclose()
+    _async_clients.clear()
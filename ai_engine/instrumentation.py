@@ -0,0 +1,336 @@
+"""
+Instrumentação por requisição do AI Engine.
+
+Cada webhook cria um estado em TOOLS_USAGE_STATE[request_id] (mesmo dicionário
+global usado pelo tracker 'sent'). Aqui ficam os contadores de chamadas LLM,
+tokens e ferramentas, além da gravação opcional da conversa (ver recorder.py).
+"""
+import time
+import traceback
+
+import budgets
+from circuit import get_breaker
+from key_registry import classify_error, get_key_registry
+from budgets import BUDGET_WARN_RATIO, budget_for
+from deadline import DeadlineExceeded, LLM_MIN_CALL_SECONDS
+import hedging
+import metrics
+from model_router import TIERS, estimate_cost_usd, tier_of_model
+from tools import TOOLS_USAGE_STATE
+
+# Hook opcional usado pelo replay.py: quando definido, substitui a chamada real ao LLM.
+# Assinatura: LLM_STUB(request_id, messages, kwargs) -> str
+LLM_STUB = None
+
+# Callbacks chamados com o resumo de cada execução (usado pelo replay.py)
+RUN_SUMMARY_LISTENERS = []
+
+
+def estimate_tokens(value) -> int:
+    """Estimativa barata de tokens (~4 caracteres por token) para textos ou listas de mensagens."""
+    if value is None:
+        return 0
+    if isinstance(value, list):
+        return sum(estimate_tokens(m.get("content") if isinstance(m, dict) else m) for m in value)
+    text = value if isinstance(value, str) else str(value)
+    return max(1, len(text) // 4) if text else 0
+
+
+def new_request_state(request_id: str, tenant_id: str = None, channel: str = "whatsapp", recording: list = None,
+                      deadline=None) -> dict:
+    """Cria o estado da requisição em TOOLS_USAGE_STATE e o retorna."""
+    state = {
+        "sent": False,
+        "tenant_id": tenant_id,
+        "channel": channel,
+        "started_at": time.monotonic(),
+        "llm_calls": 0,
+        "llm_seconds": 0.0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cost_usd": 0.0,
+        "route": None,
+        "tool_calls": [],
+        "recording": recording,
+        "deadline": deadline,         # deadline.Deadline da requisição
+        "deadline_exceeded": None,    # etapa que estourou o prazo
+        "budget": budget_for(tenant_id),   # budgets.RunBudget
+        "tool_counts": {},
+        "budget_exceeded": None,
+        "tool_budget_exceeded": None,
+        "tool_definition_tokens": 0,  # definições de ferramentas enviadas a cada chamada LLM
+        "shed": None,                 # motivo do descarte por sobrecarga (overload.py)
+        "key_fingerprint": None,      # impressão digital da chave de API em uso (key_registry.py)
+        "key_fallback": None,         # status da chave do tenant quando caiu na chave do ambiente
+        "conversation": None,         # destinatário da conversa (contabilidade por conversa)
+        "usage_downgrade": None,      # limite de consumo ultrapassado que rebaixou a execução (accounting.py)
+    }
+    TOOLS_USAGE_STATE[request_id] = state
+    return state
+
+
+def record_event(request_id: str, event: dict):
+    """Anexa um evento à gravação da requisição, se a gravação estiver ativa."""
+    state = TOOLS_USAGE_STATE.get(request_id)
+    if state is not None and state.get("recording") is not None:
+        state["recording"].append(event)
+
+
+def _usage_from_llm(llm):
+    """Lê o acumulado de tokens que o LLM do CrewAI mantém internamente (quando disponível)."""
+    usage = getattr(llm, "_token_usage", None)
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens", 0) or 0, usage.get("completion_tokens", 0) or 0
+    return None
+
+
+def instrument_llm(llm, request_id: str, hedge_llm=None):
+    """
+    Envolve llm.call para contar chamadas, tokens e tempo no estado da requisição.
+    Não altera o comportamento da chamada; apenas observa (ou serve o LLM_STUB no replay).
+    Com LLM_HEDGING=1, chamadas sem ferramentas lentas são duplicadas (ver hedging.py)
+    no hedge_llm (modelo/chave de fallback) ou, sem ele, no próprio llm.
+    """
+    if not request_id:
+        return llm
+
+    original_call = llm.call
+    hedge_call = hedge_llm.call if hedge_llm is not None else original_call
+    base_timeout = getattr(llm, "timeout", None)
+    tier = tier_of_model(getattr(llm, "model", None)) or "other"
+
+    def call(messages, *args, **kwargs):
+        state = TOOLS_USAGE_STATE.get(request_id) or {}
+        if LLM_STUB is None:
+            budgets.check_llm(state)
+        deadline = state.get("deadline")
+        if deadline is not None and LLM_STUB is None:
+            # Não inicia uma chamada que não cabe no prazo; as que iniciam herdam o tempo restante
+            deadline.require("llm", LLM_MIN_CALL_SECONDS)
+            for target in (llm, hedge_llm):
+                if target is not None:
+                    object.__setattr__(target, "timeout", deadline.clamp(base_timeout))
+        usage_before = _usage_from_llm(llm)
+        started = time.monotonic()
+        error = None
+        response = None
+        try:
+            if LLM_STUB is not None:
+                response = LLM_STUB(request_id, messages, kwargs)
+            elif hedging.HEDGING_ENABLED and hedging.is_side_effect_free(args, kwargs):
+                response = hedging.hedged_call(
+                    lambda: original_call(messages, *args, **kwargs),
+                    lambda: hedge_call(messages, *args, **kwargs),
+                    tier,
+                )
+            else:
+                response = original_call(messages, *args, **kwargs)
+            return response
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            usage_after = _usage_from_llm(llm)
+            if usage_before is not None and usage_after is not None and usage_after[0] > usage_before[0]:
+                input_tokens = usage_after[0] - usage_before[0]
+                output_tokens = usage_after[1] - usage_before[1]
+            else:
+                input_tokens = estimate_tokens(messages)
+                output_tokens = estimate_tokens(response)
+
+            record_llm_call(request_id, messages, response, error, input_tokens, output_tokens, elapsed,
+                            model=getattr(llm, "model", None), engine="crewai")
+
+    object.__setattr__(llm, "call", call)
+    return llm
+
+
+def record_llm_call(request_id: str, messages, response, error, input_tokens: int, output_tokens: int, elapsed: float,
+                    model: str = None, engine: str = None):
+    """
+    Soma uma chamada LLM ao estado da requisição e a grava (usado pelo CrewAI e pelo lean_engine).
+    Latência, tokens e custo estimado também vão para as métricas por tier de modelo.
+    """
+    tier = tier_of_model(model) or "other"
+    cost = estimate_cost_usd(tier, input_tokens, output_tokens)
+    metrics.observe("llm_call_seconds", elapsed, tier=tier)
+    metrics.inc("llm_calls_total", tier=tier, engine=engine or "unknown", outcome="error" if error else "ok")
+    metrics.inc("llm_tier_calls_total", tier=tier)
+    metrics.inc("llm_input_tokens_total", input_tokens, tier=tier)
+    metrics.inc("llm_output_tokens_total", output_tokens, tier=tier)
+    metrics.inc("llm_cost_usd_total", cost, tier=tier)
+
+    state = TOOLS_USAGE_STATE.get(request_id)
+    # Prazo/orçamento esgotados são decisões nossas, não falhas do provedor
+    if not isinstance(error, (DeadlineExceeded, budgets.BudgetExceeded)):
+        if state is not None and state.get("key_fingerprint"):
+            get_key_registry().record(state["key_fingerprint"], error)
+        # Chave ruim/sem cota é problema de um tenant, não do provedor: não abre o circuito
+        if error is None or classify_error(error) is None:
+            get_breaker("llm").record(error is None)
+
+    if state is not None:
+        state["llm_calls"] += 1
+        state["llm_seconds"] += elapsed
+        state["input_tokens"] += input_tokens
+        state["output_tokens"] += output_tokens
+        state["cost_usd"] = state.get("cost_usd", 0.0) + cost
+
+    record_event(request_id, {
+        "type": "llm",
+        "messages": messages,
+        "response": response,
+        "error": str(error) if error else None,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "model": model,
+        "ms": round(elapsed * 1000, 1),
+    })
+
+
+def note_tool_definitions(request_id: str, tools):
+    """Registra os tokens das definições das ferramentas do agente (reenviadas a cada chamada LLM)."""
+    state = TOOLS_USAGE_STATE.get(request_id) if request_id else None
+    if state is not None:
+        state["tool_definition_tokens"] = sum(estimate_tokens(type(tool).definition_text()) for tool in tools)
+
+
+def tool_tokens(state: dict) -> dict:
+    """Tokens das ferramentas na execução: definições (x chamadas LLM) e resultados devolvidos ao agente, por ferramenta."""
+    per_tool = {}
+    for call in state.get("tool_calls", []):
+        per_tool[call["name"]] = per_tool.get(call["name"], 0) + estimate_tokens(call.get("result"))
+    definitions = state.get("tool_definition_tokens", 0)
+    return {
+        "definitions": definitions,
+        "definitions_input": definitions * state.get("llm_calls", 0),
+        "results": sum(per_tool.values()),
+        "per_tool": per_tool,
+    }
+
+
+def absorb_crew_usage(request_id: str, result):
+    """
+    Substitui as estimativas pelos números oficiais do CrewOutput.token_usage, quando presentes.
+    """
+    state = TOOLS_USAGE_STATE.get(request_id)
+    usage = getattr(result, "token_usage", None)
+    if state is None or usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    if prompt_tokens:
+        state["input_tokens"] = max(state["input_tokens"], prompt_tokens)
+        state["output_tokens"] = max(state["output_tokens"], completion_tokens)
+    requests_count = getattr(usage, "successful_requests", 0) or 0
+    state["llm_calls"] = max(state["llm_calls"], requests_count)
+
+
+def summarize_request(request_id: str) -> dict:
+    """Resumo do que a execução consumiu (LLM, tokens, ferramentas, tempo)."""
+    state = TOOLS_USAGE_STATE.get(request_id)
+    if state is None:
+        return {}
+    tool_calls = state.get("tool_calls", [])
+    bookings = sum(
+        1 for call in tool_calls
+        if call["name"] == "Agendar Compromisso" and str(call.get("result", "")).startswith("✅")
+    )
+    return {
+        "request_id": request_id,
+        "tenant_id": state.get("tenant_id"),
+        "channel": state.get("channel"),
+        "sent": state.get("sent", False),
+        "llm_calls": state.get("llm_calls", 0),
+        "llm_seconds": round(state.get("llm_seconds", 0.0), 3),
+        "input_tokens": state.get("input_tokens", 0),
+        "output_tokens": state.get("output_tokens", 0),
+        "cost_usd": round(state.get("cost_usd", 0.0), 6),
+        "route": state.get("route"),
+        "tool_calls": len(tool_calls),
+        "tools": [call["name"] for call in tool_calls],
+        "bookings": bookings,
+        "deadline_seconds": round(state["deadline"].budget, 3) if state.get("deadline") else None,
+        "deadline_exceeded": state.get("deadline_exceeded"),
+        "budget": budgets.usage(state),
+        "budget_exceeded": state.get("budget_exceeded"),
+        "tool_budget_exceeded": state.get("tool_budget_exceeded"),
+        "shed": state.get("shed"),
+        "key_fingerprint": state.get("key_fingerprint"),
+        "key_fallback": state.get("key_fallback"),
+        "conversation": state.get("conversation"),
+        "usage_downgrade": state.get("usage_downgrade"),
+        "tool_tokens": tool_tokens(state),
+        "wall_seconds": round(time.monotonic() - state.get("started_at", time.monotonic()), 3),
+    }
+
+
+def finish_request(request_id: str, error: str = None) -> dict:
+    """
+    Fecha a requisição: loga o resumo, grava a conversa (se ativa) e avisa os listeners.
+    Deve ser chamado ANTES de remover o estado de TOOLS_USAGE_STATE.
+    """
+    summary = summarize_request(request_id)
+    if not summary:
+        return summary
+    summary["error"] = error
+
+    print(
+        f"📊 Run {request_id[:8]}: llm_calls={summary['llm_calls']} "
+        f"tokens={summary['input_tokens']}/{summary['output_tokens']} cost=${summary['cost_usd']:.5f} "
+        f"tools={summary['tool_calls']} bookings={summary['bookings']} "
+        f"tool_tokens={summary['tool_tokens']['definitions_input']}+{summary['tool_tokens']['results']} "
+        f"wall={summary['wall_seconds']}s sent={summary['sent']}"
+    )
+    for call in TOOLS_USAGE_STATE.get(request_id, {}).get("tool_calls", []):
+        metrics.observe("tool_result_tokens", estimate_tokens(call.get("result")), tool=call["name"])
+    metrics.observe("tool_definition_tokens", summary["tool_tokens"]["definitions"])
+    budget = summary.get("budget") or {}
+    if budget:
+        metrics.observe("run_budget_usage_ratio", budget["max_ratio"], channel=summary.get("channel") or "unknown")
+        if summary["budget_exceeded"] or summary["tool_budget_exceeded"] or budget["max_ratio"] >= BUDGET_WARN_RATIO:
+            print(
+                f"⚠️ Run {request_id[:8]} perto/além do orçamento: llm_calls={budget['llm_calls']} "
+                f"tokens={budget['tokens']} tool={budget['top_tool']} "
+                f"abortado={summary['budget_exceeded'] or '-'} ferramenta_bloqueada={summary['tool_budget_exceeded'] or '-'}"
+            )
+
+    state = TOOLS_USAGE_STATE.get(request_id, {})
+    if state.get("recording") is not None:
+        try:
+            from recorder import save_recording
+            save_recording(request_id, state["recording"], summary)
+        except Exception:
+            print(f"⚠️ Falha ao salvar gravação: {traceback.format_exc()}")
+
+    for listener in list(RUN_SUMMARY_LISTENERS):
+        try:
+            listener(summary)
+        except Exception as e:
+            print(f"⚠️ Run summary listener falhou: {e}")
+
+    return summary
+
+
+def tier_report() -> dict:
+    """Latência, custo e chamadas por tier de modelo (exposto em /metrics como derived)."""
+    report = {}
+    for tier in list(TIERS) + ["other"]:
+        calls = metrics.counter("llm_tier_calls_total", tier=tier)
+        if not calls:
+            continue
+        cost = metrics.counter("llm_cost_usd_total", tier=tier)
+        report[tier] = {
+            "calls": calls,
+            "p50_seconds": metrics.percentile("llm_call_seconds", 50, tier=tier),
+            "p95_seconds": metrics.percentile("llm_call_seconds", 95, tier=tier),
+            "input_tokens": metrics.counter("llm_input_tokens_total", tier=tier),
+            "output_tokens": metrics.counter("llm_output_tokens_total", tier=tier),
+            "cost_usd": round(cost, 6),
+            "cost_per_call_usd": round(cost / calls, 6),
+        }
+    return report
+
+
+metrics.register_derived("llm_tiers", tier_report)
@@ -0,0 +1,282 @@
+"""
+Registro de saúde das chaves de API do Gemini enviadas pelos tenants (apiKey).
+
+Uma chave inválida, revogada ou sem cota passava por todo o run_crew_with_retry,
+às vezes com backoff, antes de falhar. Agora o pipeline consulta o registro
+antes de montar os agentes:
+
+  - chave nunca vista: validada uma vez (models.get, sem gastar tokens) e o
+    status fica em cache: valid, invalid ou quota_exhausted até um horário.
+    A validação respeita o prazo da requisição, requisições simultâneas com a
+    mesma chave esperam a mesma validação, e um resultado inconclusivo (rede,
+    timeout) fica em cache por KEY_INCONCLUSIVE_TTL_SECONDS: nesse meio tempo a
+    chave segue sem validação e o erro, se houver, vem da própria chamada LLM;
+  - chave conhecida como ruim: falha na hora (KeyRejected) sem chamar o LLM, ou
+    cai na chave do ambiente se a política do tenant for "env";
+  - cada chamada LLM da requisição alimenta o registro (instrumentation.py):
+    erro de chave/cota atualiza o status e o retry para de insistir.
+
+As chaves nunca ficam guardadas: o cache usa uma impressão digital HMAC-SHA256
+(não reversível) e é ela que aparece nas métricas, com a taxa de erro por chave.
+
+Configuração:
+    KEY_VALIDATION=1                     valida chaves novas antes da execução
+    KEY_VALIDATION_MODEL=gemini-2.5-flash
+    KEY_VALIDATION_TIMEOUT_SECONDS=5     limitado também pelo prazo da requisição
+    KEY_INCONCLUSIVE_TTL_SECONDS=30
+    KEY_VALID_TTL_SECONDS=3600
+    KEY_INVALID_TTL_SECONDS=900
+    KEY_QUOTA_COOLDOWN_SECONDS=60        quando o erro de cota não diz o retryDelay
+    KEY_FALLBACK_POLICY=fail|env         padrão para chave ruim
+    TENANT_KEY_FALLBACK='{"instance_1": "env"}'
+    KEY_FINGERPRINT_SALT=...             sal da impressão digital
+"""
+import hashlib
+import hmac
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+
+KEY_VALIDATION = os.getenv("KEY_VALIDATION", "1") == "1"
+KEY_VALIDATION_MODEL = os.getenv("KEY_VALIDATION_MODEL", "gemini-2.5-flash")
+KEY_VALIDATION_TIMEOUT_SECONDS = float(os.getenv("KEY_VALIDATION_TIMEOUT_SECONDS", "5"))
+KEY_INCONCLUSIVE_TTL_SECONDS = float(os.getenv("KEY_INCONCLUSIVE_TTL_SECONDS", "30"))
+KEY_VALID_TTL_SECONDS = float(os.getenv("KEY_VALID_TTL_SECONDS", "3600"))
+KEY_INVALID_TTL_SECONDS = float(os.getenv("KEY_INVALID_TTL_SECONDS", "900"))
+KEY_QUOTA_COOLDOWN_SECONDS = float(os.getenv("KEY_QUOTA_COOLDOWN_SECONDS", "60"))
+KEY_FALLBACK_POLICY = os.getenv("KEY_FALLBACK_POLICY", "fail")
+KEY_FINGERPRINT_SALT = os.getenv("KEY_FINGERPRINT_SALT", "bot-comercial-keys")
+# Janela da taxa de erro por chave e quantidade máxima de chaves no cache
+KEY_ERROR_WINDOW_SECONDS = 300
+KEY_REGISTRY_MAX_KEYS = 2000
+
+VALID = "valid"
+INVALID = "invalid"
+QUOTA_EXHAUSTED = "quota_exhausted"
+UNKNOWN = "unknown"
+
+FALLBACK_FAIL = "fail"
+FALLBACK_ENV = "env"
+
+_INVALID_KEY = re.compile(r"api[_ ]key[_ ](not valid|invalid|expired)|permission_denied|unauthenticated|api key not found", re.I)
+_QUOTA = re.compile(r"resource_exhausted|quota", re.I)
+_RETRY_DELAY = re.compile(r"retry(?:delay|\s+in)\W*(\d+(?:\.\d+)?)\s*s", re.I)
+
+
+def _load_tenant_policies() -> dict:
+    raw = os.getenv("TENANT_KEY_FALLBACK", "")
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError as e:
+        print(f"⚠️ TENANT_KEY_FALLBACK inválido, usando {KEY_FALLBACK_POLICY} para todos: {e}")
+        return {}
+
+
+TENANT_KEY_FALLBACK = _load_tenant_policies()
+
+
+def fallback_for(tenant_id: str) -> str:
+    return TENANT_KEY_FALLBACK.get(tenant_id, KEY_FALLBACK_POLICY)
+
+
+def environment_key():
+    return os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+
+
+def fingerprint(api_key: str) -> str:
+    """Impressão digital não reversível da chave (HMAC-SHA256 com sal, 16 hex)."""
+    return hmac.new(KEY_FINGERPRINT_SALT.encode(), api_key.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def classify_error(error):
+    """(status, segundos de espera) para erros de chave/cota; None para os demais."""
+    text = str(error)
+    if _INVALID_KEY.search(text):
+        return INVALID, None
+    if _QUOTA.search(text):
+        delay = _RETRY_DELAY.search(text)
+        return QUOTA_EXHAUSTED, float(delay.group(1)) if delay else KEY_QUOTA_COOLDOWN_SECONDS
+    return None
+
+
+class KeyRejected(Exception):
+    """A chave do tenant está marcada como inválida ou sem cota e a política é falhar."""
+
+    def __init__(self, status: str, key_fingerprint: str, retry_in: float = None):
+        detail = f" por mais {retry_in:.0f}s" if retry_in else ""
+        super().__init__(f"Chave de API {key_fingerprint} recusada: {status}{detail}")
+        self.status = status
+        self.fingerprint = key_fingerprint
+
+
+class _KeyEntry:
+    def __init__(self):
+        self.status = UNKNOWN
+        self.expires_at = 0.0    # monotonic: até quando o status vale
+        self.outcomes = deque()  # (monotonic, ok)
+
+
+class KeyRegistry:
+    def __init__(self, max_keys: int = KEY_REGISTRY_MAX_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._validating = {}   # impressão digital -> Event da validação em andamento
+
+    def _entry(self, key_fingerprint: str) -> _KeyEntry:
+        entry = self._entries.get(key_fingerprint)
+        if entry is None:
+            entry = self._entries[key_fingerprint] = _KeyEntry()
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(key_fingerprint)
+        return entry
+
+    def _set(self, key_fingerprint: str, status: str, ttl: float):
+        with self._lock:
+            entry = self._entry(key_fingerprint)
+            if entry.status != status:
+                metrics.inc("api_key_status_changes_total", status=status)
+            entry.status = status
+            entry.expires_at = time.monotonic() + ttl
+
+    def status(self, key_fingerprint: str):
+        """
+        (status, segundos até expirar) do cache; (UNKNOWN, 0) se expirou ou nunca foi
+        visto. Validação inconclusiva recente: (UNKNOWN, segundos até tentar de novo).
+        """
+        with self._lock:
+            entry = self._entries.get(key_fingerprint)
+            remaining = entry.expires_at - time.monotonic() if entry else 0
+            if entry is None or remaining <= 0:
+                return UNKNOWN, 0.0
+            return entry.status, remaining
+
+    def check(self, api_key: str, timeout: float = KEY_VALIDATION_TIMEOUT_SECONDS) -> str:
+        """
+        Status da chave, validando-a se não estiver em cache (bloqueante: chamar numa
+        thread). Espera no máximo `timeout` segundos; com a mesma chave já em
+        validação, espera essa validação em vez de fazer outra.
+        """
+        key_fingerprint = fingerprint(api_key)
+        status, remaining = self.status(key_fingerprint)
+        if status != UNKNOWN or remaining > 0 or not KEY_VALIDATION:
+            return status
+        with self._lock:
+            done = self._validating.get(key_fingerprint)
+            leader = done is None
+            if leader:
+                done = self._validating[key_fingerprint] = threading.Event()
+        if not leader:
+            metrics.inc("api_key_validation_coalesced_total")
+            done.wait(timeout)
+            return self.status(key_fingerprint)[0]
+        try:
+            return self.validate(api_key, timeout)
+        finally:
+            with self._lock:
+                del self._validating[key_fingerprint]
+            done.set()
+
+    def validate(self, api_key: str, timeout: float = KEY_VALIDATION_TIMEOUT_SECONDS) -> str:
+        """Consulta o modelo com a chave (sem gerar tokens) e guarda o resultado."""
+        from llm_transport import genai_client
+
+        key_fingerprint = fingerprint(api_key)
+        if timeout <= 0:
+            return UNKNOWN
+        started = time.monotonic()
+        try:
+            genai_client(api_key, cache=False).models.get(
+                model=KEY_VALIDATION_MODEL,
+                config={"http_options": {"timeout": max(int(timeout * 1000), 1)}},
+            )
+        except ImportError:
+            return UNKNOWN
+        except Exception as e:
+            classified = classify_error(e)
+            if classified is None:
+                # Falha de rede/servidor/timeout não diz nada sobre a chave: não
+                # valida de novo a cada requisição, só depois de um intervalo curto
+                print(f"⚠️ Validação da chave {key_fingerprint} inconclusiva: {e}")
+                metrics.inc("api_key_validation_inconclusive_total")
+                self._set(key_fingerprint, UNKNOWN, KEY_INCONCLUSIVE_TTL_SECONDS)
+                return UNKNOWN
+            self.report(key_fingerprint, *classified)
+            return classified[0]
+        finally:
+            metrics.observe("api_key_validation_seconds", time.monotonic() - started)
+        self._set(key_fingerprint, VALID, KEY_VALID_TTL_SECONDS)
+        return VALID
+
+    def report(self, key_fingerprint: str, status: str, retry_in: float = None):
+        """Status aprendido com um erro de chamada LLM (ver classify_error)."""
+        if status == INVALID:
+            self._set(key_fingerprint, INVALID, KEY_INVALID_TTL_SECONDS)
+        elif status == QUOTA_EXHAUSTED:
+            self._set(key_fingerprint, QUOTA_EXHAUSTED, retry_in or KEY_QUOTA_COOLDOWN_SECONDS)
+
+    def record(self, key_fingerprint: str, error=None):
+        """Resultado de uma chamada LLM feita com a chave (taxa de erro + status)."""
+        now = time.monotonic()
+        with self._lock:
+            outcomes = self._entry(key_fingerprint).outcomes
+            outcomes.append((now, error is None))
+            while outcomes and outcomes[0][0] < now - KEY_ERROR_WINDOW_SECONDS:
+                outcomes.popleft()
+        if error is None:
+            status, _ = self.status(key_fingerprint)
+            if status in (UNKNOWN, QUOTA_EXHAUSTED):
+                self._set(key_fingerprint, VALID, KEY_VALID_TTL_SECONDS)
+            return
+        classified = classify_error(error)
+        if classified is not None:
+            self.report(key_fingerprint, *classified)
+
+    def rejection(self, key_fingerprint: str, within: float = None):
+        """
+        KeyRejected se a chave não serve: inválida, ou sem cota por mais tempo que
+        `within` segundos (o que resta do prazo da requisição). None se ainda serve.
+        """
+        status, remaining = self.status(key_fingerprint)
+        if status == INVALID:
+            return KeyRejected(status, key_fingerprint)
+        if status == QUOTA_EXHAUSTED and (within is None or remaining > within):
+            return KeyRejected(status, key_fingerprint, remaining)
+        return None
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._entries.items())
+        keys = {}
+        for key_fingerprint, entry in entries:
+            recent = [ok for at, ok in entry.outcomes if at >= now - KEY_ERROR_WINDOW_SECONDS]
+            errors = recent.count(False)
+            keys[key_fingerprint] = {
+                "status": entry.status if entry.expires_at > now else UNKNOWN,
+                "expires_in_seconds": round(max(entry.expires_at - now, 0), 1),
+                "calls": len(recent),
+                "error_rate": metrics.ratio(errors, len(recent)),
+            }
+        return {"keys": len(keys), "by_key": keys}
+
+
+_registry = None
+
+
+def get_key_registry() -> KeyRegistry:
+    global _registry
+    if _registry is None:
+        _registry = KeyRegistry()
+    return _registry
+
+
+metrics.register_derived("api_keys", lambda: get_key_registry().stats())
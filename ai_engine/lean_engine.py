@@ -0,0 +1,273 @@
+"""
+Engine enxuto: function calling nativo do Gemini, sem CrewAI/LiteLLM no caminho.
+
+Os fluxos de WhatsApp e Instagram são sempre um agente e uma tarefa. Aqui o
+mesmo perfil de agente (get_whatsapp_profile / get_instagram_profile) e as
+mesmas ferramentas de tools.py são usados diretamente com o SDK google-genai:
+o prompt do sistema é o role/goal/backstory, as ferramentas viram function
+declarations geradas a partir dos args_schema e cada turno é uma única
+chamada generate_content. Sem scaffolding ReAct e sem Crew/Task.
+
+Seleção por tenant (ver engine_for_tenant):
+    AGENT_ENGINE=crewai|lean          engine padrão (crewai)
+    LEAN_ENGINE_TENANTS=inst_1,a@b.c  tenants que usam o engine enxuto
+    CREWAI_ENGINE_TENANTS=...         tenants forçados no CrewAI
+"""
+import asyncio
+import os
+import re
+import time
+import unicodedata
+
+import budgets
+import hedging
+import instrumentation
+import llm_transport
+from deadline import LLM_MIN_CALL_SECONDS
+from model_router import tier_of_model
+from tools import TOOLS_USAGE_STATE
+
+ENGINE_CREWAI = "crewai"
+ENGINE_LEAN = "lean"
+
+DEFAULT_ENGINE = os.getenv("AGENT_ENGINE", ENGINE_CREWAI)
+LEAN_ENGINE_TENANTS = {t.strip() for t in os.getenv("LEAN_ENGINE_TENANTS", "").split(",") if t.strip()}
+CREWAI_ENGINE_TENANTS = {t.strip() for t in os.getenv("CREWAI_ENGINE_TENANTS", "").split(",") if t.strip()}
+# Máximo de idas e voltas modelo -> ferramentas numa execução
+LEAN_MAX_TURNS = int(os.getenv("LEAN_MAX_TURNS", "8"))
+
+# Usado pelo benchmark_engines.py para rodar a mesma conversa nos dois engines
+FORCE_ENGINE = None
+
+_JSON_TYPES = {
+    "string": "STRING", "integer": "INTEGER", "number": "NUMBER",
+    "boolean": "BOOLEAN", "array": "ARRAY", "object": "OBJECT",
+}
+
+
+def engine_for_tenant(tenant_id: str) -> str:
+    if FORCE_ENGINE:
+        return FORCE_ENGINE
+    if tenant_id in CREWAI_ENGINE_TENANTS:
+        return ENGINE_CREWAI
+    if tenant_id in LEAN_ENGINE_TENANTS:
+        return ENGINE_LEAN
+    return DEFAULT_ENGINE
+
+
+def function_name(tool_name: str) -> str:
+    """'Enviar Áudio WhatsApp' -> 'enviar_audio_whatsapp' (nomes aceitos pelo Gemini)."""
+    ascii_name = unicodedata.normalize("NFKD", tool_name).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "_", ascii_name.lower()).strip("_")[:64]
+
+
+def gemini_schema(schema: dict, defs: dict = None) -> dict:
+    """Converte o JSON Schema do pydantic (args_schema) para o subconjunto OpenAPI aceito pelo Gemini."""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return gemini_schema(defs[schema["$ref"].split("/")[-1]], defs)
+
+    if "anyOf" in schema:
+        options = [option for option in schema["anyOf"] if option.get("type") != "null"]
+        converted = gemini_schema(options[0], defs) if options else {"type": "STRING"}
+        if len(options) < len(schema["anyOf"]):
+            converted["nullable"] = True
+        if schema.get("description"):
+            converted["description"] = schema["description"]
+        return converted
+
+    converted = {"type": _JSON_TYPES.get(schema.get("type"), "STRING")}
+    if schema.get("description"):
+        converted["description"] = schema["description"]
+    if schema.get("enum"):
+        converted["enum"] = [str(value) for value in schema["enum"]]
+    if converted["type"] == "ARRAY":
+        converted["items"] = gemini_schema(schema.get("items", {}), defs)
+    if converted["type"] == "OBJECT" and schema.get("properties"):
+        converted["properties"] = {
+            name: gemini_schema(prop, defs) for name, prop in schema["properties"].items()
+        }
+        if schema.get("required"):
+            converted["required"] = list(schema["required"])
+    return converted
+
+
+def function_declaration(tool) -> dict:
+    return {
+        "name": function_name(tool.name),
+        "description": " ".join(tool.description.split()),
+        "parameters": gemini_schema(tool.args_schema.model_json_schema()),
+    }
+
+
+def _client(api_key: str = None):
+    """Um genai.Client por chave sobre o transporte compartilhado (llm_transport.py)."""
+    return llm_transport.genai_client(api_key)
+
+
+class LeanCrew:
+    """
+    Execução de um agente + uma tarefa com function calling nativo.
+    Tem a mesma "cara" de um Crew para run_crew_with_retry: arun() devolve um
+    objeto com .raw e .token_usage (como o CrewOutput).
+    """
+
+    def __init__(self, profile: dict, description: str, expected_output: str, request_id: str, send_tool_name: str):
+        self.profile = profile
+        self.description = description
+        self.expected_output = expected_output
+        self.request_id = request_id
+        self.send_tool_name = send_tool_name
+        self.tools = {function_name(tool.name): tool for tool in profile["tools"]}
+
+    def _system_instruction(self) -> str:
+        return (
+            f"Você é {self.profile['role']}. {self.profile['backstory']}\n"
+            f"Seu objetivo: {self.profile['goal']}"
+        )
+
+    def _config(self):
+        from google.genai import types
+
+        llm_kwargs = self.profile["llm_kwargs"]
+        safety = llm_kwargs.get("safety_settings") or (llm_kwargs.get("config") or {}).get("safety_settings") or []
+        return types.GenerateContentConfig(
+            system_instruction=self._system_instruction(),
+            temperature=llm_kwargs.get("temperature", 0.7),
+            safety_settings=[types.SafetySetting(**setting) for setting in safety],
+            tools=[types.Tool(function_declarations=[function_declaration(t) for t in self.profile["tools"]])],
+            automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True),
+        )
+
+    def _model(self) -> str:
+        return self.profile["llm_kwargs"]["model"].split("/", 1)[-1]
+
+    def _sent(self) -> bool:
+        return TOOLS_USAGE_STATE.get(self.request_id, {}).get("sent", False)
+
+    async def _generate(self, client, contents, config):
+        state = TOOLS_USAGE_STATE.get(self.request_id, {})
+        budgets.check_llm(state)
+        deadline = state.get("deadline")
+        if deadline is not None:
+            deadline.require("llm", LLM_MIN_CALL_SECONDS)
+            return await asyncio.wait_for(self._generate_call(client, contents, config), timeout=deadline.clamp())
+        return await self._generate_call(client, contents, config)
+
+    async def _generate_call(self, client, contents, config):
+        started = time.monotonic()
+        response = None
+        error = None
+        try:
+            if hedging.HEDGING_ENABLED:
+                # generate_content só devolve function calls; as ferramentas rodam fora daqui
+                fallback_client = _client(hedging.HEDGE_FALLBACK_API_KEY) if hedging.HEDGE_FALLBACK_API_KEY else client
+                fallback_model = (hedging.HEDGE_FALLBACK_MODEL or self._model()).split("/", 1)[-1]
+                response = await hedging.ahedged_call(
+                    lambda: client.aio.models.generate_content(model=self._model(), contents=contents, config=config),
+                    lambda: fallback_client.aio.models.generate_content(model=fallback_model, contents=contents, config=config),
+                    tier_of_model(self._model()) or "other",
+                )
+            else:
+                response = await client.aio.models.generate_content(model=self._model(), contents=contents, config=config)
+            return response
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            usage = getattr(response, "usage_metadata", None)
+            input_tokens = (getattr(usage, "prompt_token_count", 0) or 0) if usage else 0
+            output_tokens = (getattr(usage, "candidates_token_count", 0) or 0) if usage else 0
+            instrumentation.record_llm_call(
+                self.request_id,
+                [c.model_dump(mode="json", exclude_none=True) if hasattr(c, "model_dump") else c for c in contents[-2:]],
+                _response_text(response) if response is not None else None,
+                error, input_tokens, output_tokens, elapsed,
+                model=self._model(), engine=ENGINE_LEAN,
+            )
+
+    async def _call_tool(self, call):
+        tool = self.tools.get(call.name)
+        if tool is None:
+            return {"error": f"Ferramenta desconhecida: {call.name}"}
+        try:
+            args = tool.args_schema(**(call.args or {})).model_dump()
+            return {"result": await tool._arun(**args)}
+        except Exception as e:
+            return {"error": str(e)}
+
+    async def _run_stub(self):
+        """Replay: o LLM_STUB serve a resposta gravada e executa as ferramentas gravadas."""
+        available = {tool.name: tool._run for tool in self.profile["tools"]}
+        messages = [
+            {"role": "system", "content": self._system_instruction()},
+            {"role": "user", "content": self._task_text()},
+        ]
+        started = time.monotonic()
+        response = await asyncio.to_thread(instrumentation.LLM_STUB, self.request_id, messages, {"available_functions": available})
+        instrumentation.record_llm_call(
+            self.request_id, messages, response, None,
+            instrumentation.estimate_tokens(messages), instrumentation.estimate_tokens(response),
+            time.monotonic() - started,
+        )
+        return response
+
+    def _task_text(self) -> str:
+        return f"{self.description}\n\nResultado esperado: {self.expected_output}"
+
+    async def arun(self):
+        if instrumentation.LLM_STUB is not None:
+            return LeanOutput(await self._run_stub())
+
+        from google.genai import types
+
+        client = _client(self.profile["llm_kwargs"].get("api_key"))
+        config = self._config()
+        contents = [types.Content(role="user", parts=[types.Part(text=self._task_text())])]
+        nudged = False
+        text = ""
+
+        for _ in range(LEAN_MAX_TURNS):
+            response = await self._generate(client, contents, config)
+            calls = response.function_calls or []
+            if response.candidates and response.candidates[0].content:
+                contents.append(response.candidates[0].content)
+
+            if calls:
+                # Chamadas do mesmo turno rodam juntas; os locks de tools.py mantêm a ordem dos efeitos colaterais
+                results = await asyncio.gather(*(self._call_tool(call) for call in calls))
+                contents.append(types.Content(role="user", parts=[
+                    types.Part.from_function_response(name=call.name, response=result)
+                    for call, result in zip(calls, results)
+                ]))
+                continue
+
+            text = _response_text(response)
+            if self._sent() or nudged or not text.strip():
+                break
+            # Mesmo papel da retry_task do main.py: o texto foi gerado mas não foi enviado
+            nudged = True
+            print("⚠️ Lean engine: resposta gerada sem usar a ferramenta de envio. Pedindo o envio.")
+            contents.append(types.Content(role="user", parts=[types.Part(text=(
+                f"Você gerou uma resposta mas NÃO usou a ferramenta '{self.send_tool_name}'. "
+                "Use-a agora para enviar EXATAMENTE esse texto ao cliente."
+            ))]))
+        else:
+            print(f"⚠️ Lean engine: limite de {LEAN_MAX_TURNS} turnos atingido")
+
+        return LeanOutput(text)
+
+
+class LeanOutput:
+    def __init__(self, raw: str):
+        self.raw = raw
+        self.token_usage = None
+
+    def __str__(self):
+        return self.raw
+
+
+def _response_text(response) -> str:
+    parts = (response.candidates[0].content.parts or []) if response.candidates and response.candidates[0].content else []
+    return "".join(part.text for part in parts if getattr(part, "text", None))
@@ -0,0 +1,179 @@
+"""
+Transporte HTTP compartilhado para o tráfego de LLM (Gemini via LiteLLM e SDK google-genai).
+
+Cada conversa monta LLMs novos (agents.py), e cada objeto LLM/cliente novo abria
+as próprias conexões com o endpoint do Gemini: o handshake TCP+TLS caía no
+caminho crítico da primeira chamada de toda conversa. Aqui o processo mantém um
+pool só, com keep-alive e HTTP/2 (quando o pacote h2 está instalado), usado por:
+
+  - LLMs do CrewAI via LiteLLM: o HTTPHandler compartilhado vai como `client` da
+    chamada (share_transport);
+  - clientes google-genai (lean_engine, classificação de intenção do
+    model_router e o provedor nativo do CrewAI): um genai.Client por chave de
+    API, porque o cliente carrega a credencial, todos sobre o mesmo pool HTTP
+    (as chamadas .aio usam o pool assíncrono do próprio cliente, que também
+    sobrevive entre requisições). Os clientes ficam num LRU de até
+    KEY_REGISTRY_MAX_KEYS chaves, indexado pela impressão digital da chave
+    (key_registry.fingerprint), nunca pela chave em si.
+
+O benchmark de latência da primeira chamada (pool novo x compartilhado, contra
+um servidor TLS local) está em benchmark_transport.py.
+
+Configuração:
+    LLM_SHARED_TRANSPORT=1          liga o pool compartilhado (padrão)
+    LLM_HTTP2=1                     HTTP/2 quando o h2 está disponível
+    LLM_POOL_MAX_CONNECTIONS=64
+    LLM_POOL_MAX_KEEPALIVE=32
+    LLM_POOL_KEEPALIVE_SECONDS=120  tempo que uma conexão ociosa fica aberta
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+from key_registry import KEY_REGISTRY_MAX_KEYS, fingerprint
+
+try:
+    import httpx
+except ImportError:  # httpx vem com o crewai/litellm
+    httpx = None
+
+LLM_SHARED_TRANSPORT = os.getenv("LLM_SHARED_TRANSPORT", "1") == "1"
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") == "1"
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "64"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "32"))
+LLM_POOL_KEEPALIVE_SECONDS = float(os.getenv("LLM_POOL_KEEPALIVE_SECONDS", "120"))
+# Timeout padrão do pool; cada chamada ainda passa o seu (prazo da requisição)
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "120"))
+
+_lock = threading.Lock()
+_sync_client = None
+_litellm_handler = None
+_genai_clients = OrderedDict()   # impressão digital da chave -> genai.Client (LRU)
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def client_options(**overrides) -> dict:
+    """Parâmetros do pool (também usados pelo benchmark_transport.py)."""
+    options = dict(
+        http2=LLM_HTTP2 and http2_available(),
+        limits=httpx.Limits(
+            max_connections=LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_POOL_KEEPALIVE_SECONDS,
+        ),
+        timeout=LLM_HTTP_TIMEOUT,
+    )
+    options.update(overrides)
+    return options
+
+
+def get_sync_client():
+    """httpx.Client do processo para chamadas síncronas (threads do executor)."""
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            _sync_client = httpx.Client(**client_options())
+        return _sync_client
+
+
+def _litellm_client():
+    """HTTPHandler do LiteLLM sobre o pool compartilhado (None se o LiteLLM não aceitar)."""
+    global _litellm_handler
+    if _litellm_handler is None:
+        try:
+            from litellm.llms.custom_httpx.http_handler import HTTPHandler
+        except ImportError:
+            return None
+        _litellm_handler = HTTPHandler(client=get_sync_client())
+    return _litellm_handler
+
+
+def _default_key(api_key: str = None):
+    return api_key or os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+
+
+def genai_client(api_key: str = None, cache: bool = True):
+    """
+    genai.Client por chave de API, todos sobre o pool HTTP compartilhado.
+    cache=False para chaves ainda não validadas (key_registry.py): não guarda o cliente.
+    """
+    from google import genai
+
+    key = _default_key(api_key)
+    if not cache:
+        return genai.Client(api_key=key, **_genai_http_options())
+    key_fingerprint = fingerprint(key) if key else None
+    with _lock:
+        client = _genai_clients.get(key_fingerprint)
+        if client is not None:
+            _genai_clients.move_to_end(key_fingerprint)
+            return client
+    client = genai.Client(api_key=key, **_genai_http_options())
+    with _lock:
+        client = _genai_clients.setdefault(key_fingerprint, client)
+        _genai_clients.move_to_end(key_fingerprint)
+        # O descartado não é fechado: o pool síncrono é o compartilhado, em uso pelos outros
+        while len(_genai_clients) > KEY_REGISTRY_MAX_KEYS:
+            _genai_clients.popitem(last=False)
+            metrics.inc("llm_genai_clients_evicted_total")
+        return client
+
+
+def _genai_http_options() -> dict:
+    if not LLM_SHARED_TRANSPORT or httpx is None:
+        return {}
+    from google.genai import types
+
+    # Versões antigas do SDK não aceitam clientes httpx próprios: ficam com o pool interno do cliente
+    if "httpx_client" not in getattr(types.HttpOptions, "model_fields", {}):
+        return {}
+    return {"http_options": types.HttpOptions(httpx_client=get_sync_client())}
+
+
+def share_transport(llm, api_key: str = None):
+    """
+    Faz um LLM do CrewAI usar o transporte compartilhado: o LLM via LiteLLM recebe
+    o HTTPHandler do pool em cada chamada; o provedor nativo do Gemini troca o
+    próprio genai.Client pelo cliente compartilhado da chave.
+    """
+    if not LLM_SHARED_TRANSPORT or httpx is None:
+        return llm
+    client = getattr(llm, "client", None)
+    if client is not None and type(client).__module__.startswith("google.genai"):
+        object.__setattr__(llm, "client", genai_client(api_key))
+        return llm
+    params = getattr(llm, "additional_params", None)
+    if isinstance(params, dict) and "client" not in params:
+        handler = _litellm_client()
+        if handler is not None:
+            params["client"] = handler
+    return llm
+
+
+def stats() -> dict:
+    return {
+        "enabled": LLM_SHARED_TRANSPORT,
+        "http2": bool(LLM_HTTP2 and http2_available()),
+        "genai_clients": len(_genai_clients),
+    }
+
+
+def close():
+    global _sync_client, _litellm_handler
+    with _lock:
+        if _sync_client is not None:
+            _sync_client.close()
+        _sync_client = None
+        _litellm_handler = None
+        _genai_clients.clear()
+
+
+metrics.register_derived("llm_transport", stats)
@@ -0,0 +1,113 @@
+"""
+Monitor de atraso (lag) do event loop.
+
+Todo webhook, o /health e o outbox dividem o mesmo event loop do uvicorn: um
+trecho síncrono pesado rodando nele (montar agentes, importar módulos, gravar
+arquivo) atrasa todas as outras requisições. O monitor mede isso de dois jeitos:
+
+  - uma tarefa no loop dorme LOOP_LAG_INTERVAL_SECONDS e mede quanto acordou
+    atrasada (event_loop_lag_seconds);
+  - uma thread de vigia confere o último batimento dessa tarefa; se o loop ficou
+    preso por mais de LOOP_BLOCK_THRESHOLD_SECONDS, loga a pilha da thread do
+    loop naquele momento (o callback que está bloqueando) e conta
+    event_loop_blocked_total. Uma pilha por bloqueio.
+
+Configuração:
+    LOOP_MONITOR=1                       liga o monitor (padrão)
+    LOOP_LAG_INTERVAL_SECONDS=0.25       intervalo entre amostras
+    LOOP_BLOCK_THRESHOLD_SECONDS=0.3     bloqueio a partir do qual a pilha é logada
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+LOOP_MONITOR = os.getenv("LOOP_MONITOR", "1") == "1"
+LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.25"))
+LOOP_BLOCK_THRESHOLD_SECONDS = float(os.getenv("LOOP_BLOCK_THRESHOLD_SECONDS", "0.3"))
+# Frames da pilha do loop mostrados no log de bloqueio
+BLOCK_STACK_LIMIT = 25
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL_SECONDS, threshold: float = LOOP_BLOCK_THRESHOLD_SECONDS):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_lag = 0.0
+        self.blocked = 0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    def start(self):
+        """Inicia a amostragem no loop atual e a thread de vigia (chamar de dentro do loop)."""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _sample(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - started - self.interval, 0.0)
+            self._heartbeat = now
+            self.max_lag = max(self.max_lag, lag)
+            metrics.observe("event_loop_lag_seconds", lag)
+            metrics.set_gauge("event_loop_lag_last_seconds", round(lag, 4))
+
+    def _watch(self):
+        reported = False   # já logou a pilha deste bloqueio
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            self.blocked += 1
+            metrics.inc("event_loop_blocked_total")
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame, limit=BLOCK_STACK_LIMIT)) if frame else "(pilha indisponível)\n"
+            print(f"🐢 Event loop bloqueado há {stalled:.2f}s (limite {self.threshold}s). Pilha do loop:\n{stack}", end="")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": LOOP_MONITOR,
+            "running": self._task is not None,
+            "lag_p50_seconds": metrics.percentile("event_loop_lag_seconds", 50),
+            "lag_p99_seconds": metrics.percentile("event_loop_lag_seconds", 99),
+            "lag_max_seconds": round(self.max_lag, 4),
+            "blocked": self.blocked,
+        }
+
+
+_monitor = None
+
+
+def get_loop_monitor() -> LoopMonitor:
+    global _monitor
+    if _monitor is None:
+        _monitor = LoopMonitor()
+    return _monitor
+
+
+metrics.register_derived("event_loop", lambda: get_loop_monitor().stats())
@@ -0,0 +1,117 @@
+"""
+Métricas em processo do AI Engine (contadores, gauges e histogramas simples).
+
+Sem dependências externas: os valores ficam em memória e são expostos em JSON
+pelo endpoint /metrics do main.py.
+"""
+import threading
+from collections import defaultdict, deque
+
+# Quantidade de amostras mantidas por histograma (janela deslizante)
+HISTOGRAM_WINDOW = 2048
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {}
+# Métricas calculadas sob demanda (ex: taxa de acerto do prefetch): nome -> callable()
+_derived = {}
+
+
+def _key(name, labels):
+    if not labels:
+        return name
+    rendered = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+    return f"{name}{{{rendered}}}"
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        if key not in _histograms:
+            _histograms[key] = {"count": 0, "sum": 0.0, "window": deque(maxlen=HISTOGRAM_WINDOW)}
+        hist = _histograms[key]
+        hist["count"] += 1
+        hist["sum"] += value
+        hist["window"].append(value)
+
+
+def counter(name, **labels):
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def counter_total(name):
+    """Soma de um contador em todas as combinações de labels."""
+    prefix = f"{name}{{"
+    with _lock:
+        return sum(v for k, v in _counters.items() if k == name or k.startswith(prefix))
+
+
+def histogram_count(name, **labels):
+    with _lock:
+        hist = _histograms.get(_key(name, labels))
+        return hist["count"] if hist else 0
+
+
+def percentile(name, q, **labels):
+    """Percentil (0-100) da janela recente do histograma, ou None se não houver amostras."""
+    with _lock:
+        hist = _histograms.get(_key(name, labels))
+        values = sorted(hist["window"]) if hist else []
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def ratio(numerator, denominator):
+    return round(numerator / denominator, 4) if denominator else None
+
+
+def register_derived(name, fn):
+    """Registra uma métrica calculada no momento do snapshot."""
+    _derived[name] = fn
+
+
+def snapshot():
+    """Estado atual de todas as métricas, pronto para serializar em JSON."""
+    with _lock:
+        histograms = {
+            key: (hist["count"], hist["sum"], sorted(hist["window"]))
+            for key, hist in _histograms.items()
+        }
+        result = {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "histograms": {},
+        }
+
+    for key, (count, total, values) in histograms.items():
+        def pick(q):
+            return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))] if values else None
+        result["histograms"][key] = {
+            "count": count,
+            "avg": round(total / count, 4) if count else None,
+            "p50": pick(50),
+            "p95": pick(95),
+            "p99": pick(99),
+        }
+
+    result["derived"] = {}
+    for name, fn in list(_derived.items()):
+        try:
+            result["derived"][name] = fn()
+        except Exception as e:
+            result["derived"][name] = f"error: {e}"
+    return result
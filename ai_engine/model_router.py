@@ -0,0 +1,210 @@
+"""
+Roteamento de modelos por etapa e por tenant.
+
+Cada execução recebe um ModelRoute que diz qual tier de modelo usar em cada
+etapa:
+  - intent:    classificação da mensagem (heurística; LLM só se ROUTER_INTENT_LLM=1)
+  - tool_args: preenchimento de argumentos de ferramenta (function_calling_llm)
+  - wording:   raciocínio e redação da resposta (llm principal do agente),
+               com tier diferente por intenção (ex: conversa x agendamento)
+
+As políticas são nomeadas (economy / balanced / quality / legacy) e podem ser
+escolhidas por tenant com MODEL_ROUTING_POLICIES='{"instance_1": "quality"}'
+ou sobrescritas etapa a etapa ('{"instance_2": {"wording": "flash"}}').
+Em falha (retry do crew) a rota sobe um tier (escalate). Tenant acima do
+orçamento de consumo (accounting.py) roda rebaixado: todas as etapas no tier
+mais barato, escalando no máximo até ele. Latência, tokens e custo estimado de
+cada chamada vão para as métricas com o label tier.
+"""
+import json
+import os
+import re
+import unicodedata
+from dataclasses import dataclass, field
+
+TIERS = {
+    "lite": "gemini/gemini-2.5-flash-lite",
+    "flash": "gemini/gemini-2.5-flash",
+    "pro": "gemini/gemini-2.5-pro",
+}
+TIER_ORDER = ["lite", "flash", "pro"]
+
+# USD por 1M tokens (entrada, saída) - usado só para estimar custo nas métricas
+TIER_PRICES = {
+    "lite": (0.10, 0.40),
+    "flash": (0.30, 2.50),
+    "pro": (1.25, 10.00),
+}
+
+INTENT_CHAT = "chat"
+INTENT_SCHEDULING = "scheduling"
+
+POLICIES = {
+    # Tudo no modelo mais barato
+    "economy": {"intent": "lite", "tool_args": "lite", "wording": {INTENT_CHAT: "lite", INTENT_SCHEDULING: "lite"}},
+    "balanced": {"intent": "lite", "tool_args": "lite", "wording": {INTENT_CHAT: "lite", INTENT_SCHEDULING: "flash"}},
+    "quality": {"intent": "lite", "tool_args": "flash", "wording": {INTENT_CHAT: "flash", INTENT_SCHEDULING: "flash"}},
+    # Comportamento anterior ao roteamento: flash em tudo
+    "legacy": {"intent": "flash", "tool_args": "flash", "wording": {INTENT_CHAT: "flash", INTENT_SCHEDULING: "flash"}},
+}
+
+DEFAULT_POLICY = os.getenv("MODEL_ROUTING_DEFAULT", "balanced")
+ROUTER_INTENT_LLM = os.getenv("ROUTER_INTENT_LLM", "0") == "1"
+
+_SCHEDULING_WORDS = re.compile(
+    r"\b(agend\w*|marc\w*|remarc\w*|reagend\w*|cancel\w*|desmarc\w*|horario\w*|hora|horas|"
+    r"disponi\w*|vaga\w*|consulta\w*|amanha|hoje|segunda|terca|quarta|quinta|sexta|sabado|domingo|"
+    r"dia \d{1,2}|\d{1,2}/\d{1,2}|\d{1,2}h|\d{1,2}:\d{2})\b"
+)
+
+
+def _load_tenant_policies() -> dict:
+    raw = os.getenv("MODEL_ROUTING_POLICIES", "")
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError as e:
+        print(f"⚠️ MODEL_ROUTING_POLICIES inválido, usando '{DEFAULT_POLICY}': {e}")
+        return {}
+
+
+TENANT_POLICIES = _load_tenant_policies()
+
+
+def policy_for(tenant_id: str) -> dict:
+    """Política do tenant: nome de política, overrides parciais sobre a padrão, ou a padrão."""
+    base = POLICIES.get(DEFAULT_POLICY, POLICIES["balanced"])
+    custom = TENANT_POLICIES.get(tenant_id)
+    if isinstance(custom, str):
+        return POLICIES.get(custom, base)
+    if isinstance(custom, dict):
+        merged = {**base, **{k: v for k, v in custom.items() if k != "wording"}}
+        wording = custom.get("wording")
+        if isinstance(wording, str):
+            merged["wording"] = {intent: wording for intent in base["wording"]}
+        elif isinstance(wording, dict):
+            merged["wording"] = {**base["wording"], **wording}
+        return merged
+    return base
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def detect_intent(message: str, history=None) -> str:
+    """
+    Intenção da mensagem atual. Agendamento se a mensagem (ou a última resposta
+    do atendente, caso o cliente esteja respondendo a ela) fala de datas/horários.
+    """
+    if _SCHEDULING_WORDS.search(_normalize(message)):
+        return INTENT_SCHEDULING
+    if history:
+        last_assistant = next(
+            (getattr(item, "content", "") for item in reversed(history)
+             if getattr(item, "role", "") in ("assistant", "model")),
+            "",
+        )
+        # "Sim", "pode", o nome ou o e-mail em resposta a um resumo de agendamento
+        if _SCHEDULING_WORDS.search(_normalize(last_assistant)):
+            return INTENT_SCHEDULING
+    return INTENT_CHAT
+
+
+def _escalated(tier: str, ceiling: str = None) -> str:
+    index = TIER_ORDER.index(tier) if tier in TIER_ORDER else 0
+    top = TIER_ORDER.index(ceiling) if ceiling in TIER_ORDER else len(TIER_ORDER) - 1
+    return TIER_ORDER[max(min(index + 1, top), index)]
+
+
+@dataclass
+class ModelRoute:
+    tenant_id: str
+    intent: str
+    tiers: dict = field(default_factory=dict)   # etapa -> tier
+    escalations: int = 0
+    ceiling: str = None   # tier máximo (rota rebaixada por orçamento)
+
+    def tier(self, step: str) -> str:
+        return self.tiers[step]
+
+    def model(self, step: str) -> str:
+        return TIERS[self.tiers[step]]
+
+    def describe(self) -> dict:
+        described = {"intent": self.intent, "tiers": dict(self.tiers), "escalations": self.escalations}
+        if self.ceiling:
+            described["ceiling"] = self.ceiling
+        return described
+
+    def downgrade(self, tier: str = TIER_ORDER[0]):
+        """Todas as etapas no tier dado, que passa a ser o teto das escaladas."""
+        self.tiers = {step: tier for step in self.tiers}
+        self.ceiling = tier
+        print(f"⬇️ Model route rebaixada para {tier} (orçamento de consumo do tenant)")
+
+    def escalate(self) -> bool:
+        """Sobe um tier em tool_args e wording. Retorna False se já está no topo."""
+        changed = False
+        for step in ("tool_args", "wording"):
+            new_tier = _escalated(self.tiers[step], self.ceiling)
+            if new_tier != self.tiers[step]:
+                self.tiers[step] = new_tier
+                changed = True
+        if changed:
+            self.escalations += 1
+            print(f"⬆️ Model route escalada para tool_args={self.tiers['tool_args']} wording={self.tiers['wording']}")
+        return changed
+
+
+def route_for(tenant_id: str, message: str, history=None, api_key: str = None) -> ModelRoute:
+    """Rota da execução. Com ROUTER_INTENT_LLM=1 faz uma chamada síncrona: rodar fora do event loop."""
+    policy = policy_for(tenant_id)
+    intent = detect_intent(message, history)
+    if ROUTER_INTENT_LLM and intent == INTENT_CHAT:
+        intent = _llm_intent(message, TIERS[policy["intent"]], api_key) or intent
+    wording = policy["wording"]
+    return ModelRoute(
+        tenant_id=tenant_id,
+        intent=intent,
+        tiers={
+            "intent": policy["intent"],
+            "tool_args": policy["tool_args"],
+            "wording": wording.get(intent, wording.get(INTENT_SCHEDULING, "flash")),
+        },
+    )
+
+
+def _llm_intent(message: str, model: str, api_key: str = None):
+    """Classificação por LLM (tier 'intent') para mensagens que a heurística não pegou."""
+    try:
+        from llm_transport import genai_client
+
+        client = genai_client(api_key)
+        response = client.models.generate_content(
+            model=model.split("/", 1)[-1],
+            contents=(
+                "Classifique a mensagem de um cliente de WhatsApp. Responda só 'scheduling' se ela "
+                "envolver marcar, remarcar, cancelar ou consultar horários; senão 'chat'.\n\n"
+                f"Mensagem: {message}"
+            ),
+        )
+        answer = (response.text or "").strip().lower()
+        return INTENT_SCHEDULING if answer.startswith("scheduling") else INTENT_CHAT
+    except Exception as e:
+        print(f"⚠️ Classificação de intenção por LLM falhou: {e}")
+        return None
+
+
+def tier_of_model(model: str):
+    for tier, name in TIERS.items():
+        if name == model or name.split("/", 1)[-1] == model:
+            return tier
+    return None
+
+
+def estimate_cost_usd(tier: str, input_tokens: int, output_tokens: int) -> float:
+    price_in, price_out = TIER_PRICES.get(tier, TIER_PRICES["flash"])
+    return (input_tokens * price_in + output_tokens * price_out) / 1_000_000
@@ -0,0 +1,234 @@
+"""
+Outbox durável para mensagens de saída (WhatsApp / Instagram).
+
+As ferramentas de envio gravam a mensagem final numa fila local em SQLite (WAL)
+e retornam na hora. Um sender em background entrega ao backend Node mantendo a
+ordem por destinatário, com retries e backoff exponencial. Assim, uma falha
+momentânea do backend não custa uma nova execução do LLM, e nada se perde se o
+processo reiniciar (mensagens 'sending' voltam para 'pending' no startup).
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from http_client import BackendCall, send_sync
+
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "1") == "1"
+OUTBOX_DB_PATH = os.getenv("OUTBOX_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "outbox.db"))
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_SEND_TIMEOUT = float(os.getenv("OUTBOX_SEND_TIMEOUT", "30"))
+OUTBOX_BASE_BACKOFF = 1.0   # segundos (dobra a cada tentativa)
+OUTBOX_MAX_BACKOFF = 120.0
+OUTBOX_POLL_INTERVAL = 0.5
+OUTBOX_RETENTION_SECONDS = 24 * 3600  # mensagens entregues/falhas ficam 1 dia para consulta
+
+PENDING, SENDING, DELIVERED, FAILED = "pending", "sending", "delivered", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    request_id TEXT,
+    channel TEXT NOT NULL,
+    path TEXT NOT NULL,
+    recipient_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    delivered_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_recipient ON outbox (recipient_key, state, id);
+CREATE INDEX IF NOT EXISTS idx_outbox_state ON outbox (state, next_attempt_at);
+"""
+
+
+class Outbox:
+    def __init__(self, path=OUTBOX_DB_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._in_flight = set()
+        self._thread = None
+        self._pool = None
+        # Listeners chamados com (row_id, state) a cada mudança de estado terminal
+        self.listeners = []
+
+    # ------------------------------------------------------------------ API
+
+    def enqueue(self, channel: str, path: str, recipient_key: str, payload: dict, request_id: str = None) -> int:
+        """Grava a mensagem de forma durável e acorda o sender. Retorna o id da linha."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO outbox (request_id, channel, path, recipient_key, payload, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (request_id, channel, path, recipient_key, json.dumps(payload, ensure_ascii=False), now, now),
+            )
+            row_id = cursor.lastrowid
+        metrics.inc("outbox_enqueued_total", channel=channel)
+        self._wakeup.set()
+        return row_id
+
+    def status(self, row_id: int):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, channel, recipient_key, state, attempts, created_at, delivered_at, last_error "
+                "FROM outbox WHERE id = ?", (row_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "channel", "recipient_key", "state", "attempts", "created_at", "delivered_at", "last_error")
+        return dict(zip(keys, row))
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall()
+            oldest = self._conn.execute("SELECT MIN(created_at) FROM outbox WHERE state IN ('pending', 'sending')").fetchone()[0]
+        counts = {state: count for state, count in rows}
+        return {
+            "pending": counts.get(PENDING, 0),
+            "sending": counts.get(SENDING, 0),
+            "delivered": counts.get(DELIVERED, 0),
+            "failed": counts.get(FAILED, 0),
+            "oldest_pending_age_seconds": round(time.time() - oldest, 1) if oldest else 0,
+            "in_flight_recipients": len(self._in_flight),
+        }
+
+    # --------------------------------------------------------------- sender
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            # Crash recovery: o que estava 'sending' quando o processo caiu volta para a fila
+            self._conn.execute("UPDATE outbox SET state = 'pending' WHERE state = 'sending'")
+        self._stop.clear()
+        self._pool = ThreadPoolExecutor(max_workers=OUTBOX_WORKERS, thread_name_prefix="outbox")
+        self._thread = threading.Thread(target=self._loop, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+        print(f"📮 Outbox iniciado ({OUTBOX_DB_PATH}, {OUTBOX_WORKERS} workers)")
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._pool:
+            self._pool.shutdown(wait=True)
+
+    def _loop(self):
+        last_prune = 0.0
+        while not self._stop.is_set():
+            try:
+                for row in self._due_heads():
+                    self._in_flight.add(row[4])
+                    self._pool.submit(self._deliver, row)
+                if time.time() - last_prune > 3600:
+                    self._prune()
+                    last_prune = time.time()
+                stats = self.stats()
+                metrics.set_gauge("outbox_pending", stats["pending"] + stats["sending"])
+                metrics.set_gauge("outbox_oldest_pending_age_seconds", stats["oldest_pending_age_seconds"])
+            except Exception:
+                print(f"❌ Outbox loop error: {traceback.format_exc()}")
+            self._wakeup.wait(OUTBOX_POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def _due_heads(self):
+        """
+        A mensagem mais antiga não entregue de cada destinatário, se já estiver na hora.
+        Destinatários com envio em andamento são ignorados (ordem por destinatário).
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT o.id, o.channel, o.path, o.payload, o.recipient_key, o.attempts FROM outbox o "
+                "JOIN (SELECT recipient_key, MIN(id) AS head FROM outbox "
+                "      WHERE state IN ('pending', 'sending') GROUP BY recipient_key) h ON o.id = h.head "
+                "WHERE o.state = 'pending' AND o.next_attempt_at <= ?",
+                (now,),
+            ).fetchall()
+            due = [row for row in rows if row[4] not in self._in_flight]
+            for row in due:
+                self._conn.execute("UPDATE outbox SET state = 'sending' WHERE id = ?", (row[0],))
+        return due
+
+    def _deliver(self, row):
+        row_id, channel, path, payload, recipient_key, attempts = row
+        attempts += 1
+        started = time.monotonic()
+        error = None
+        permanent = False
+        try:
+            response = send_sync(BackendCall("POST", path, json=json.loads(payload), timeout=OUTBOX_SEND_TIMEOUT))
+            if response.status_code == 200:
+                self._finish(row_id, DELIVERED, attempts)
+                metrics.inc("outbox_delivered_total", channel=channel)
+                metrics.observe("outbox_delivery_seconds", time.monotonic() - started, channel=channel)
+                return
+            error = f"HTTP {response.status_code}: {response.text[:200]}"
+            # 400 = payload inválido: repetir não resolve
+            permanent = response.status_code == 400
+        except Exception as e:
+            error = str(e)
+        finally:
+            self._in_flight.discard(recipient_key)
+            self._wakeup.set()
+
+        if permanent or attempts >= OUTBOX_MAX_ATTEMPTS:
+            print(f"❌ Outbox: mensagem {row_id} para {recipient_key} descartada após {attempts} tentativas: {error}")
+            self._finish(row_id, FAILED, attempts, error)
+            metrics.inc("outbox_failed_total", channel=channel)
+            return
+
+        backoff = min(OUTBOX_MAX_BACKOFF, OUTBOX_BASE_BACKOFF * (2 ** (attempts - 1))) * random.uniform(0.8, 1.2)
+        print(f"⚠️ Outbox: falha ao entregar {row_id} (tentativa {attempts}): {error}. Nova tentativa em {backoff:.1f}s")
+        metrics.inc("outbox_retries_total", channel=channel)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET state = 'pending', attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, time.time() + backoff, error, row_id),
+            )
+
+    def _finish(self, row_id, state, attempts, error=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET state = ?, attempts = ?, delivered_at = ?, last_error = ? WHERE id = ?",
+                (state, attempts, time.time() if state == DELIVERED else None, error, row_id),
+            )
+        for listener in list(self.listeners):
+            try:
+                listener(row_id, state)
+            except Exception as e:
+                print(f"⚠️ Outbox listener falhou: {e}")
+
+    def _prune(self):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM outbox WHERE state IN ('delivered', 'failed') AND created_at < ?",
+                (time.time() - OUTBOX_RETENTION_SECONDS,),
+            )
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox() -> Outbox:
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+        return _outbox
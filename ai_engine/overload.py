@@ -0,0 +1,135 @@
+"""
+Controle de sobrecarga (load shedding) na entrada do pipeline.
+
+Sem isso, com o engine saturado as requisições só se acumulam na fila até o
+prazo estourar: o cliente não recebe nada e o Node pode reenviar, piorando a
+sobrecarga. Cada webhook passa por OverloadController.admit antes de entrar na
+fila do scheduler.py:
+
+  - queue_depth: fila total acima de OVERLOAD_MAX_QUEUE -> descarta;
+  - latency: controle no estilo CoDel sobre o tempo de espera na fila
+    (sojourn). Se a espera ficou acima do alvo por um intervalo inteiro, o
+    controlador entra em "dropping" e descarta chegadas com frequência
+    crescente (intervalo / sqrt(n)) até a espera voltar ao alvo.
+Confirmações de agendamento em andamento (faixa prioritária) só são
+descartadas pelo limite de fila.
+
+Descartar significa enviar na hora um aviso leve ao cliente e então, conforme
+OVERLOAD_SHED_MODE, adiar a execução completa (fila "deferred", atendida só
+quando não há outras esperando, com prazo estendido) ou não executá-la.
+
+Configuração:
+    OVERLOAD_CONTROL=1                 liga o controle (padrão)
+    OVERLOAD_MAX_QUEUE=40              fila total máxima
+    OVERLOAD_TARGET_SECONDS=5          espera alvo na fila
+    OVERLOAD_INTERVAL_SECONDS=10       tempo acima do alvo antes de descartar
+    OVERLOAD_SHED_MODE=defer|drop
+    OVERLOAD_DEFER_SECONDS=300         prazo da execução adiada
+"""
+import math
+import os
+import threading
+import time
+
+import metrics
+
+OVERLOAD_CONTROL = os.getenv("OVERLOAD_CONTROL", "1") == "1"
+OVERLOAD_MAX_QUEUE = int(os.getenv("OVERLOAD_MAX_QUEUE", "40"))
+OVERLOAD_TARGET_SECONDS = float(os.getenv("OVERLOAD_TARGET_SECONDS", "5"))
+OVERLOAD_INTERVAL_SECONDS = float(os.getenv("OVERLOAD_INTERVAL_SECONDS", "10"))
+OVERLOAD_SHED_MODE = os.getenv("OVERLOAD_SHED_MODE", "defer")
+OVERLOAD_DEFER_SECONDS = float(os.getenv("OVERLOAD_DEFER_SECONDS", "300"))
+
+OVERLOAD_ACK_MESSAGE = os.getenv("OVERLOAD_ACK_MESSAGE", "Recebi sua mensagem, já te respondo! 😊")
+
+SHED_QUEUE_DEPTH = "queue_depth"
+SHED_LATENCY = "latency"
+
+
+class OverloadController:
+    def __init__(self, queue_depth, max_queue: int = OVERLOAD_MAX_QUEUE,
+                 target: float = OVERLOAD_TARGET_SECONDS, interval: float = OVERLOAD_INTERVAL_SECONDS):
+        # queue_depth: callable com a fila total atual (scheduler.FairScheduler.waiting)
+        self.queue_depth = queue_depth
+        self.max_queue = max_queue
+        self.target = target
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._first_above = None   # quando a espera ficou acima do alvo (+ intervalo)
+        self._dropping = False
+        self._drop_next = 0.0
+        self._drop_count = 0
+
+    def record_sojourn(self, seconds: float):
+        """Tempo que uma execução esperou na fila (listener do scheduler)."""
+        now = time.monotonic()
+        with self._lock:
+            if seconds < self.target:
+                self._first_above = None
+                if self._dropping:
+                    print("✅ Sobrecarga encerrada: espera na fila voltou ao alvo")
+                self._dropping = False
+                return
+            if self._first_above is None:
+                self._first_above = now + self.interval
+            elif now >= self._first_above and not self._dropping:
+                print(f"🚦 Sobrecarga: espera na fila acima de {self.target}s por {self.interval}s")
+                self._dropping = True
+                self._drop_count = 0
+                self._drop_next = now
+
+    def overloaded(self) -> bool:
+        return self._dropping
+
+    def admit(self, priority: bool = False):
+        """None se a requisição pode entrar na fila, ou o motivo do descarte."""
+        depth = self.queue_depth()
+        metrics.set_gauge("overload_queue_depth", depth)
+        if depth >= self.max_queue:
+            return self._shed(SHED_QUEUE_DEPTH)
+        with self._lock:
+            if depth == 0:
+                # Fila vazia: a medição de espera ficou velha
+                self._first_above = None
+                self._dropping = False
+                return None
+            if priority or not self._dropping:
+                return None
+            now = time.monotonic()
+            if now < self._drop_next:
+                return None
+            # Lei de controle do CoDel: descartes cada vez mais próximos enquanto durar a sobrecarga
+            self._drop_count += 1
+            self._drop_next = now + self.interval / math.sqrt(self._drop_count)
+        return self._shed(SHED_LATENCY)
+
+    def _shed(self, reason: str) -> str:
+        metrics.inc("overload_shed_total", reason=reason, mode=OVERLOAD_SHED_MODE)
+        return reason
+
+    def stats(self) -> dict:
+        return {
+            "enabled": OVERLOAD_CONTROL,
+            "dropping": self._dropping,
+            "queue_depth": self.queue_depth(),
+            "max_queue": self.max_queue,
+            "target_seconds": self.target,
+            "mode": OVERLOAD_SHED_MODE,
+        }
+
+
+_controller = None
+
+
+def get_overload_controller() -> OverloadController:
+    global _controller
+    if _controller is None:
+        from scheduler import get_scheduler
+
+        scheduler = get_scheduler()
+        _controller = OverloadController(scheduler.waiting)
+        scheduler.wait_listeners.append(_controller.record_sojourn)
+    return _controller
+
+
+metrics.register_derived("overload", lambda: get_overload_controller().stats())
@@ -0,0 +1,655 @@
+"""
+Pipeline de conversa independente de canal: ingest -> route -> execute -> deliver.
+
+Os webhooks de WhatsApp e Instagram (main.py) só validam o payload e chamam
+run_conversation com o adaptador do canal. Tudo o mais é comum aos dois:
+
+  - ingest:  estado da requisição, gravação, prazo (deadline.py) e orçamento (budgets.py)
+  - key:     chave de API do tenant (key_registry.py): chave inválida ou sem cota
+             falha na hora, ou cai na chave do ambiente conforme a política do tenant
+  - route:   tier de modelo (model_router.py) e engine (lean_engine.py) do tenant,
+             rebaixados quando o tenant passou do orçamento de consumo (accounting.py)
+  - admit:   controle de sobrecarga (overload.py): aviso imediato ao cliente e
+             execução adiada ou descartada quando o engine está saturado
+  - execute: vaga no escalonador entre tenants (scheduler.py), agentes/crew montados
+             pelo adaptador (numa thread: a montagem é síncrona e pesada e não pode
+             travar o event loop, ver loop_monitor.py), retry com escalada de tier
+  - deliver: retry forçado quando o agente não usou a ferramenta de envio, ou
+             mensagem de aviso quando o prazo/orçamento acaba (abort_run)
+
+O ChannelAdapter concentra o que muda por canal: a ferramenta e a rota de envio,
+o destinatário travado nas ferramentas, os perfis de agente e o texto da tarefa.
+"""
+import asyncio
+import contextlib
+import random
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import metrics
+from accounting import (
+    ACCOUNTING_ENABLED, ON_EXCEED_BOTH, ON_EXCEED_ECONOMY, ON_EXCEED_LEAN, get_accounting, usage_budget_for,
+)
+from budgets import BudgetExceeded, BUDGET_ABORT_MESSAGE
+from deadline import Deadline, DeadlineExceeded, deadline_for, CREW_MIN_ATTEMPT_SECONDS, HOLDING_MESSAGE
+from http_client import BackendCall, send_sync
+from instrumentation import new_request_state, absorb_crew_usage, finish_request
+from key_registry import (
+    FALLBACK_ENV, KEY_VALIDATION_TIMEOUT_SECONDS, KeyRejected, environment_key, fallback_for, fingerprint,
+    get_key_registry,
+)
+from lean_engine import LeanCrew, ENGINE_LEAN, engine_for_tenant
+from model_router import route_for, ROUTER_INTENT_LLM
+from overload import (
+    OVERLOAD_CONTROL, OVERLOAD_SHED_MODE, OVERLOAD_DEFER_SECONDS, OVERLOAD_ACK_MESSAGE, get_overload_controller,
+)
+from prefetch import PREFETCH_ENABLED, extract_candidate_dates, start_prefetch, prefetch_context
+from recorder import start_recording
+from scheduler import CREW_WORKERS, LANE_DEFERRED, LANE_NORMAL, LANE_PRIORITY, booking_in_progress, get_scheduler
+from tools import TOOLS_USAGE_STATE, enqueue_outbound
+
+
+def format_history(history) -> str:
+    if not history:
+        return "Nenhum histórico disponível."
+    
+    formatted = []
+    for item in history:
+        role_pt = "Atendente" if item.role in ["assistant", "model"] else "Cliente"
+        formatted.append(f"{role_pt}: {item.content}")
+    
+    # Pegar as últimas 40 mensagens para manter contexto robusto (Gemini aguenta muito mais)
+    return "\n".join(formatted[-30:])
+
+
+
+
+# Timeout configuration (in seconds)
+CREW_TIMEOUT_SECONDS = 90  # Maximum time to wait for crew.kickoff() (limitado pelo prazo da requisição)
+
+# Thread pool for running synchronous crew operations (vagas controladas pelo scheduler.py)
+_executor = ThreadPoolExecutor(max_workers=CREW_WORKERS)
+
+async def run_crew_with_timeout(crew, timeout=CREW_TIMEOUT_SECONDS):
+    """
+    Executa o crew.kickoff() com timeout para evitar travamentos.
+    Usa ThreadPoolExecutor para rodar a operação síncrona em thread separada.
+    """
+    loop = asyncio.get_event_loop()
+    
+    try:
+        print(f"⏱️ Iniciando crew.kickoff() com timeout de {timeout}s...")
+        if isinstance(crew, LeanCrew):
+            # Engine enxuto é assíncrono de ponta a ponta: roda no próprio event loop
+            result = await asyncio.wait_for(crew.arun(), timeout=timeout)
+        else:
+            # Run synchronous crew.kickoff() in thread pool with timeout
+            result = await asyncio.wait_for(
+                loop.run_in_executor(_executor, crew.kickoff),
+                timeout=timeout
+            )
+        print(f"✅ crew.kickoff() completado com sucesso")
+        return result
+    except asyncio.TimeoutError:
+        print(f"❌ TIMEOUT: crew.kickoff() excedeu {timeout}s")
+        raise TimeoutError(f"O processamento excedeu o limite de {timeout} segundos. Tente novamente.")
+
+async def _backoff(wait_time, deadline=None):
+    """Espera antes da próxima tentativa, se ainda couber uma tentativa depois dela."""
+    if deadline is not None and not deadline.fits(wait_time + CREW_MIN_ATTEMPT_SECONDS):
+        raise DeadlineExceeded("crew_retry", deadline.remaining())
+    await asyncio.sleep(wait_time)
+
+async def _escalated_crew(crew, escalate):
+    """Crew da próxima tentativa: o escalado (modelo de tier maior) ou o mesmo (montado fora do event loop)."""
+    if escalate is None:
+        return crew
+    return await asyncio.to_thread(escalate) or crew
+
+async def run_crew_with_retry(crew, retries=3, delay=2, request_id=None, escalate=None, deadline=None):
+    """
+    Executa o crew.kickoff() com mecanismo de retry e timeout.
+    IMPORTANT: If request_id is provided, checks if message was already sent before retrying.
+    escalate (opcional) é chamado numa thread antes de cada nova tentativa e pode devolver
+    um novo crew montado com modelos de tier maior (ver model_router.py).
+    deadline (opcional, deadline.Deadline) limita o timeout de cada tentativa e impede
+    tentativas e esperas que não cabem no tempo restante (levanta DeadlineExceeded).
+    """
+    last_exception = None
+    
+    for attempt in range(retries):
+        timeout = CREW_TIMEOUT_SECONDS
+        if deadline is not None:
+            deadline.require("crew_attempt", CREW_MIN_ATTEMPT_SECONDS)
+            timeout = deadline.clamp(CREW_TIMEOUT_SECONDS)
+        try:
+            result = await run_crew_with_timeout(crew, timeout=timeout)
+            
+            # Check for None or empty response from LLM
+            if result is None or (isinstance(result, str) and not result.strip()):
+                raise ValueError("Invalid response from LLM call - None or empty")
+            
+            return result
+        except TimeoutError as e:
+            last_exception = e
+            # ANTI-DUPLICATION: Check if message was already sent before retrying
+            if request_id and TOOLS_USAGE_STATE.get(request_id, {}).get("sent", False):
+                print(f"✅ Message already sent for request {request_id}. Stopping retry despite timeout.")
+                return "Mensagem já enviada com sucesso."
+            if deadline is not None and not deadline.fits(CREW_MIN_ATTEMPT_SECONDS):
+                raise DeadlineExceeded(getattr(e, "stage", "crew_attempt"), deadline.remaining()) from e
+            if attempt < retries - 1:
+                wait_time = delay * (attempt + 1)
+                print(f"⚠️ Timeout (Tentativa {attempt+1}/{retries}). Tentando novamente em {wait_time}s...")
+                await _backoff(wait_time, deadline)
+                crew = await _escalated_crew(crew, escalate)
+            else:
+                print(f"❌ Timeout após {retries} tentativas.")
+                raise e
+        except Exception as e:
+            last_exception = e
+            error_str = str(e)
+            
+            # ANTI-DUPLICATION: Check if message was already sent before retrying
+            if request_id and TOOLS_USAGE_STATE.get(request_id, {}).get("sent", False):
+                print(f"✅ Message already sent for request {request_id}. Stopping retry despite error: {error_str[:50]}...")
+                return "Mensagem já enviada com sucesso."
+
+            # O CrewAI pode embrulhar o DeadlineExceeded/BudgetExceeded de uma chamada LLM em outra exceção
+            if deadline is not None and not deadline.fits(CREW_MIN_ATTEMPT_SECONDS):
+                raise DeadlineExceeded("crew_attempt", deadline.remaining()) from e
+            exceeded = TOOLS_USAGE_STATE.get(request_id, {}).get("budget_exceeded") if request_id else None
+            if exceeded:
+                # Orçamento esgotado não se resolve com outra tentativa
+                if isinstance(e, BudgetExceeded):
+                    raise
+                raise BudgetExceeded(exceeded) from e
+            # Chave inválida (ou sem cota além do prazo) também não: o registro já aprendeu com a chamada
+            rejected = _key_rejection(request_id, deadline)
+            if rejected is not None:
+                raise rejected from e
+            
+            # Verificar se é erro de resposta vazia (transiente)
+            if "None or empty" in error_str or "Invalid response from LLM" in error_str:
+                wait_time = delay * (attempt + 1) + random.uniform(0.5, 2)
+                print(f"⚠️ Resposta vazia do LLM (Tentativa {attempt+1}/{retries}). Tentando novamente em {wait_time:.1f}s...")
+                await _backoff(wait_time, deadline)
+                crew = await _escalated_crew(crew, escalate)
+            # Verificar se é erro 500 ou mensagem de erro interno
+            elif "500" in error_str or "Internal error" in error_str or "INTERNAL" in error_str:
+                wait_time = delay * (attempt + 1) + random.uniform(0, 1)
+                print(f"⚠️ Erro 500 detectado (Tentativa {attempt+1}/{retries}). Tentando novamente em {wait_time:.1f}s...")
+                await _backoff(wait_time, deadline)
+                crew = await _escalated_crew(crew, escalate)
+            # Rate limit errors
+            elif "429" in error_str or "quota" in error_str.lower() or "rate" in error_str.lower():
+                wait_time = delay * (attempt + 1) * 2 + random.uniform(1, 3)
+                print(f"⚠️ Rate limit detectado (Tentativa {attempt+1}/{retries}). Tentando novamente em {wait_time:.1f}s...")
+                await _backoff(wait_time, deadline)
+                crew = await _escalated_crew(crew, escalate)
+            else:
+                # Se não for erro de servidor/transiente, falha imediatamente (ex: erro de validação)
+                raise e
+                
+    # Se esgotou tentativas - verificar se mensagem foi enviada mesmo assim
+    if request_id and TOOLS_USAGE_STATE.get(request_id, {}).get("sent", False):
+        print(f"✅ Message was sent despite exhausting retries. Returning success.")
+        return "Mensagem já enviada com sucesso."
+        
+    print(f"❌ Falha após {retries} tentativas.")
+    raise last_exception
+
+
+def _key_rejection(request_id, deadline):
+    key_fingerprint = TOOLS_USAGE_STATE.get(request_id, {}).get("key_fingerprint") if request_id else None
+    if key_fingerprint is None:
+        return None
+    return get_key_registry().rejection(key_fingerprint, within=deadline.remaining() if deadline else None)
+
+
+async def resolve_api_key(channel, data, state):
+    """
+    Dados da conversa com a chave de API que a execução vai usar. A chave do tenant
+    conhecida como ruim falha na hora (KeyRejected) ou, com a política "env" do
+    tenant, é trocada pela chave do ambiente. A primeira vez que uma chave aparece
+    ela é validada (numa thread, dentro do prazo da requisição) e o status fica em cache.
+    """
+    tenant_key = channel.api_key(data)
+    api_key = tenant_key or environment_key()
+    if not api_key:
+        return data
+    registry = get_key_registry()
+    state["key_fingerprint"] = fingerprint(api_key)
+    await asyncio.to_thread(registry.check, api_key, state["deadline"].clamp(KEY_VALIDATION_TIMEOUT_SECONDS))
+    rejected = registry.rejection(state["key_fingerprint"], within=state["deadline"].remaining())
+    if rejected is None:
+        return data
+    env_key = environment_key()
+    if tenant_key and env_key and fallback_for(data.userId) == FALLBACK_ENV:
+        print(f"🔑 Chave {rejected.fingerprint} ({rejected.status}): usando a chave do ambiente para {data.userId}")
+        metrics.inc("api_key_rejected_total", status=rejected.status, outcome="fallback")
+        state["key_fallback"] = rejected.status
+        state["key_fingerprint"] = fingerprint(env_key)
+        return data.model_copy(update={"apiKey": None})
+    metrics.inc("api_key_rejected_total", status=rejected.status, outcome="failed")
+    raise rejected
+
+
+async def abort_run(request_id, error, channel: str, path: str, recipient_key: str, payload: dict):
+    """
+    Execução interrompida por prazo (DeadlineExceeded) ou orçamento (BudgetExceeded):
+    avisa o cliente, a menos que uma mensagem já tenha saído nesta requisição.
+    """
+    state = TOOLS_USAGE_STATE.get(request_id, {})
+    if isinstance(error, DeadlineExceeded):
+        state["deadline_exceeded"] = error.stage
+        metrics.inc("deadline_exceeded_total", channel=channel, stage=error.stage, sent=str(bool(state.get("sent"))).lower())
+        # Execução adiada pela sobrecarga: o cliente já recebeu o aviso de espera
+        message = None if state.get("shed") else HOLDING_MESSAGE
+    else:
+        message = BUDGET_ABORT_MESSAGE
+    if state.get("sent") or message is None:
+        return
+    print(f"⏹️ Execução interrompida para {recipient_key} ({error}). Avisando o cliente.")
+    await notify_client(request_id, channel, path, recipient_key, payload, message)
+
+
+async def notify_client(request_id, channel: str, path: str, recipient_key: str, payload: dict, message: str,
+                        mark_sent: bool = True) -> bool:
+    """Mensagem do próprio engine ao cliente (pelo outbox quando ligado). mark_sent=False para avisos intermediários."""
+    state = TOOLS_USAGE_STATE.get(request_id, {})
+    payload = {**payload, "message": message}
+    if enqueue_outbound(request_id, channel, path, recipient_key, payload, mark_sent=mark_sent):
+        return True
+    try:
+        response = await asyncio.to_thread(send_sync, BackendCall("POST", path, json=payload, timeout=10))
+        if response.status_code == 200:
+            if mark_sent:
+                state["sent"] = True
+            return True
+        print(f"⚠️ Falha ao avisar o cliente: HTTP {response.status_code}")
+    except Exception as e:
+        print(f"⚠️ Falha ao avisar o cliente: {e}")
+    return False
+
+
+# ============================================================================
+# ADAPTADORES DE CANAL
+# ============================================================================
+
+class ChannelAdapter:
+    """O que muda entre canais. Subclasses preenchem os atributos e os métodos abaixo."""
+    name = None
+    send_tool_name = None
+    send_path = None
+    expected_output = None
+
+    def recipient(self, data) -> str:
+        raise NotImplementedError
+
+    def recipient_key(self, data) -> str:
+        return f"{self.name}:{data.userId}:{self.recipient(data)}"
+
+    def send_payload(self, data) -> dict:
+        """Payload da rota de envio sem o campo message (usado para avisos do próprio engine)."""
+        raise NotImplementedError
+
+    def api_key(self, data):
+        return getattr(data, "apiKey", None)
+
+    def profile(self, data, request_id, route) -> dict:
+        """Perfil do agente (lean_engine) com as ferramentas travadas no destinatário."""
+        raise NotImplementedError
+
+    def agents(self, data, request_id, route) -> list:
+        """Agentes do CrewAI; o primeiro executa a tarefa."""
+        raise NotImplementedError
+
+    def start_prepare(self, data, state):
+        """Trabalho que roda em paralelo com a montagem dos agentes (ex: prefetch)."""
+        return None
+
+    async def context_block(self, prepared) -> str:
+        return ""
+
+    def task_description(self, data, context_block: str) -> str:
+        raise NotImplementedError
+
+
+class WhatsAppChannel(ChannelAdapter):
+    name = "whatsapp"
+    send_tool_name = "Enviar Mensagem WhatsApp"
+    send_path = "/api/internal/whatsapp/send-text"
+    expected_output = "Mensagem de confirmação enviada ao cliente via ferramenta 'Enviar Mensagem WhatsApp'."
+
+    def recipient(self, data):
+        return data.remoteJid
+
+    def send_payload(self, data):
+        return {"userId": data.userId, "phoneNumber": data.remoteJid}
+
+    def _agent_kwargs(self, data, request_id):
+        # userId is the session_id (instance_1, etc), userEmail is for Google Calendar
+        return dict(
+            user_id=data.userId,
+            custom_prompt=data.agentPrompt,
+            user_email=data.userEmail or data.userId,
+            appointment_duration=data.appointmentDuration or 60,
+            calendar_connected=data.calendarConnected or False,
+            target_remote_jid=data.remoteJid,  # SECURITY: Lock tools to this user
+            request_id=request_id,             # STATEFUL: Track usage via global state
+            api_key=data.apiKey                # Pass custom API Key
+        )
+
+    def profile(self, data, request_id, route):
+        from agents import get_whatsapp_profile
+        return get_whatsapp_profile(**self._agent_kwargs(data, request_id), route=route)
+
+    def agents(self, data, request_id, route):
+        from agents import get_agents
+        return list(get_agents(**self._agent_kwargs(data, request_id), route=route))
+
+    def start_prepare(self, data, state):
+        # PREFETCH: busca os horários das datas citadas em paralelo com a montagem do agente
+        if not (data.calendarConnected and PREFETCH_ENABLED):
+            return {}
+        futures = start_prefetch(data.userEmail or data.userId, extract_candidate_dates(data.message, data.history))
+        state["prefetch"] = futures
+        return futures
+
+    async def context_block(self, prepared):
+        return await prefetch_context(prepared or {})
+
+    def task_description(self, data, context_block):
+        appointment_duration = data.appointmentDuration or 60
+
+        # Get current datetime for context
+        now = datetime.now()
+        current_date_str = now.strftime('%d/%m/%Y')
+        current_time_str = now.strftime('%H:%M')
+        current_year = now.year
+
+        # Include remoteJid in task so agent knows where to send response
+        return f"""
+📅 DATA E HORA ATUAL: {current_date_str} às {current_time_str} (Ano: {current_year})
+⚠️ IMPORTANTE: Quando o cliente mencionar uma data sem ano (ex: "22/01"), assuma o ANO ATUAL ({current_year}) ou o próximo se a data já passou.
+
+O cliente com ID '{data.remoteJid}' enviou a seguinte mensagem: '{data.message}'
+
+Histórico da Conversa:
+{format_history(data.history)}
+
+📍 INFORMAÇÕES DO ESTABELECIMENTO:
+- Tipo de Atendimento: {'PRESENCIAL' if data.serviceType == 'presencial' else 'ONLINE (Google Meet)'}
+- Endereço: {data.businessAddress if data.businessAddress else 'Não configurado'}
+- Duração padrão dos agendamentos: {appointment_duration} minutos
+
+{context_block}
+
+═══════════════════════════════════════════════════════════════
+                        INSTRUÇÕES GERAIS
+═══════════════════════════════════════════════════════════════
+
+REGRAS BÁSICAS:
+- Analise a mensagem e responda seguindo suas instruções
+- LEVE EM CONTA O HISTÓRICO ACIMA
+- Se você fez uma pergunta, a mensagem atual é provavelmente a resposta
+APÓS SUCESSO:
+Use 'Enviar Mensagem WhatsApp' para confirmar ao cliente.
+Para PRESENCIAL: informe o endereço ({data.businessAddress if data.businessAddress else 'não configurado'})
+Para ONLINE: informe que o link Google Meet foi enviado por e-mail.
+            """.strip()
+
+
+class InstagramChannel(ChannelAdapter):
+    name = "instagram"
+    send_tool_name = "Enviar Mensagem Instagram"
+    send_path = "/api/internal/instagram/send-dm"
+    expected_output = "Mensagem Instagram enviada com sucesso ao cliente."
+
+    def recipient(self, data):
+        return data.senderId
+
+    def send_payload(self, data):
+        return {"userId": data.userId, "recipientId": data.senderId}
+
+    def _agent_kwargs(self, data, request_id):
+        return dict(
+            user_id=data.userId,
+            custom_prompt=data.agentPrompt,
+            target_recipient_id=data.senderId,  # SECURITY: Lock tools to this user
+            request_id=request_id,              # STATEFUL: Track usage via global state
+        )
+
+    def profile(self, data, request_id, route):
+        from agents import get_instagram_profile
+        return get_instagram_profile(**self._agent_kwargs(data, request_id), route=route)
+
+    def agents(self, data, request_id, route):
+        from agents import get_instagram_agent
+        return [get_instagram_agent(**self._agent_kwargs(data, request_id), route=route)]
+
+    def task_description(self, data, context_block):
+        return f"""
+O cliente do Instagram com ID '{data.senderId}' enviou a seguinte mensagem: '{data.message}'
+
+Histórico da Conversa:
+{format_history(data.history)}
+
+IMPORTANTE: Para responder, use a ferramenta 'Enviar Mensagem Instagram' com:
+- recipient_id: {data.senderId}
+- message: sua resposta
+
+Analise a mensagem e responda de forma adequada seguindo suas instruções, LEVANDO EM CONTA O HISTÓRICO ACIMA.
+            """.strip()
+
+
+WHATSAPP = WhatsAppChannel()
+INSTAGRAM = InstagramChannel()
+
+
+# ============================================================================
+# PIPELINE
+# ============================================================================
+
+async def run_conversation(channel: ChannelAdapter, data) -> dict:
+    """Processa uma mensagem recebida no canal. Erros não tratados sobem para o webhook (HTTP 500)."""
+    # INGEST: tracker para saber se a mensagem foi enviada (+ contadores de LLM/ferramentas, prazo e orçamento)
+    request_id = str(uuid.uuid4())
+    deadline = deadline_for(data.userId, data.deadlineAt, data.receivedAt)
+    state = new_request_state(request_id, tenant_id=data.userId, channel=channel.name,
+                              recording=start_recording(data.model_dump()), deadline=deadline)
+    state["conversation"] = channel.recipient(data)
+    error_msg = None
+    try:
+        # KEY: chave conhecida como inválida/sem cota não chega ao LLM
+        data = await resolve_api_key(channel, data, state)
+
+        # ADMIT: com o engine saturado, avisa o cliente na hora e adia (ou descarta) a execução
+        lane = LANE_PRIORITY if booking_in_progress(data.history) else LANE_NORMAL
+        if OVERLOAD_CONTROL:
+            reason = get_overload_controller().admit(priority=lane == LANE_PRIORITY)
+            if reason:
+                state["shed"] = reason
+                print(f"🚦 Sobrecarga ({reason}): aviso imediato para {channel.recipient_key(data)} ({OVERLOAD_SHED_MODE})")
+                await notify_client(request_id, channel.name, channel.send_path, channel.recipient_key(data),
+                                    channel.send_payload(data), OVERLOAD_ACK_MESSAGE, mark_sent=False)
+                if OVERLOAD_SHED_MODE == "drop":
+                    return {"status": "shed", "result": reason}
+                # Adiada: prazo estendido, fila atendida só quando não há outras execuções esperando
+                deadline = state["deadline"] = Deadline(OVERLOAD_DEFER_SECONDS)
+                lane = LANE_DEFERRED
+
+        prepared = channel.start_prepare(data, state)
+
+        # ROUTE: tier de modelo por etapa conforme a política do tenant e a intenção da mensagem
+        route_args = (data.userId, data.message, data.history, channel.api_key(data))
+        route = await asyncio.to_thread(route_for, *route_args) if ROUTER_INTENT_LLM else route_for(*route_args)
+        engine = engine_for_tenant(data.userId)
+        if ACCOUNTING_ENABLED and usage_budget_for(data.userId):
+            # Orçamento diário/mensal estourado: mesma conversa, caminho mais barato
+            downgrade = await asyncio.to_thread(get_accounting().downgrade_for, data.userId)
+            if downgrade:
+                state["usage_downgrade"], action = downgrade
+                if action in (ON_EXCEED_ECONOMY, ON_EXCEED_BOTH):
+                    route.downgrade()
+                if action in (ON_EXCEED_LEAN, ON_EXCEED_BOTH):
+                    engine = ENGINE_LEAN
+        state["route"] = route.describe()
+
+        # EXECUTE: vaga no escalonador justo entre tenants (fila prioritária para confirmações de agendamento)
+        async with execution_slot(data.userId, lane, deadline):
+            def build_agents():
+                if engine == ENGINE_LEAN:
+                    return channel.profile(data, request_id, route)
+                return channel.agents(data, request_id, route)
+
+            # LLMs, ferramentas e agentes são montados numa thread; o prefetch segue em paralelo
+            built = await asyncio.to_thread(build_agents)
+            task_description = channel.task_description(data, await channel.context_block(prepared))
+
+            def build_crew(built):
+                if engine == ENGINE_LEAN:
+                    return LeanCrew(built, task_description, channel.expected_output, request_id,
+                                    send_tool_name=channel.send_tool_name)
+                from crewai import Crew, Process, Task
+                task = Task(description=task_description, expected_output=channel.expected_output, agent=built[0])
+                return Crew(agents=built, tasks=[task], process=Process.sequential, memory=False)
+
+            def escalate():
+                # Falha na tentativa: remonta os agentes com o próximo tier de modelo
+                nonlocal built
+                if not route.escalate():
+                    return None
+                state["route"] = route.describe()
+                built = build_agents()
+                return build_crew(built)
+
+            crew = await asyncio.to_thread(build_crew, built)
+            result = await run_crew_with_retry(crew, request_id=request_id, escalate=escalate, deadline=deadline)
+            absorb_crew_usage(request_id, result)
+
+            # DELIVER
+            final_answer = str(result)
+            if engine != ENGINE_LEAN:
+                def retry_agent():
+                    # Não usar a ferramenta de envio também conta como falha do tier atual
+                    escalate()
+                    return built[0]
+
+                final_answer = await force_send(channel, final_answer, retry_agent, request_id, deadline)
+            elif not state["sent"]:
+                # O engine enxuto já pede o envio dentro da mesma conversa com o modelo
+                print(f"⚠️ Lean engine finished without sending for request {request_id}.")
+            return {"status": "success", "result": final_answer}
+
+    except (DeadlineExceeded, BudgetExceeded) as e:
+        error_msg = str(e)
+        await abort_run(request_id, e, channel.name, channel.send_path, channel.recipient_key(data),
+                        channel.send_payload(data))
+        return {"status": "deadline_exceeded" if isinstance(e, DeadlineExceeded) else "budget_exceeded", "result": error_msg}
+    except KeyRejected as e:
+        error_msg = str(e)
+        print(f"🔑 {error_msg} (tenant {data.userId}): execução não iniciada")
+        return {"status": "key_rejected", "result": error_msg}
+    except Exception as e:
+        error_msg = str(e)
+        print(f"❌ Error in {channel.name} webhook: {error_msg}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise
+    finally:
+        # Cleanup global state (o resumo grava métricas e a gravação: fora do event loop)
+        await asyncio.to_thread(finish_request, request_id, error=error_msg)
+        TOOLS_USAGE_STATE.pop(request_id, None)
+
+
+@contextlib.asynccontextmanager
+async def execution_slot(tenant_id: str, lane: str, deadline):
+    """Vaga de execução do tenant; a espera na fila não pode consumir o tempo de uma tentativa."""
+    scheduler = get_scheduler()
+    try:
+        await scheduler.acquire(tenant_id, lane=lane,
+                                timeout=max(deadline.remaining() - CREW_MIN_ATTEMPT_SECONDS, 0))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("queue", deadline.remaining())
+    try:
+        yield
+    finally:
+        scheduler.release(tenant_id)
+
+
+async def force_send(channel: ChannelAdapter, final_answer: str, retry_agent, request_id, deadline) -> str:
+    """
+    O agente terminou sem usar a ferramenta de envio: roda um crew curto que só envia
+    o texto gerado. retry_agent() devolve o agente que fará o envio. Devolve o resultado final.
+    """
+    # ANTI-DUPLICATION: Check if message was already sent before attempting retry
+    # This prevents duplicate messages when LLM returns empty but tool already executed
+    if TOOLS_USAGE_STATE.get(request_id, {}).get("sent", False):
+        print(f"✅ Message already sent for request {request_id}. Skipping retry.")
+        return final_answer
+    if not final_answer or final_answer.strip() == "" or "None" in final_answer:
+        # LLM returned empty/None but message wasn't sent
+        print(f"⚠️ LLM returned empty response and message not sent. Cannot retry without content.")
+        return final_answer
+    if not deadline.fits(CREW_MIN_ATTEMPT_SECONDS):
+        # Não há tempo para o crew de retry forçado: vai a mensagem de espera
+        raise DeadlineExceeded("forced_retry", deadline.remaining())
+
+    # LLM returned content but tool was NOT used - force retry
+    print(f"⚠️ Agent finished but 'sent' tracker ({channel.name}) is False. Retry triggered.")
+    print(f"Agent generated text: {final_answer}")
+
+    crew_retry = await asyncio.to_thread(_forced_send_crew, channel, final_answer, retry_agent)
+
+    print(f"🔄 Starting RETRY to force {channel.name} message sending...")
+    result = await run_crew_with_retry(crew_retry, request_id=request_id, deadline=deadline)
+    final_answer = str(result)
+    print(f"✅ Retry result: {final_answer}")
+    return final_answer
+
+
+def _forced_send_crew(channel: ChannelAdapter, final_answer: str, retry_agent):
+    """Crew curto do retry forçado (síncrono: roda numa thread)."""
+    from crewai import Crew, Process, Task
+
+    agent = retry_agent()
+    retry_task = Task(
+        description=f"""
+🚨 ATENÇÃO: Você gerou uma resposta mas NÃO usou a ferramenta de envio!
+Sua tarefa NÃO ESTÁ COMPLETA.
+
+Você DEVE usar a ferramenta '{channel.send_tool_name}' agora mesmo.
+
+A mensagem que você gerou foi:
+"{final_answer}"
+
+👉 SUA TAREFA AGORA: Use a ferramenta '{channel.send_tool_name}' para enviar EXATAMENTE o texto acima para o cliente.
+NÃO mude o texto. Apenas envie.
+        """.strip(),
+        expected_output=f"Confirmação de envio vinda da ferramenta '{channel.send_tool_name}'.",
+        agent=agent
+    )
+
+    return Crew(
+        agents=[agent],
+        tasks=[retry_task],
+        process=Process.sequential,
+        memory=False
+    )
+
+
+def warm_up():
+    """
+    Importa de antemão os módulos pesados que as execuções carregam sob demanda
+    (CrewAI, agents/LiteLLM, SDK do Gemini). Chamado numa thread no startup do
+    main.py para que o primeiro webhook não pague o import dentro do event loop.
+    """
+    import crewai  # noqa: F401
+    import agents  # noqa: F401
+    try:
+        import google.genai  # noqa: F401
+    except ImportError:
+        pass
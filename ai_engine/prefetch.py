@@ -0,0 +1,167 @@
+"""
+Prefetch especulativo de horários do Google Calendar.
+
+Quando o calendário está conectado, quase toda conversa de agendamento termina
+com o agente chamando 'Listar Horários Disponíveis do Dia' ou 'Verificar
+Disponibilidade' para as datas citadas. Aqui extraímos essas datas da mensagem
+(e do histórico recente) com um parser barato e buscamos available-slots-for-day
+em paralelo com a montagem do agente. O resultado é injetado na tarefa e também
+servido pelas ferramentas (ver get_prefetched_day_slots em tools.py).
+"""
+import asyncio
+import os
+import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import metrics
+from tools import fetch_day_slots, format_day_slots
+
+PREFETCH_ENABLED = os.getenv("CALENDAR_PREFETCH", "1") == "1"
+MAX_PREFETCH_DATES = int(os.getenv("PREFETCH_MAX_DATES", "3"))
+# Quanto esperamos, antes do kickoff, para injetar o resultado na tarefa
+PREFETCH_INJECT_WAIT_SECONDS = float(os.getenv("PREFETCH_INJECT_WAIT_SECONDS", "1.5"))
+# Quantas mensagens do histórico (mais recentes) também são varridas
+PREFETCH_HISTORY_MESSAGES = 4
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="prefetch")
+
+WEEKDAYS = {
+    "segunda": 0, "terca": 1, "quarta": 2, "quinta": 3, "sexta": 4, "sabado": 5, "domingo": 6,
+}
+
+_RE_ISO = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_RE_DMY = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b")
+_RE_DIA = re.compile(r"\bdia (\d{1,2})\b(?!/)")
+_RE_WEEKDAY = re.compile(r"\b(segunda|terca|quarta|quinta|sexta|sabado|domingo)\b")
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _safe_date(year, month, day):
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _dates_in_text(text: str, today: date):
+    """Datas mencionadas em um texto, na ordem em que aparecem."""
+    text = _normalize(text)
+    found = []
+
+    if "depois de amanha" in text:
+        found.append((text.index("depois de amanha"), today + timedelta(days=2)))
+        text = text.replace("depois de amanha", " " * len("depois de amanha"))
+    if "amanha" in text:
+        found.append((text.index("amanha"), today + timedelta(days=1)))
+    if "hoje" in text:
+        found.append((text.index("hoje"), today))
+
+    for m in _RE_ISO.finditer(text):
+        d = _safe_date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        if d:
+            found.append((m.start(), d))
+
+    for m in _RE_DMY.finditer(text):
+        day, month = int(m.group(1)), int(m.group(2))
+        year = m.group(3)
+        if year:
+            year = int(year) + (2000 if len(year) == 2 else 0)
+            d = _safe_date(year, month, day)
+        else:
+            # Mesma regra da tarefa: sem ano, assume o atual ou o próximo se já passou
+            d = _safe_date(today.year, month, day)
+            if d and d < today:
+                d = _safe_date(today.year + 1, month, day)
+        if d:
+            found.append((m.start(), d))
+
+    for m in _RE_DIA.finditer(text):
+        day = int(m.group(1))
+        d = _safe_date(today.year, today.month, day)
+        if d is None or d < today:
+            next_month = (today.replace(day=1) + timedelta(days=32)).replace(day=1)
+            d = _safe_date(next_month.year, next_month.month, day)
+        if d:
+            found.append((m.start(), d))
+
+    for m in _RE_WEEKDAY.finditer(text):
+        delta = (WEEKDAYS[m.group(1)] - today.weekday()) % 7
+        found.append((m.start(), today + timedelta(days=delta)))
+
+    return [d for _, d in sorted(found, key=lambda item: item[0])]
+
+
+def extract_candidate_dates(message: str, history=None, now: datetime = None):
+    """
+    Datas candidatas (YYYY-MM-DD) citadas na mensagem atual e, em seguida, no histórico recente.
+    Retorna no máximo MAX_PREFETCH_DATES datas futuras, sem repetição.
+    """
+    today = (now or datetime.now()).date()
+    texts = [message or ""]
+    if history:
+        recent = [getattr(item, "content", "") for item in history[-PREFETCH_HISTORY_MESSAGES:]]
+        texts.extend(reversed(recent))
+
+    candidates = []
+    for text in texts:
+        for d in _dates_in_text(text, today):
+            iso = d.isoformat()
+            if d >= today and iso not in candidates:
+                candidates.append(iso)
+            if len(candidates) >= MAX_PREFETCH_DATES:
+                return candidates
+    return candidates
+
+
+def start_prefetch(user_id: str, dates):
+    """
+    Dispara imediatamente (em threads) a busca dos horários de cada data.
+    Retorna {data: Future}, pronto para ser guardado em TOOLS_USAGE_STATE[request_id]["prefetch"].
+    """
+    futures = {}
+    for iso in dates:
+        futures[iso] = _prefetch_executor.submit(fetch_day_slots, user_id, iso, "all")
+        metrics.inc("prefetch_dates_total")
+    if futures:
+        print(f"🔮 Prefetch de horários disparado para {', '.join(futures)}")
+    return futures
+
+
+async def prefetch_context(futures: dict) -> str:
+    """
+    Espera até PREFETCH_INJECT_WAIT_SECONDS pelos prefetches e monta o bloco injetado na tarefa.
+    Datas que não ficaram prontas a tempo continuam disponíveis para as ferramentas.
+    """
+    if not futures:
+        return ""
+    await asyncio.wait([asyncio.wrap_future(f) for f in futures.values()], timeout=PREFETCH_INJECT_WAIT_SECONDS)
+
+    blocks = []
+    for iso, future in futures.items():
+        if not future.done() or future.exception() is not None:
+            metrics.inc("prefetch_late_total")
+            continue
+        result = future.result()
+        if result and result.get("success"):
+            blocks.append(format_day_slots(result, iso))
+            metrics.inc("prefetch_injected_total")
+
+    if not blocks:
+        return ""
+    return (
+        "🔮 HORÁRIOS JÁ CONSULTADOS NO CALENDÁRIO (dados atuais, NÃO precisa chamar "
+        "'Listar Horários Disponíveis do Dia' para estas datas; horários desta lista estão livres):\n"
+        + "\n\n".join(blocks)
+    )
+
+
+metrics.register_derived("prefetch_hit_rate", lambda: metrics.ratio(
+    metrics.counter("prefetch_served_total"),
+    metrics.counter("prefetch_served_total") + metrics.counter("prefetch_miss_total"),
+))
@@ -0,0 +1,107 @@
+"""
+Prontidão (/ready) da instância para o balanceador e o autoscaler.
+
+O /health só diz que o processo está de pé. O /ready diz se vale a pena mandar
+mais conversas para esta instância, com os números que justificam a resposta:
+
+  - executor: vagas ocupadas e fila do scheduler.py (utilização e saturação =
+    (em execução + esperando) / vagas), e se o overload.py está descartando;
+  - llm: taxa de erro recente das chamadas e estado do circuito (circuit.py);
+  - backend: taxa de erro recente das chamadas ao Node e estado dos circuitos,
+    um por bulkhead (bulkheads.py), também somados;
+  - event loop: p99 do atraso medido pelo loop_monitor.py.
+
+Fica indisponível (HTTP 503) quando algum número passa do limite ou um circuito
+está aberto; "reasons" lista o que passou. Em half_open a instância segue pronta:
+o circuito do llm só sai desse estado quando chega uma chamada de teste. Os mesmos números vão para os gauges
+readiness_* do /metrics, para o autoscaler.
+
+Configuração:
+    READY_MAX_SATURATION=2.0             (em execução + esperando) / vagas
+    READY_MAX_LLM_ERROR_RATE=0.5
+    READY_MAX_BACKEND_ERROR_RATE=0.5
+    READY_MAX_LOOP_LAG_SECONDS=1.0       p99 do atraso do event loop
+"""
+import os
+
+import metrics
+from bulkheads import BULKHEADS
+from circuit import CIRCUIT_MIN_CALLS, OPEN, get_breaker
+from overload import get_overload_controller
+from scheduler import get_scheduler
+
+READY_MAX_SATURATION = float(os.getenv("READY_MAX_SATURATION", "2.0"))
+READY_MAX_LLM_ERROR_RATE = float(os.getenv("READY_MAX_LLM_ERROR_RATE", "0.5"))
+READY_MAX_BACKEND_ERROR_RATE = float(os.getenv("READY_MAX_BACKEND_ERROR_RATE", "0.5"))
+READY_MAX_LOOP_LAG_SECONDS = float(os.getenv("READY_MAX_LOOP_LAG_SECONDS", "1.0"))
+
+
+def _dependency(name: str, max_error_rate: float, reasons: list) -> dict:
+    stats = get_breaker(name).stats()
+    if stats["state"] == OPEN:
+        reasons.append(f"{name}_circuit_{stats['state']}")
+    # Com poucas chamadas na janela a taxa não diz nada
+    elif stats["calls"] >= CIRCUIT_MIN_CALLS and stats["error_rate"] > max_error_rate:
+        reasons.append(f"{name}_error_rate")
+    return stats
+
+
+def _backend(reasons: list) -> dict:
+    """Circuitos do backend por bulkhead (http_client.py) e a soma deles."""
+    circuits = {
+        name: _dependency(f"backend:{name}", READY_MAX_BACKEND_ERROR_RATE, reasons)
+        for name in BULKHEADS
+    }
+    calls = sum(c["calls"] for c in circuits.values())
+    errors = sum(c["errors"] for c in circuits.values())
+    return {
+        "open": sorted(name for name, c in circuits.items() if c["state"] == OPEN),
+        "calls": calls,
+        "errors": errors,
+        "error_rate": round(errors / calls, 4) if calls else None,
+        "circuits": circuits,
+    }
+
+
+def check() -> dict:
+    """Estado de prontidão e os sinais usados para decidir."""
+    reasons = []
+    scheduler = get_scheduler()
+    waiting = scheduler.waiting()
+    utilization = metrics.ratio(scheduler.running, scheduler.capacity)
+    saturation = metrics.ratio(scheduler.running + waiting, scheduler.capacity)
+    if saturation is not None and saturation > READY_MAX_SATURATION:
+        reasons.append("saturation")
+    overloaded = get_overload_controller().overloaded()
+    if overloaded:
+        reasons.append("overload")
+
+    llm = _dependency("llm", READY_MAX_LLM_ERROR_RATE, reasons)
+    backend = _backend(reasons)
+
+    loop_lag = metrics.percentile("event_loop_lag_seconds", 99)
+    if loop_lag is not None and loop_lag > READY_MAX_LOOP_LAG_SECONDS:
+        reasons.append("event_loop_lag")
+
+    ready = not reasons
+    metrics.set_gauge("readiness_ready", int(ready))
+    metrics.set_gauge("readiness_executor_utilization", utilization or 0)
+    metrics.set_gauge("readiness_saturation", saturation or 0)
+    metrics.set_gauge("readiness_queue_depth", waiting)
+    metrics.set_gauge("readiness_llm_error_rate", llm["error_rate"] or 0)
+    metrics.set_gauge("readiness_backend_error_rate", backend["error_rate"] or 0)
+    return {
+        "ready": ready,
+        "reasons": reasons,
+        "executor": {
+            "capacity": scheduler.capacity,
+            "running": scheduler.running,
+            "waiting": waiting,
+            "utilization": utilization,
+            "saturation": saturation,
+            "overloaded": overloaded,
+        },
+        "llm": llm,
+        "backend": backend,
+        "event_loop_lag_p99_seconds": loop_lag,
+    }
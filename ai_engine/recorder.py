@@ -0,0 +1,94 @@
+"""
+Gravação de conversas reais para o replay.py.
+
+Ativado com RECORD_CONVERSATIONS=1. Cada execução vira um arquivo JSONL em
+RECORDINGS_DIR com: payload do webhook, pares request/response do LLM,
+respostas das ferramentas e o resumo final. Dados pessoais (telefones, JIDs,
+e-mails, chaves) são substituídos por marcadores estáveis dentro da gravação,
+para que o replay continue coerente.
+"""
+import json
+import os
+import re
+import time
+
+RECORD_CONVERSATIONS = os.getenv("RECORD_CONVERSATIONS", "0") == "1"
+RECORDINGS_DIR = os.getenv("RECORDINGS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings"))
+
+# Campos do payload que nunca devem ser gravados
+_DROP_FIELDS = {"apiKey"}
+# Delta do histórico (conversation_cache.py): a gravação guarda o histórico já
+# resolvido, senão o replay cai no cache vazio e recebe 409
+DELTA_FIELDS = ("historyBaseVersion", "historyDrop", "historyAppend", "historyVersion")
+# O prazo gravado já passou: a execução usa o SLA a partir de agora
+_REPLAY_DROP_FIELDS = ("receivedAt", "deadlineAt") + DELTA_FIELDS
+
+_PII_PATTERNS = [
+    ("JID", re.compile(r"[\w.+-]+@(?:s\.whatsapp\.net|lid|g\.us)")),
+    ("EMAIL", re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")),
+    ("PHONE", re.compile(r"\+?\d[\d\s().-]{8,}\d")),
+    ("KEY", re.compile(r"AIza[\w-]{20,}")),
+]
+
+
+class Redactor:
+    """Substitui PII por marcadores estáveis (<EMAIL_1>, <PHONE_2>...) dentro de uma gravação."""
+
+    def __init__(self):
+        self.mapping = {}
+        self.counters = {}
+
+    def _token(self, kind, value):
+        key = (kind, value)
+        if key not in self.mapping:
+            self.counters[kind] = self.counters.get(kind, 0) + 1
+            self.mapping[key] = f"<{kind}_{self.counters[kind]}>"
+        return self.mapping[key]
+
+    def text(self, value: str) -> str:
+        for kind, pattern in _PII_PATTERNS:
+            value = pattern.sub(lambda m, k=kind: self._token(k, m.group(0)), value)
+        return value
+
+    def value(self, value):
+        if isinstance(value, str):
+            return self.text(value)
+        if isinstance(value, dict):
+            return {k: self.value(v) for k, v in value.items() if k not in _DROP_FIELDS}
+        if isinstance(value, (list, tuple)):
+            return [self.value(v) for v in value]
+        return value
+
+
+def start_recording(payload: dict):
+    """Retorna a lista de eventos inicial (com o webhook) ou None se a gravação estiver desligada."""
+    if not RECORD_CONVERSATIONS:
+        return None
+    payload = {k: v for k, v in payload.items() if k not in DELTA_FIELDS}
+    return [{"type": "webhook", "payload": payload, "ts": time.time()}]
+
+
+def replay_payload(events: list) -> dict:
+    """Payload do webhook gravado, pronto para ser reenviado (gravações antigas ainda têm os campos de delta)."""
+    payload = next(e for e in events if e.get("type") == "webhook")["payload"]
+    return {k: v for k, v in payload.items() if k not in _REPLAY_DROP_FIELDS}
+
+
+def save_recording(request_id: str, events: list, summary: dict) -> str:
+    """Redige PII e grava a conversa em RECORDINGS_DIR/<timestamp>_<request_id>.jsonl."""
+    os.makedirs(RECORDINGS_DIR, exist_ok=True)
+    redactor = Redactor()
+    path = os.path.join(RECORDINGS_DIR, f"{int(time.time())}_{request_id[:8]}.jsonl")
+
+    with open(path, "w", encoding="utf-8") as f:
+        for event in events:
+            f.write(json.dumps(redactor.value(event), ensure_ascii=False, default=str) + "\n")
+        f.write(json.dumps({"type": "summary", **redactor.value(summary)}, ensure_ascii=False, default=str) + "\n")
+
+    print(f"🎙️ Conversa gravada em {path}")
+    return path
+
+
+def load_recording(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,174 @@
+"""
+Replay determinístico de conversas gravadas (ver recorder.py).
+
+Roda cada gravação através de handle_whatsapp_message / handle_instagram_message
+com o LLM e as ferramentas substituídos por stubs que servem as respostas gravadas.
+Os prompts são montados pelo código ATUAL, então os tokens de entrada refletem
+mudanças de prompt/engine; as respostas do LLM e do backend são as gravadas.
+
+Tokens das ferramentas: tool_def = definições x chamadas LLM, tool_res = resultados
+devolvidos ao agente. Compare TOOL_VERBOSITY=verbose x compact (padrão) para medir
+a economia por agendamento (ver também tool_tokens.py).
+
+Uso:
+    python replay.py recordings/*.jsonl
+    python replay.py recordings/*.jsonl --json > baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "replay")
+os.environ.setdefault("GOOGLE_API_KEY", "replay")
+# As chaves gravadas não são validadas no Gemini durante o replay
+os.environ.setdefault("KEY_VALIDATION", "0")
+# O prefetch consultaria o calendário de verdade (fora do TOOL_STUB) e mudaria o prompt
+os.environ.setdefault("CALENDAR_PREFETCH", "0")
+# Nada sai do processo: avisos do engine e fallbacks não vão para o outbox, nem o replay é regravado
+os.environ.setdefault("OUTBOX_ENABLED", "0")
+os.environ.setdefault("RECORD_CONVERSATIONS", "0")
+os.environ.setdefault("OVERLOAD_CONTROL", "0")
+
+import instrumentation
+import tools
+from recorder import load_recording, replay_payload
+
+SEND_TOOLS = {"Enviar Mensagem WhatsApp", "Enviar Mensagem Instagram", "Enviar Áudio WhatsApp"}
+
+
+class ReplayStubs:
+    """Serve as respostas gravadas do LLM (em ordem) e das ferramentas (em ordem, por nome)."""
+
+    def __init__(self, events):
+        self.events = [e for e in events if e.get("type") in ("llm", "tool")]
+        self.cursor = 0
+        self.tool_queues = {}
+        for event in self.events:
+            if event["type"] == "tool":
+                self.tool_queues.setdefault(event["name"], []).append(event)
+        self.unmatched_tools = 0
+
+    def llm(self, request_id, messages, kwargs):
+        available_functions = kwargs.get("available_functions") or {}
+        while self.cursor < len(self.events):
+            event = self.events[self.cursor]
+            self.cursor += 1
+            if event["type"] == "tool":
+                # Chamada nativa de função: a ferramenta foi executada dentro do llm.call gravado
+                if event["name"] in available_functions:
+                    available_functions[event["name"]](**(event.get("args") or {}))
+                continue
+            if event.get("error"):
+                raise RuntimeError(event["error"])
+            return event.get("response") or ""
+        raise RuntimeError("replay: o engine fez mais chamadas ao LLM do que a gravação contém")
+
+    def tool(self, tool, kwargs):
+        if tool.name in SEND_TOOLS and tool.request_id in tools.TOOLS_USAGE_STATE:
+            tools.TOOLS_USAGE_STATE[tool.request_id]["sent"] = True
+        queue = self.tool_queues.get(tool.name)
+        if queue:
+            return queue.pop(0)["result"]
+        self.unmatched_tools += 1
+        if tool.name in SEND_TOOLS:
+            return "Mensagem enviada com sucesso."
+        return "Erro de conexão: replay sem resposta gravada para esta ferramenta."
+
+
+async def replay_one(path):
+    from main import (
+        handle_whatsapp_message, handle_instagram_message,
+        MessageInput, InstagramMessageInput,
+    )
+
+    events = load_recording(path)
+    recorded = next((e for e in events if e.get("type") == "summary"), {})
+    payload = replay_payload(events)
+
+    stubs = ReplayStubs(events)
+    summaries = []
+    instrumentation.LLM_STUB = stubs.llm
+    tools.TOOL_STUB = stubs.tool
+    instrumentation.RUN_SUMMARY_LISTENERS.append(summaries.append)
+
+    started = time.monotonic()
+    error = None
+    try:
+        if "senderId" in payload:
+            await handle_instagram_message(InstagramMessageInput(**payload))
+        else:
+            await handle_whatsapp_message(MessageInput(**payload))
+    except Exception as e:
+        error = getattr(e, "detail", None) or str(e)
+    finally:
+        instrumentation.LLM_STUB = None
+        tools.TOOL_STUB = None
+        instrumentation.RUN_SUMMARY_LISTENERS.remove(summaries.append)
+
+    summary = summaries[-1] if summaries else {}
+    recorded_tool_tokens = recorded.get("tool_tokens") or {}
+    return {
+        "file": os.path.basename(path),
+        "llm_calls": summary.get("llm_calls", 0),
+        "input_tokens": summary.get("input_tokens", 0),
+        "output_tokens": summary.get("output_tokens", 0),
+        "tool_calls": summary.get("tool_calls", 0),
+        "bookings": summary.get("bookings", 0),
+        "tool_def_tokens": (summary.get("tool_tokens") or {}).get("definitions_input", 0),
+        "tool_result_tokens": (summary.get("tool_tokens") or {}).get("results", 0),
+        "wall_seconds": round(time.monotonic() - started, 3),
+        "unmatched_tools": stubs.unmatched_tools,
+        "error": error,
+        "recorded": {
+            **{k: recorded.get(k) for k in ("llm_calls", "input_tokens", "output_tokens", "tool_calls", "bookings")},
+            "tool_def_tokens": recorded_tool_tokens.get("definitions_input"),
+            "tool_result_tokens": recorded_tool_tokens.get("results"),
+        },
+    }
+
+
+def print_report(rows):
+    header = (f"{'conversa':<32} {'llm':>4} {'in_tok':>8} {'out_tok':>8} {'tools':>5} {'book':>4} "
+              f"{'tool_def':>8} {'tool_res':>8} {'wall_s':>7}  status")
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        status = "ok" if not r["error"] else f"ERRO: {str(r['error'])[:40]}"
+        if r["unmatched_tools"]:
+            status += f" (divergiu: {r['unmatched_tools']} tool calls sem gravação)"
+        print(f"{r['file'][:32]:<32} {r['llm_calls']:>4} {r['input_tokens']:>8} {r['output_tokens']:>8} "
+              f"{r['tool_calls']:>5} {r['bookings']:>4} {r['tool_def_tokens']:>8} {r['tool_result_tokens']:>8} "
+              f"{r['wall_seconds']:>7}  {status}")
+
+    bookings = sum(r["bookings"] for r in rows)
+    totals = {k: sum(r[k] for r in rows) for k in ("llm_calls", "input_tokens", "output_tokens", "tool_calls",
+                                                   "tool_def_tokens", "tool_result_tokens")}
+    recorded_totals = {k: sum((r["recorded"].get(k) or 0) for r in rows) for k in totals}
+    print("-" * len(header))
+    print(f"Conversas: {len(rows)} | Agendamentos concluídos: {bookings}")
+    for key, value in totals.items():
+        print(f"  {key:<14} replay={value:<8} gravado={recorded_totals[key]:<8} delta={value - recorded_totals[key]:+}")
+    if bookings:
+        print(f"  LLM calls/agendamento: {totals['llm_calls'] / bookings:.2f} | "
+              f"tokens entrada/agendamento: {totals['input_tokens'] / bookings:.0f} | "
+              f"tokens de ferramentas/agendamento: {(totals['tool_def_tokens'] + totals['tool_result_tokens']) / bookings:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay de conversas gravadas contra stubs")
+    parser.add_argument("recordings", nargs="+")
+    parser.add_argument("--json", action="store_true", help="Imprime o resultado em JSON")
+    args = parser.parse_args()
+
+    rows = [asyncio.run(replay_one(path)) for path in args.recordings]
+    if args.json:
+        json.dump(rows, sys.stdout, ensure_ascii=False, indent=2)
+    else:
+        print_report(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Escalonamento justo entre tenants para a execução dos agentes.
+
+Antes, todas as execuções disputavam o mesmo ThreadPoolExecutor em ordem de
+chegada: uma campanha com centenas de mensagens para um userId atrasava as
+respostas de todos os outros negócios. Agora cada execução pede uma vaga ao
+FairScheduler (pipeline.run_conversation):
+
+  - uma fila por tenant, com limite de execuções simultâneas por tenant;
+  - entre tenants com fila, vaga para o menor "tempo virtual" (weighted fair
+    queueing): cada execução custa 1/peso, e o peso vem do plano do tenant;
+  - faixa prioritária: confirmações de agendamento em andamento passam na
+    frente de conversas novas (ainda respeitando o limite do tenant);
+  - faixa adiada: execuções adiadas pelo overload.py, atendidas só quando
+    não há mais ninguém elegível nas outras faixas.
+
+Métricas por tenant: profundidade da fila, execuções em andamento e tempo de
+espera (scheduler_wait_seconds, com o label lane).
+
+Configuração:
+    CREW_WORKERS=4                         vagas de execução (= threads do executor)
+    TENANT_PLANS='{"instance_1": "pro"}'   plano por tenant (padrão: basic)
+    PLAN_WEIGHTS='{"free": 1, "basic": 2, "pro": 4}'
+    PLAN_MAX_CONCURRENCY='{"free": 1, "basic": 2, "pro": 3}'
+"""
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import deque
+
+import metrics
+
+CREW_WORKERS = int(os.getenv("CREW_WORKERS", "4"))
+DEFAULT_PLAN = "basic"
+
+LANE_PRIORITY = "priority"
+LANE_NORMAL = "normal"
+# Execuções adiadas pelo controle de sobrecarga (overload.py): só quando ninguém mais espera
+LANE_DEFERRED = "deferred"
+
+
+def _json_env(name: str, default: dict) -> dict:
+    raw = os.getenv(name, "")
+    if not raw:
+        return default
+    try:
+        return {**default, **json.loads(raw)}
+    except json.JSONDecodeError as e:
+        print(f"⚠️ {name} inválido, usando o padrão: {e}")
+        return default
+
+
+TENANT_PLANS = _json_env("TENANT_PLANS", {})
+PLAN_WEIGHTS = _json_env("PLAN_WEIGHTS", {"free": 1, "basic": 2, "pro": 4})
+PLAN_MAX_CONCURRENCY = _json_env("PLAN_MAX_CONCURRENCY", {"free": 1, "basic": 2, "pro": 3})
+
+# Última mensagem do atendente pedindo a confirmação de um agendamento (resumo da FASE 2)
+_CONFIRMATION_PROMPT = re.compile(r"posso confirmar|confirmacao de agendamento|confirma (o|esse|este) (agendamento|horario)")
+
+
+def plan_for(tenant_id: str) -> str:
+    return TENANT_PLANS.get(tenant_id, DEFAULT_PLAN)
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def booking_in_progress(history) -> bool:
+    """O cliente está respondendo ao resumo de um agendamento (faixa prioritária)."""
+    for item in reversed(history or []):
+        if getattr(item, "role", "") in ("assistant", "model"):
+            return bool(_CONFIRMATION_PROMPT.search(_normalize(getattr(item, "content", ""))))
+    return False
+
+
+class _TenantQueue:
+    def __init__(self, tenant_id: str):
+        plan = plan_for(tenant_id)
+        self.tenant_id = tenant_id
+        self.weight = float(PLAN_WEIGHTS.get(plan, 1))
+        self.max_concurrency = int(PLAN_MAX_CONCURRENCY.get(plan, 1))
+        self.lanes = {LANE_PRIORITY: deque(), LANE_NORMAL: deque(), LANE_DEFERRED: deque()}
+        self.running = 0
+        self.finish_tag = 0.0
+
+    def waiting(self) -> int:
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def eligible(self) -> bool:
+        return self.running < self.max_concurrency and self.waiting() > 0
+
+
+class FairScheduler:
+    """Vagas de execução com filas por tenant. Usado só no event loop (sem locks)."""
+
+    def __init__(self, capacity: int = CREW_WORKERS):
+        self.capacity = capacity
+        self.running = 0
+        self._tenants = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        # Chamados com o tempo de espera de cada execução liberada (ex: overload.py)
+        self.wait_listeners = []
+
+    def _tenant(self, tenant_id: str) -> _TenantQueue:
+        queue = self._tenants.get(tenant_id)
+        if queue is None:
+            queue = self._tenants[tenant_id] = _TenantQueue(tenant_id)
+        return queue
+
+    def _charge(self, queue: _TenantQueue):
+        # Start-time fair queueing: a vaga custa 1/peso no relógio virtual do tenant
+        start = max(self._virtual_time, queue.finish_tag)
+        queue.finish_tag = start + 1.0 / queue.weight
+        self._virtual_time = start
+
+    def _grant(self, queue: _TenantQueue, lane: str, enqueued_at: float):
+        self._charge(queue)
+        queue.running += 1
+        self.running += 1
+        waited = time.monotonic() - enqueued_at
+        metrics.observe("scheduler_wait_seconds", waited, tenant=queue.tenant_id, lane=lane)
+        self._publish(queue)
+        for listener in list(self.wait_listeners):
+            listener(waited)
+
+    def _publish(self, queue: _TenantQueue):
+        metrics.set_gauge("scheduler_queue_depth", queue.waiting(), tenant=queue.tenant_id)
+        metrics.set_gauge("scheduler_running", queue.running, tenant=queue.tenant_id)
+
+    def _next(self):
+        eligible = [queue for queue in self._tenants.values() if queue.eligible()]
+        if not eligible:
+            return None, None
+        # Faixa prioritária primeiro (ordem de chegada), depois o menor tempo virtual
+        priority = [queue for queue in eligible if queue.lanes[LANE_PRIORITY]]
+        if priority:
+            return min(priority, key=lambda q: q.lanes[LANE_PRIORITY][0][0]), LANE_PRIORITY
+        normal = [queue for queue in eligible if queue.lanes[LANE_NORMAL]]
+        if normal:
+            return min(normal, key=lambda q: (max(self._virtual_time, q.finish_tag), q.lanes[LANE_NORMAL][0][0])), LANE_NORMAL
+        return min(eligible, key=lambda q: q.lanes[LANE_DEFERRED][0][0]), LANE_DEFERRED
+
+    def _dispatch(self):
+        while self.running < self.capacity:
+            queue, lane = self._next()
+            if queue is None:
+                return
+            _, enqueued_at, future = queue.lanes[lane].popleft()
+            if future.done():  # desistiu (timeout/cancelamento) enquanto esperava
+                self._publish(queue)
+                continue
+            self._grant(queue, lane, enqueued_at)
+            future.set_result(None)
+
+    def waiting(self) -> int:
+        return sum(queue.waiting() for queue in self._tenants.values())
+
+    async def acquire(self, tenant_id: str, lane: str = LANE_NORMAL, timeout: float = None):
+        """Espera uma vaga (asyncio.TimeoutError se não vier dentro de timeout)."""
+        queue = self._tenant(tenant_id)
+        now = time.monotonic()
+        # Com vaga livre, quem está na fila é de tenant no limite: pode entrar direto
+        if self.running < self.capacity and queue.running < queue.max_concurrency and not queue.waiting():
+            self._grant(queue, lane, now)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        queue.lanes[lane].append((next(self._seq), now, future))
+        self._publish(queue)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if future.done() and not future.cancelled():
+                # A vaga chegou junto com o timeout: devolve
+                self.release(tenant_id)
+            else:
+                future.cancel()
+                self._remove(queue, lane, future)
+            raise
+
+    def _remove(self, queue: _TenantQueue, lane: str, future):
+        entries = queue.lanes[lane]
+        for entry in list(entries):
+            if entry[2] is future:
+                entries.remove(entry)
+                break
+        self._publish(queue)
+
+    def release(self, tenant_id: str):
+        queue = self._tenant(tenant_id)
+        queue.running -= 1
+        self.running -= 1
+        self._publish(queue)
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, tenant_id: str, lane: str = LANE_NORMAL, timeout: float = None):
+        await self.acquire(tenant_id, lane=lane, timeout=timeout)
+        try:
+            yield
+        finally:
+            self.release(tenant_id)
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "running": self.running,
+            "tenants": {
+                tenant_id: {
+                    "plan": plan_for(tenant_id),
+                    "running": queue.running,
+                    "waiting": queue.waiting(),
+                    "priority_waiting": len(queue.lanes[LANE_PRIORITY]),
+                    "deferred_waiting": len(queue.lanes[LANE_DEFERRED]),
+                    "wait_p95_seconds": metrics.percentile("scheduler_wait_seconds", 95, tenant=tenant_id, lane=LANE_NORMAL),
+                }
+                for tenant_id, queue in self._tenants.items()
+                if queue.running or queue.waiting()
+            },
+        }
+
+
+_scheduler = None
+
+
+def get_scheduler() -> FairScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FairScheduler()
+    return _scheduler
+
+
+metrics.register_derived("scheduler", lambda: get_scheduler().stats())
@@ -0,0 +1,296 @@
+"""
+Regras de agendamento de cada tenant em cache local, para pré-validar horários.
+
+O agente só descobria que um horário estava fora do funcionamento depois de ir
+ao backend (schedule-appointment / check-availability) e gastar mais um turno do
+LLM. A antecedência mínima de 2h era reimplementada, com o parse de datas
+duplicado, no agendamento e no reagendamento. Agora:
+
+  - as regras do tenant (funcionamento, duração, antecedência, tipo de serviço)
+    vêm de GET /api/google-calendar/scheduling-rules e ficam em cache por
+    SCHEDULING_RULES_TTL_SECONDS; depois disso a revalidação manda a versão em
+    cache e o backend só responde "unchanged" se nada mudou;
+  - validate() é o validador único das ferramentas: recusa na hora, sem
+    chamada ao backend, horários em cima da hora ou fora do funcionamento;
+  - se o backend recusar por funcionamento um horário que o cache aprovou, as
+    regras do tenant são descartadas (invalidate) e buscadas de novo.
+
+Sem regras (backend antigo, falha na busca, SCHEDULING_RULES=0) só a
+antecedência padrão é checada localmente, como antes; o resto fica com o backend.
+
+Configuração:
+    SCHEDULING_RULES=1                     busca e usa as regras do tenant
+    SCHEDULING_RULES_TTL_SECONDS=300       idade máxima antes de revalidar a versão
+    SCHEDULING_RULES_RETRY_SECONDS=60      espera após uma busca que falhou
+    SCHEDULING_RULES_TIMEOUT_SECONDS=3
+"""
+import functools
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import metrics
+from http_client import BackendCall, arun_flow, run_flow
+
+SCHEDULING_RULES = os.getenv("SCHEDULING_RULES", "1") == "1"
+SCHEDULING_RULES_TTL_SECONDS = float(os.getenv("SCHEDULING_RULES_TTL_SECONDS", "300"))
+SCHEDULING_RULES_RETRY_SECONDS = float(os.getenv("SCHEDULING_RULES_RETRY_SECONDS", "60"))
+SCHEDULING_RULES_TIMEOUT_SECONDS = float(os.getenv("SCHEDULING_RULES_TIMEOUT_SECONDS", "3"))
+
+DEFAULT_TIMEZONE = "America/Sao_Paulo"
+DEFAULT_MIN_ADVANCE_MINUTES = 120   # MIN_ADVANCE_MINUTES do googleCalendarService.js
+# TIMEZONE_OFFSET do backend, caso o sistema não tenha a base de fusos (tzdata)
+_FALLBACK_OFFSET = timezone(timedelta(hours=-3))
+
+INSUFFICIENT_ADVANCE_TIME = "insufficient_advance_time"
+OUTSIDE_BUSINESS_HOURS = "outside_business_hours"
+
+# weekday() -> (chave nova, chave antiga, nome), os dois formatos de businessHours do backend
+_DAYS = (
+    ("seg", "monday", "Segunda"),
+    ("ter", "tuesday", "Terça"),
+    ("qua", "wednesday", "Quarta"),
+    ("qui", "thursday", "Quinta"),
+    ("sex", "friday", "Sexta"),
+    ("sab", "saturday", "Sábado"),
+    ("dom", "sunday", "Domingo"),
+)
+
+
+@functools.lru_cache(maxsize=None)
+def tenant_zone(name: str = DEFAULT_TIMEZONE):
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(name)
+    except Exception:
+        return _FALLBACK_OFFSET
+
+
+@dataclass(frozen=True)
+class SchedulingRules:
+    version: str = ""
+    business_hours: Optional[dict] = None
+    appointment_duration: int = 60
+    min_advance_minutes: int = DEFAULT_MIN_ADVANCE_MINUTES
+    service_type: Optional[str] = None
+    timezone: str = DEFAULT_TIMEZONE
+    formatted_hours: str = ""
+
+    @classmethod
+    def from_payload(cls, version: str, rules: dict) -> "SchedulingRules":
+        return cls(
+            version=version,
+            business_hours=rules.get("businessHours") or None,
+            appointment_duration=int(rules.get("appointmentDuration") or 60),
+            min_advance_minutes=int(rules.get("minAdvanceMinutes") or DEFAULT_MIN_ADVANCE_MINUTES),
+            service_type=rules.get("serviceType"),
+            timezone=rules.get("timezone") or DEFAULT_TIMEZONE,
+            formatted_hours=rules.get("formattedHours") or "",
+        )
+
+
+# Sem regras do tenant: só a antecedência padrão
+DEFAULT_RULES = SchedulingRules()
+
+
+@dataclass(frozen=True)
+class Rejection:
+    reason: str
+    message: str
+    min_start: Optional[datetime] = None
+    lead: str = ""   # antecedência exigida, por extenso ("2 horas")
+    formatted_hours: str = ""
+
+    def as_result(self) -> dict:
+        """No formato das respostas do backend, para as ferramentas tratarem igual."""
+        return {
+            "success": False,
+            "reason": self.reason,
+            "message": self.message,
+            "formattedHours": self.formatted_hours or "Horários não disponíveis",
+        }
+
+
+def parse_datetime(value: str) -> Optional[datetime]:
+    """Data/hora ISO como veio do LLM (com ou sem fuso); None se não for ISO válido."""
+    try:
+        return datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+
+def localize(value: datetime, zone) -> datetime:
+    """Sem fuso, é horário do tenant (como o ensureTimezone do backend)."""
+    return value.replace(tzinfo=zone) if value.tzinfo is None else value.astimezone(zone)
+
+
+def lead_time(minutes: int) -> str:
+    if minutes % 60:
+        return f"{minutes} minutos"
+    hours = minutes // 60
+    return f"{hours} hora" if hours == 1 else f"{hours} horas"
+
+
+def _minutes(hhmm: str) -> int:
+    hours, minutes = hhmm.split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def _outside_hours(business_hours: dict, start: datetime, end: datetime) -> Optional[str]:
+    """Mesma regra do isWithinBusinessHours do backend; None se o horário está no funcionamento."""
+    new_key, old_key, day_name = _DAYS[start.weekday()]
+    day = business_hours.get(new_key)
+    if isinstance(day, dict) and isinstance(day.get("slots"), list):
+        windows = [(slot["start"], slot["end"]) for slot in day["slots"]] if day.get("enabled") else None
+    else:
+        day = business_hours.get(old_key)
+        windows = [(day["start"], day["end"])] if day and day.get("isOpen") else None
+    if not windows:
+        return f"Não é possível agendar: o estabelecimento não funciona em {day_name}."
+    start_minutes = start.hour * 60 + start.minute
+    end_minutes = end.hour * 60 + end.minute
+    if any(_minutes(first) <= start_minutes and end_minutes <= _minutes(last) for first, last in windows):
+        return None
+    return (f"Horário fora do funcionamento. Em {day_name}, o horário solicitado "
+            f"({start:%H:%M}-{end:%H:%M}) não está dentro dos horários disponíveis.")
+
+
+def validate(start: datetime, rules: Optional[SchedulingRules] = None, now: datetime = None) -> Optional[Rejection]:
+    """
+    Recusa local de um horário de início, ou None se só o backend pode decidir
+    (conflitos de agenda nunca são checados aqui).
+    """
+    rules = rules or DEFAULT_RULES
+    zone = tenant_zone(rules.timezone)
+    start = localize(start, zone)
+    now = (now or datetime.now(timezone.utc)).astimezone(zone)
+
+    min_start = now + timedelta(minutes=rules.min_advance_minutes)
+    if start < min_start:
+        metrics.inc("scheduling_rules_rejected_total", reason=INSUFFICIENT_ADVANCE_TIME)
+        lead = lead_time(rules.min_advance_minutes)
+        return Rejection(
+            INSUFFICIENT_ADVANCE_TIME,
+            f"Horário muito próximo. Necessário {lead} de antecedência (mínimo {min_start:%d/%m/%Y %H:%M}).",
+            min_start=min_start,
+            lead=lead,
+        )
+
+    if rules.business_hours:
+        end = start + timedelta(minutes=rules.appointment_duration)
+        try:
+            message = _outside_hours(rules.business_hours, start, end)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            message = None   # Configuração em formato inesperado: o backend decide
+        if message:
+            metrics.inc("scheduling_rules_rejected_total", reason=OUTSIDE_BUSINESS_HOURS)
+            return Rejection(OUTSIDE_BUSINESS_HOURS, message, formatted_hours=rules.formatted_hours)
+    return None
+
+
+class _Entry:
+    def __init__(self):
+        self.rules = None
+        self.checked_at = 0.0   # monotonic: última vez que o backend confirmou a versão
+        self.failed_at = None
+
+
+class SchedulingRulesCache:
+    def __init__(self, ttl: float = SCHEDULING_RULES_TTL_SECONDS, retry: float = SCHEDULING_RULES_RETRY_SECONDS):
+        self.ttl = ttl
+        self.retry = retry
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def _entry(self, user_id: str) -> _Entry:
+        with self._lock:
+            return self._entries.setdefault(user_id, _Entry())
+
+    def flow(self, user_id: str):
+        """
+        Flow de ferramenta (yield BackendCall) que devolve as regras do tenant:
+        do cache se ainda frescas, senão revalidando/buscando no backend. Em falha
+        devolve as últimas regras conhecidas (ou None).
+        """
+        if not SCHEDULING_RULES or not user_id:
+            return None
+        entry = self._entry(user_id)
+        now = time.monotonic()
+        if entry.rules is not None and now - entry.checked_at < self.ttl:
+            metrics.inc("scheduling_rules_cache_total", result="hit")
+            return entry.rules
+        if entry.failed_at is not None and now - entry.failed_at < self.retry:
+            metrics.inc("scheduling_rules_cache_total", result="stale" if entry.rules else "unavailable")
+            return entry.rules
+
+        params = {"userId": user_id}
+        if entry.rules is not None:
+            params["version"] = entry.rules.version
+        started = time.monotonic()
+        try:
+            response = yield BackendCall(
+                "GET", "/api/google-calendar/scheduling-rules", params=params,
+                timeout=SCHEDULING_RULES_TIMEOUT_SECONDS,
+            )
+            payload = response.json() if response.status_code == 200 else {}
+        except Exception as e:
+            payload = {"error": str(e)}
+        finally:
+            metrics.observe("scheduling_rules_fetch_seconds", time.monotonic() - started)
+
+        if payload.get("success") and payload.get("unchanged") and entry.rules is not None:
+            result = "revalidated"
+        elif payload.get("success") and isinstance(payload.get("rules"), dict):
+            entry.rules = SchedulingRules.from_payload(payload.get("version", ""), payload["rules"])
+            result = "fetched"
+        else:
+            entry.failed_at = time.monotonic()
+            metrics.inc("scheduling_rules_cache_total", result="fetch_failed")
+            return entry.rules
+        entry.checked_at = time.monotonic()
+        entry.failed_at = None
+        metrics.inc("scheduling_rules_cache_total", result=result)
+        return entry.rules
+
+    def load(self, user_id: str) -> Optional[SchedulingRules]:
+        return run_flow(self.flow(user_id))
+
+    async def aload(self, user_id: str) -> Optional[SchedulingRules]:
+        return await arun_flow(self.flow(user_id))
+
+    def reconcile(self, user_id: str, rules: Optional[SchedulingRules], result: dict):
+        """Backend recusou por funcionamento um horário que as regras em cache aprovaram: descarta-as."""
+        if rules is not None and rules.version and result.get("reason") == OUTSIDE_BUSINESS_HOURS:
+            self.invalidate(user_id)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                metrics.inc("scheduling_rules_invalidated_total")
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._entries.values())
+        cached = [e for e in entries if e.rules is not None]
+        return {
+            "enabled": SCHEDULING_RULES,
+            "tenants": len(cached),
+            "fresh": sum(1 for e in cached if now - e.checked_at < self.ttl),
+        }
+
+
+_cache = None
+
+
+def get_rules_cache() -> SchedulingRulesCache:
+    global _cache
+    if _cache is None:
+        _cache = SchedulingRulesCache()
+    return _cache
+
+
+metrics.register_derived("scheduling_rules", lambda: get_rules_cache().stats())
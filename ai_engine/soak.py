@@ -0,0 +1,313 @@
+"""
+Soak test: dezenas de milhares de conversas sintéticas no mesmo processo.
+
+Cada requisição cria LLM, Agent, Crew, Task e ferramentas novos, e um
+TOOLS_USAGE_STATE que pode sobrar quando uma execução zumbi sobrevive à
+requisição. Este script reproduz um processo de longa duração: dirige
+conversas pelos handlers do main.py (mesmo event loop, com concorrência) com o
+LLM e as ferramentas substituídos por stubs locais (como em replay.py), tira
+snapshots de tracemalloc e RSS a intervalos e compara o fim do teste com o
+início (depois do aquecimento, que enche caches e pools).
+
+Falha (exit 1) quando a memória retida por requisição passa do limite, quando
+estados de requisição ficam para trás ou quando mais de --max-errors
+requisições falham (um engine que só devolve erro não retém memória).
+
+Uso:
+    python soak.py --requests 20000
+    python soak.py --requests 50000 --concurrency 16 --max-bytes-per-request 1024
+    python soak.py --recordings recordings/*.jsonl --requests 10000   # gravações em loop
+    python soak.py --requests 20000 --json > soak.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("GEMINI_API_KEY", "soak")
+os.environ.setdefault("GOOGLE_API_KEY", "soak")
+# Nada sai do processo: sem outbox, gravação ou avisos de sobrecarga ao backend
+os.environ.setdefault("OUTBOX_ENABLED", "0")
+os.environ.setdefault("RECORD_CONVERSATIONS", "0")
+os.environ.setdefault("OVERLOAD_CONTROL", "0")
+os.environ.setdefault("CALENDAR_PREFETCH", "0")
+os.environ.setdefault("KEY_VALIDATION", "0")
+
+import instrumentation
+import tools
+from recorder import load_recording, replay_payload
+from replay import ReplayStubs, SEND_TOOLS
+
+DEFAULT_MAX_BYTES_PER_REQUEST = 2048
+TOP_GROWTH_SITES = 15
+
+SYNTHETIC_MESSAGES = (
+    "Oi, tudo bem?",
+    "Quero agendar um horário para amanhã às 14h",
+    "Tem horário na sexta de manhã?",
+    "Pode ser às 10:00 então",
+    "Preciso remarcar meu atendimento",
+    "Qual o endereço?",
+    "Sim, pode confirmar",
+)
+
+
+class SyntheticStubs:
+    """LLM que consulta a agenda e responde pela ferramenta de envio; ferramentas com respostas fixas."""
+
+    def __init__(self):
+        self.llm_calls = 0
+
+    def llm(self, request_id, messages, kwargs):
+        self.llm_calls += 1
+        available_functions = kwargs.get("available_functions") or {}
+        if "Verificar Disponibilidade" in available_functions:
+            available_functions["Verificar Disponibilidade"](requested_date="2026-01-20", requested_time="14:00")
+        for name in ("Enviar Mensagem WhatsApp", "Enviar Mensagem Instagram"):
+            if name in available_functions:
+                target = "recipient_id" if "Instagram" in name else "remote_jid"
+                available_functions[name](**{target: "stub", "message": "Olá! O horário das 14h está disponível."})
+                break
+        return "Final Answer: Olá! O horário das 14h está disponível."
+
+    def tool(self, tool, kwargs):
+        if tool.name in SEND_TOOLS:
+            if tool.request_id in tools.TOOLS_USAGE_STATE:
+                tools.TOOLS_USAGE_STATE[tool.request_id]["sent"] = True
+            return "Mensagem enviada com sucesso."
+        if tool.name == "Verificar Disponibilidade":
+            return "✅ Horário disponível: 20/01/2026 às 14:00."
+        return "✅ Operação concluída."
+
+
+def synthetic_payload(i: int, tenants: int) -> dict:
+    rng = random.Random(i)
+    turns = rng.randint(0, 12)
+    history = [
+        {"role": "user" if t % 2 == 0 else "assistant", "content": rng.choice(SYNTHETIC_MESSAGES)}
+        for t in range(turns)
+    ]
+    return {
+        "userId": f"soak_{i % tenants}",
+        "remoteJid": f"55319{i % 100000:05d}0000@s.whatsapp.net",
+        "message": rng.choice(SYNTHETIC_MESSAGES),
+        "agentPrompt": "Você é a atendente do estabelecimento de teste.",
+        "history": history,
+        "userEmail": f"soak_{i % tenants}@example.com",
+        "calendarConnected": True,
+    }
+
+
+def rss_bytes() -> int:
+    """RSS atual (Linux: /proc/self/statm); fora do Linux, o pico (ru_maxrss)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def take_sample(done: int, use_tracemalloc: bool) -> dict:
+    gc.collect()
+    return {
+        "requests": done,
+        "at": time.monotonic(),
+        "rss_bytes": rss_bytes(),
+        "traced_bytes": tracemalloc.get_traced_memory()[0] if use_tracemalloc else None,
+        "live_states": len(tools.TOOLS_USAGE_STATE),
+        "gc_objects": len(gc.get_objects()),
+    }
+
+
+class Soak:
+    def __init__(self, args):
+        self.args = args
+        self.recordings = [load_recording(path) for path in args.recordings or []]
+        self.synthetic = SyntheticStubs()
+        self.done = 0
+        self.errors = 0
+        self.samples = []
+        self.baseline = None   # (amostra, snapshot do tracemalloc) ao fim do aquecimento
+
+    def _stubs_for(self, i):
+        if not self.recordings:
+            return None, synthetic_payload(i, self.args.tenants)
+        events = self.recordings[i % len(self.recordings)]
+        return ReplayStubs(events), replay_payload(events)
+
+    async def _one(self, i):
+        from main import handle_whatsapp_message, handle_instagram_message, MessageInput, InstagramMessageInput
+
+        replay_stubs, payload = self._stubs_for(i)
+        # Gravações: cada requisição serve a própria gravação; com concorrência > 1 use o modo sintético
+        if replay_stubs is not None:
+            instrumentation.LLM_STUB = replay_stubs.llm
+            tools.TOOL_STUB = replay_stubs.tool
+        try:
+            if "senderId" in payload:
+                await handle_instagram_message(InstagramMessageInput(**payload))
+            else:
+                await handle_whatsapp_message(MessageInput(**payload))
+        except Exception as e:
+            self.errors += 1
+            if self.errors <= 5:
+                print(f"⚠️ Requisição {i} falhou: {str(getattr(e, 'detail', None) or e)[:200]}", file=sys.stderr)
+        self.done += 1
+        self._maybe_sample()
+
+    def _take_baseline(self):
+        sample = take_sample(self.done, self.args.tracemalloc)
+        snapshot = tracemalloc.take_snapshot() if self.args.tracemalloc else None
+        self.baseline = (sample, snapshot)
+        self.samples.append(sample)
+        self._print_sample(sample, "referência")
+
+    def _maybe_sample(self):
+        if self.done == self.args.warmup:
+            self._take_baseline()
+        elif self.done > self.args.warmup and self.done % self.args.interval == 0:
+            sample = take_sample(self.done, self.args.tracemalloc)
+            self.samples.append(sample)
+            self._print_sample(sample)
+
+    def _print_sample(self, sample, label=""):
+        traced = f" traced={sample['traced_bytes'] / 2**20:.1f}MiB" if sample["traced_bytes"] is not None else ""
+        print(f"📈 {sample['requests']:>7} req | rss={sample['rss_bytes'] / 2**20:.1f}MiB{traced} "
+              f"estados={sample['live_states']} objetos={sample['gc_objects']} {label}".rstrip(), file=sys.stderr)
+
+    async def run(self):
+        concurrency = 1 if self.recordings else self.args.concurrency
+        if not self.recordings:
+            instrumentation.LLM_STUB = self.synthetic.llm
+            tools.TOOL_STUB = self.synthetic.tool
+        semaphore = asyncio.Semaphore(concurrency)
+        started = time.monotonic()
+        if self.args.warmup == 0:
+            self._take_baseline()
+
+        async def guarded(i):
+            async with semaphore:
+                await self._one(i)
+
+        try:
+            # Lotes limitados: não cria dezenas de milhares de corrotinas de uma vez
+            batch = concurrency * 50
+            for start in range(0, self.args.requests, batch):
+                await asyncio.gather(*(guarded(i) for i in range(start, min(start + batch, self.args.requests))))
+        finally:
+            instrumentation.LLM_STUB = None
+            tools.TOOL_STUB = None
+        # Execuções zumbis (timeout do crew) ainda podem estar terminando em threads
+        await asyncio.sleep(self.args.settle)
+        final = take_sample(self.done, self.args.tracemalloc)
+        self.samples.append(final)
+        return self.report(final, time.monotonic() - started)
+
+    def report(self, final, wall_seconds):
+        base_sample, base_snapshot = self.baseline
+        measured = max(final["requests"] - base_sample["requests"], 1)
+        rss_growth = final["rss_bytes"] - base_sample["rss_bytes"]
+        traced_growth = (final["traced_bytes"] - base_sample["traced_bytes"]) if self.args.tracemalloc else None
+        # tracemalloc mede só o heap do Python (sem fragmentação); sem ele, vale o RSS
+        retained = traced_growth if traced_growth is not None else rss_growth
+
+        growth_sites = []
+        if base_snapshot is not None:
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            for stat in snapshot.compare_to(base_snapshot, "lineno")[:TOP_GROWTH_SITES]:
+                if stat.size_diff <= 0:
+                    continue
+                frame = stat.traceback[0]
+                growth_sites.append({
+                    "site": f"{frame.filename}:{frame.lineno}",
+                    "size_diff_bytes": stat.size_diff,
+                    "count_diff": stat.count_diff,
+                    "bytes_per_request": round(stat.size_diff / measured, 1),
+                })
+
+        bytes_per_request = retained / measured
+        failures = []
+        if bytes_per_request > self.args.max_bytes_per_request:
+            failures.append(f"memória retida {bytes_per_request:.0f} B/req > limite {self.args.max_bytes_per_request} B/req")
+        if final["live_states"]:
+            failures.append(f"{final['live_states']} estados de requisição em TOOLS_USAGE_STATE após o fim")
+        if self.errors > self.args.max_errors:
+            failures.append(f"{self.errors} requisições com erro > limite {self.args.max_errors}")
+        return {
+            "requests": self.done,
+            "errors": self.errors,
+            "max_errors": self.args.max_errors,
+            "wall_seconds": round(wall_seconds, 1),
+            "requests_per_second": round(self.done / wall_seconds, 1) if wall_seconds else None,
+            "measured_requests": measured,
+            "rss_growth_bytes": rss_growth,
+            "traced_growth_bytes": traced_growth,
+            "retained_bytes_per_request": round(bytes_per_request, 1),
+            "max_bytes_per_request": self.args.max_bytes_per_request,
+            "live_states": final["live_states"],
+            "top_growth_sites": growth_sites,
+            "samples": self.samples,
+            "failures": failures,
+            "passed": not failures,
+        }
+
+
+def print_report(report):
+    print(f"Requisições: {report['requests']} ({report['errors']} com erro, limite {report['max_errors']}) em {report['wall_seconds']}s "
+          f"({report['requests_per_second']} req/s)")
+    print(f"Crescimento após o aquecimento ({report['measured_requests']} req): "
+          f"rss={report['rss_growth_bytes'] / 2**20:+.1f}MiB"
+          + (f" traced={report['traced_growth_bytes'] / 2**20:+.1f}MiB" if report["traced_growth_bytes"] is not None else ""))
+    print(f"Memória retida por requisição: {report['retained_bytes_per_request']} B "
+          f"(limite {report['max_bytes_per_request']} B) | estados vivos: {report['live_states']}")
+    if report["top_growth_sites"]:
+        print("Maiores crescimentos de alocação:")
+        for site in report["top_growth_sites"]:
+            print(f"  {site['size_diff_bytes'] / 1024:>9.1f} KiB {site['count_diff']:>+8} blocos "
+                  f"{site['bytes_per_request']:>8} B/req  {site['site']}")
+    if report["passed"]:
+        print("✅ Soak OK")
+    for failure in report["failures"]:
+        print(f"❌ {failure}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test com detecção de crescimento de memória")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=8, help="Requisições simultâneas (modo sintético)")
+    parser.add_argument("--tenants", type=int, default=50, help="userIds distintos no modo sintético")
+    parser.add_argument("--warmup", type=int, default=500, help="Requisições antes do snapshot de referência")
+    parser.add_argument("--interval", type=int, default=1000, help="Requisições entre amostras")
+    parser.add_argument("--settle", type=float, default=2.0, help="Espera (s) antes da amostra final")
+    parser.add_argument("--max-bytes-per-request", type=int, default=DEFAULT_MAX_BYTES_PER_REQUEST)
+    parser.add_argument("--max-errors", type=int, default=0, help="Requisições com erro toleradas")
+    parser.add_argument("--frames", type=int, default=1, help="Profundidade das pilhas do tracemalloc")
+    parser.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false",
+                        help="Só RSS (sem o custo do tracemalloc)")
+    parser.add_argument("--recordings", nargs="*", help="Gravações (recorder.py) servidas em loop")
+    parser.add_argument("--json", action="store_true", help="Imprime o resultado em JSON")
+    args = parser.parse_args()
+    args.warmup = min(args.warmup, max(args.requests - 1, 0))
+
+    if args.tracemalloc:
+        tracemalloc.start(args.frames)
+    report = asyncio.run(Soak(args).run())
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    else:
+        print_report(report)
+    sys.exit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Relatório de tokens das ferramentas: descrições compactas x verbosas (TOOL_VERBOSITY).
+
+As definições das ferramentas (nome, descrição e schema) vão em TODA chamada ao
+LLM, e cada resultado de ferramenta volta como entrada nas iterações seguintes
+do agente. Este script mede, com o código atual de tools.py:
+  - tokens da definição de cada ferramenta nas duas variantes;
+  - tokens dos resultados de cenários típicos (respostas do backend fixas);
+  - estimativa de tokens de entrada das ferramentas por agendamento (listar
+    horários -> verificar -> agendar -> enviar), com cada resultado reenviado
+    nas iterações seguintes.
+Os números medidos em conversas reais vêm do resumo de cada execução
+(tool_tokens) e do replay.py rodado com TOOL_VERBOSITY=verbose e compact.
+
+Uso:
+    python tool_tokens.py
+    python tool_tokens.py --json
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Os flows das ferramentas rodam de verdade: o envio não pode ir para o outbox (e dali a um número real)
+os.environ.setdefault("OUTBOX_ENABLED", "0")
+
+import tools
+from instrumentation import estimate_tokens
+
+VARIANTS = ("verbose", "compact")
+
+WHATSAPP_TOOLS = (
+    tools.WhatsAppSendTool, tools.WhatsAppSendAudioTool, tools.GoogleCalendarTool,
+    tools.GoogleCalendarRescheduleTool, tools.GoogleCalendarCheckAvailabilityTool,
+    tools.GoogleCalendarCancelTool, tools.GoogleCalendarListDaySlotsTool, tools.GoogleCalendarBatchQueryTool,
+)
+
+_START = (datetime.now() + timedelta(days=3)).replace(hour=14, minute=0, second=0, microsecond=0)
+_DATE = _START.strftime("%Y-%m-%d")
+_SUGGESTIONS = [{"formatted": f"{_START.strftime('%d/%m')} às {h}:00"} for h in (15, 16, 17)]
+_EVENTS = [{"id": f"ev{i}", "summary": f"Consulta - Cliente {i}", "start": f"{_DATE}T{9 + i}:00:00"} for i in range(1, 4)]
+_HOURS = "Segunda a Sexta: 08:00 às 18:00\nSábado: 08:00 às 12:00"
+
+
+class _Canned:
+    """Resposta fixa do backend para o flow (mesma interface usada pelas ferramentas)."""
+
+    def __init__(self, payload):
+        self._payload = payload
+        self.status_code = 200
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return self._payload
+
+
+def run_canned(flow, responses):
+    """Executa o flow de uma ferramenta servindo as respostas em ordem (sem rede)."""
+    responses = iter(responses)
+    try:
+        next(flow)
+        while True:
+            flow.send(_Canned(next(responses)))
+    except StopIteration as stop:
+        return stop.value
+
+
+def _scenarios():
+    """(ferramenta, cenário, callable que devolve o texto do resultado)."""
+    calendar = dict(user_id="dono@example.com")
+    schedule = tools.GoogleCalendarTool(**calendar)
+    reschedule = tools.GoogleCalendarRescheduleTool(**calendar)
+    availability = tools.GoogleCalendarCheckAvailabilityTool(**calendar)
+    slots = tools.GoogleCalendarListDaySlotsTool(**calendar)
+    cancel = tools.GoogleCalendarCancelTool(**calendar)
+    send = tools.WhatsAppSendTool(session_id="instance_1")
+    start = _START.strftime("%Y-%m-%dT%H:%M:%S")
+    day_slots = {
+        "success": True, "dayName": "Terça-feira", "formattedDate": _START.strftime("%d/%m/%Y"), "durationMinutes": 60,
+        "slots": [{"time": f"{h:02d}:00"} for h in range(8, 18)], "totalSlots": 10,
+    }
+    return [
+        ("Listar Horários Disponíveis do Dia", "dia com 10 horários",
+         lambda: run_canned(slots._flow(_DATE), [day_slots])),
+        ("Verificar Disponibilidade", "disponível",
+         lambda: run_canned(availability._flow(_DATE, "14:00"), [{"success": True, "available": True}])),
+        ("Verificar Disponibilidade", "conflito com sugestões",
+         lambda: run_canned(availability._flow(_DATE, "14:00"), [{"success": True, "available": False, "reason": "calendar_conflict", "suggestions": _SUGGESTIONS}])),
+        ("Verificar Disponibilidade", "fora do funcionamento",
+         lambda: run_canned(availability._flow(_DATE, "20:00"), [{"success": True, "available": False, "reason": "outside_business_hours", "formattedHours": _HOURS}])),
+        ("Agendar Compromisso", "confirmado (online)",
+         lambda: run_canned(schedule._flow("Maria", "maria@example.com", start), [{"success": True, "meetLink": "https://meet.google.com/abc-defg-hij"}])),
+        ("Agendar Compromisso", "conflito com sugestões",
+         lambda: run_canned(schedule._flow("Maria", "maria@example.com", start), [{"success": False, "reason": "calendar_conflict", "suggestions": _SUGGESTIONS}])),
+        ("Reagendar Compromisso", "lista para escolha",
+         lambda: run_canned(reschedule._flow("maria@example.com", start), [{"success": True, "events": _EVENTS}])),
+        ("Reagendar Compromisso", "reagendado",
+         lambda: run_canned(reschedule._flow("maria@example.com", start, 2), [{"success": True, "events": _EVENTS}, {"success": True, "meetLink": "https://meet.google.com/abc-defg-hij"}])),
+        ("Cancelar Agendamento", "lista para escolha",
+         lambda: run_canned(cancel._flow("maria@example.com"), [{"success": True, "events": _EVENTS}])),
+        ("Cancelar Agendamento", "pede confirmação",
+         lambda: run_canned(cancel._flow("maria@example.com", 2), [{"success": True, "events": _EVENTS}])),
+        ("Cancelar Agendamento", "cancelado",
+         lambda: run_canned(cancel._flow("maria@example.com", 2, True), [{"success": True, "events": _EVENTS}, {"success": True}])),
+        ("Enviar Mensagem WhatsApp", "enviado",
+         lambda: run_canned(send._flow("5531999999999@s.whatsapp.net", "Olá!"), [{"success": True}])),
+    ]
+
+
+# Agendamento típico: cada ferramenta seguida de uma iteração do agente
+BOOKING_FLOW = (
+    ("Listar Horários Disponíveis do Dia", "dia com 10 horários"),
+    ("Verificar Disponibilidade", "disponível"),
+    ("Agendar Compromisso", "confirmado (online)"),
+    ("Enviar Mensagem WhatsApp", "enviado"),
+)
+
+
+def build_report() -> dict:
+    definitions = {
+        cls.model_fields["name"].default: {v: estimate_tokens(cls.definition_text(v)) for v in VARIANTS}
+        for cls in WHATSAPP_TOOLS
+    }
+    results = {}
+    original = tools.TOOL_VERBOSITY
+    try:
+        for variant in VARIANTS:
+            tools.TOOL_VERBOSITY = variant
+            for name, scenario, run in _scenarios():
+                results.setdefault((name, scenario), {})[variant] = estimate_tokens(run())
+    finally:
+        tools.TOOL_VERBOSITY = original
+
+    booking = {}
+    for variant in VARIANTS:
+        per_call = sum(d[variant] for d in definitions.values())
+        llm_calls = len(BOOKING_FLOW) + 1
+        # O resultado i volta como entrada em todas as iterações depois dele
+        result_input = sum(results[step][variant] * (len(BOOKING_FLOW) - i) for i, step in enumerate(BOOKING_FLOW))
+        booking[variant] = {
+            "llm_calls": llm_calls,
+            "definition_tokens_per_call": per_call,
+            "definition_input_tokens": per_call * llm_calls,
+            "result_input_tokens": result_input,
+            "tool_input_tokens": per_call * llm_calls + result_input,
+        }
+    verbose_total, compact_total = booking["verbose"]["tool_input_tokens"], booking["compact"]["tool_input_tokens"]
+    return {
+        "definitions": definitions,
+        "results": [{"tool": name, "scenario": scenario, **tokens} for (name, scenario), tokens in results.items()],
+        "booking": booking,
+        "booking_savings_tokens": verbose_total - compact_total,
+        "booking_savings_ratio": round(1 - compact_total / verbose_total, 3) if verbose_total else None,
+    }
+
+
+def print_report(report):
+    print(f"{'definição da ferramenta':<40} {'verbose':>8} {'compact':>8}")
+    for name, tokens in report["definitions"].items():
+        print(f"{name:<40} {tokens['verbose']:>8} {tokens['compact']:>8}")
+    print()
+    print(f"{'resultado':<62} {'verbose':>8} {'compact':>8}")
+    for row in report["results"]:
+        print(f"{(row['tool'] + ' / ' + row['scenario'])[:62]:<62} {row['verbose']:>8} {row['compact']:>8}")
+    print()
+    print("Agendamento típico (" + " -> ".join(name for name, _ in BOOKING_FLOW) + "):")
+    for variant, stats in report["booking"].items():
+        print(f"  {variant:<8} {stats['llm_calls']} chamadas LLM | definições {stats['definition_tokens_per_call']}/chamada "
+              f"= {stats['definition_input_tokens']} | resultados reenviados {stats['result_input_tokens']} "
+              f"| total {stats['tool_input_tokens']} tokens de entrada")
+    if report["booking_savings_ratio"] is not None:
+        print(f"Economia por agendamento: {report['booking_savings_tokens']} tokens de entrada "
+              f"({report['booking_savings_ratio']:.0%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokens das definições e resultados das ferramentas (verbose x compact)")
+    parser.add_argument("--json", action="store_true", help="Imprime o resultado em JSON")
+    args = parser.parse_args()
+    report = build_report()
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,85 @@
 from crewai.tools import BaseTool
-from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional
-import requests
+from pydantic import BaseModel, Field, ConfigDict, model_validator
+from typing import Optional, List, ClassVar
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextlib
+import contextvars
+import functools
+import threading
 import os
 import json
+import time
+import budgets
+import deadline
+import metrics
+from http_client import BackendCall, send_sync, run_flow, arun_flow
+import outbox
+import audio_dispatch
+import scheduling_rules
+from scheduling_rules import get_rules_cache
+from event_index import get_event_index
 
 # Global state to track tool usage across threads/deepcopies
-# Format: { "request_id": { "sent": False } }
+# Format: { "request_id": { "sent": False, "tool_calls": [...], ... } } (ver instrumentation.py)
 TOOLS_USAGE_STATE = {}
 
+# Hook opcional usado pelo replay.py: quando definido, serve respostas gravadas em vez de chamar o backend.
+# Assinatura: TOOL_STUB(tool, kwargs) -> str
+TOOL_STUB = None
+
+# Texto das ferramentas para o LLM: descrições e resultados são reenviados a cada iteração do agente.
+# "compact" (padrão): descrições curtas e resultados em uma linha, sem blocos de instrução;
+# "verbose": os textos longos originais, para depuração de comportamento do agente.
+TOOL_VERBOSITY = os.getenv("TOOL_VERBOSITY", "compact")
+
+# Máximo de ferramentas somente-leitura executando ao mesmo tempo para UMA requisição
+READ_ONLY_TOOL_CONCURRENCY = int(os.getenv("READ_ONLY_TOOL_CONCURRENCY", "3"))
+
+# Pool compartilhado para consultas somente-leitura executadas em paralelo
+_read_only_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="readonly-tool")
+# Máximo de consultas numa chamada de 'Consultar Agenda em Lote'
+BATCH_QUERY_MAX = int(os.getenv("BATCH_QUERY_MAX", "6"))
+
+
+def say(verbose: str, compact: str) -> str:
+    """Resultado de ferramenta na variante de TOOL_VERBOSITY."""
+    return verbose if TOOL_VERBOSITY == "verbose" else compact
+
+
+def describe(tool_cls, verbosity: str = None) -> str:
+    """Descrição da ferramenta na variante pedida (padrão: TOOL_VERBOSITY)."""
+    if (verbosity or TOOL_VERBOSITY) == "verbose" or not tool_cls.compact_description:
+        return tool_cls.verbose_description.strip()
+    return tool_cls.compact_description
+
+
+def _one_line(text: str) -> str:
+    return "; ".join(line.strip(" •-") for line in str(text).splitlines() if line.strip(" •-"))
+
+
+def _suggestions(suggestions: list) -> str:
+    return "; ".join(s['formatted'] for s in suggestions)
+
+
+def _event_list(events: list) -> str:
+    return "; ".join(f"{i+1}) {e['summary']} - {e['start']}" for i, e in enumerate(events))
+
+
+def _too_soon(requested: str, rejection, action: str, compact_prefix: str) -> str:
+    """Recusa local por antecedência mínima (scheduling_rules.validate)."""
+    return say(
+        f"⚠️ AÇÃO NÃO REALIZADA: O horário solicitado ({requested}) é muito próximo. É necessário {action} com pelo menos {rejection.lead} de antecedência. O horário mínimo disponível agora é {rejection.min_start:%d/%m/%Y às %H:%M}. Por favor, escolha outro horário.",
+        f"⚠️ {compact_prefix}: mínimo {rejection.lead} de antecedência (a partir de {rejection.min_start:%d/%m/%Y %H:%M}). Peça outro horário.",
+    )
+
+
+def _available(date: str, time: str) -> str:
+    return say(
+        f"✅ O horário {date} às {time} está DISPONÍVEL! Você deve agora:\n1. Perguntar ao cliente se ele confirma o agendamento\n2. Se ele confirmar, usar a ferramenta 'Agendar Compromisso'",
+        f"✅ DISPONÍVEL {date} {time}. Peça a confirmação do cliente antes de 'Agendar Compromisso'.",
+    )
+
 
 # ============================================================================
 # SCHEMAS PYDANTIC PARA ARGS_SCHEMA (OBRIGATÓRIOS PARA TOOL CALLING)
@@ -74,6 +145,24 @@ class GoogleCalendarListDaySlotsInput(BaseModel):
     period: Optional[str] = Field(default="all", description="Período do dia: 'morning', 'afternoon', 'evening' ou 'all'")
 
 
+class CalendarQuery(BaseModel):
+    """Uma consulta individual dentro de 'Consultar Agenda em Lote'."""
+    model_config = ConfigDict(extra='ignore')
+    
+    kind: str = Field(..., description="'slots' (listar horários do dia), 'availability' (verificar um horário) ou 'events' (agendamentos de um cliente)")
+    date: Optional[str] = Field(default="", description="Data no formato YYYY-MM-DD (para 'slots' e 'availability')")
+    time: Optional[str] = Field(default="", description="Hora no formato HH:mm (para 'availability')")
+    period: Optional[str] = Field(default="all", description="Período do dia para 'slots': 'morning', 'afternoon', 'evening' ou 'all'")
+    customer_email: Optional[str] = Field(default="", description="E-mail do cliente (para 'events')")
+
+
+class GoogleCalendarBatchQueryInput(BaseModel):
+    """Schema de entrada para consultas de agenda em lote."""
+    model_config = ConfigDict(extra='ignore')
+    
+    queries: List[CalendarQuery] = Field(..., max_length=BATCH_QUERY_MAX, description="Lista de consultas independentes (ex: horários de amanhã e de depois de amanhã)")
+
+
 class GoogleCalendarCancelInput(BaseModel):
     """Schema de entrada para cancelar agendamento."""
     model_config = ConfigDict(extra='ignore')
@@ -83,11 +172,336 @@ class GoogleCalendarCancelInput(BaseModel):
     confirmed: Optional[bool] = Field(default=False, description="True se o cliente confirmou o cancelamento")
 
 
+# ============================================================================
+# BASE COM RASTREAMENTO
+# ============================================================================
+
+def _record_tool_call(request_id, name, kwargs, result, elapsed):
+    """Registra a chamada da ferramenta no estado da requisição (e na gravação, se ativa)."""
+    state = TOOLS_USAGE_STATE.get(request_id) if request_id else None
+    if state is None:
+        return
+    call = {"name": name, "args": kwargs, "result": result, "ms": round(elapsed * 1000, 1)}
+    state.setdefault("tool_calls", []).append(call)
+    if state.get("recording") is not None:
+        state["recording"].append({"type": "tool", **call})
+
+
+def _request_sync(request_id, key, factory):
+    """Objeto de sincronização por requisição (criado uma única vez dentro do estado)."""
+    state = TOOLS_USAGE_STATE.get(request_id) if request_id else None
+    if state is None:
+        return None
+    if key not in state:
+        state.setdefault(key, factory())
+    return state[key]
+
+
+def _side_effect_lock(request_id):
+    """Lock por requisição: ferramentas com efeito colateral (envio, agendar, cancelar) rodam em ordem."""
+    return _request_sync(request_id, "side_effect_lock", threading.Lock) or contextlib.nullcontext()
+
+
+def _read_only_slot(request_id):
+    """Semáforo por requisição que limita as consultas somente-leitura simultâneas."""
+    return _request_sync(
+        request_id, "read_only_semaphore", lambda: threading.BoundedSemaphore(READ_ONLY_TOOL_CONCURRENCY)
+    ) or contextlib.nullcontext()
+
+
+def _async_side_effect_lock(request_id):
+    """Equivalente assíncrono de _side_effect_lock (para _arun)."""
+    return _request_sync(request_id, "side_effect_alock", asyncio.Lock) or contextlib.nullcontext()
+
+
+def _async_read_only_slot(request_id):
+    """Equivalente assíncrono de _read_only_slot (para _arun)."""
+    return _request_sync(
+        request_id, "read_only_asemaphore", lambda: asyncio.BoundedSemaphore(READ_ONLY_TOOL_CONCURRENCY)
+    ) or contextlib.nullcontext()
+
+
+def _guard(tool, async_mode=False):
+    if tool.fan_out:
+        return contextlib.nullcontext()  # as subconsultas ocupam os slots individualmente
+    if tool.read_only:
+        return _async_read_only_slot(tool.request_id) if async_mode else _read_only_slot(tool.request_id)
+    return _async_side_effect_lock(tool.request_id) if async_mode else _side_effect_lock(tool.request_id)
+
+
+def _request_deadline(request_id):
+    state = TOOLS_USAGE_STATE.get(request_id) if request_id else None
+    return state.get("deadline") if state else None
+
+
+def _tracked(run):
+    @functools.wraps(run)
+    def wrapper(self, *args, **kwargs):
+        with _guard(self), deadline.bind(_request_deadline(self.request_id)):
+            started = time.monotonic()
+            refused = budgets.reserve_tool(TOOLS_USAGE_STATE.get(self.request_id), self.name)
+            if refused is not None:
+                result = refused
+            elif TOOL_STUB is not None:
+                result = TOOL_STUB(self, kwargs)
+            else:
+                result = run(self, *args, **kwargs)
+            _record_tool_call(self.request_id, self.name, kwargs, result, time.monotonic() - started)
+        return result
+    return wrapper
+
+
+def _atracked(arun):
+    @functools.wraps(arun)
+    async def wrapper(self, *args, **kwargs):
+        with deadline.bind(_request_deadline(self.request_id)):
+            async with _guard(self, async_mode=True):
+                started = time.monotonic()
+                refused = budgets.reserve_tool(TOOLS_USAGE_STATE.get(self.request_id), self.name)
+                if refused is not None:
+                    result = refused
+                elif TOOL_STUB is not None:
+                    result = TOOL_STUB(self, kwargs)
+                else:
+                    result = await arun(self, *args, **kwargs)
+                _record_tool_call(self.request_id, self.name, kwargs, result, time.monotonic() - started)
+        return result
+    return wrapper
+
+
+class TrackedTool(BaseTool):
+    """
+    Base das ferramentas do engine. Envolve o _run/_arun de cada subclasse para registrar
+    nome, argumentos, resultado e duração em TOOLS_USAGE_STATE[request_id].
+    Os dois caminhos executam o mesmo flow (ver http_client.py), com resultados idênticos.
+
+    Ferramentas com read_only=True podem rodar em paralelo (limitadas por
+    READ_ONLY_TOOL_CONCURRENCY); as demais são serializadas por requisição.
+    """
+    # STATEFUL TRACKING
+    request_id: Optional[str] = Field(default=None, exclude=True)
+
+    # Sem efeito colateral (consultas): seguro executar em paralelo
+    read_only: ClassVar[bool] = False
+    # Dispara outras ferramentas (ex: consulta em lote) e não ocupa slot próprio
+    fan_out: ClassVar[bool] = False
+
+    # Variantes da descrição (ver TOOL_VERBOSITY); sem elas vale o campo description da subclasse
+    verbose_description: ClassVar[str] = ""
+    compact_description: ClassVar[str] = ""
+
+    @model_validator(mode="before")
+    @classmethod
+    def _pick_description(cls, data):
+        if isinstance(data, dict) and "description" not in data and cls.verbose_description:
+            data = {**data, "description": describe(cls)}
+        return data
+
+    @classmethod
+    def definition_text(cls, verbosity: str = None) -> str:
+        """Nome, descrição e schema dos argumentos: o que o LLM recebe desta ferramenta a cada chamada."""
+        description = describe(cls, verbosity) if cls.verbose_description else cls.model_fields["description"].default
+        schema = json.dumps(cls.model_fields["args_schema"].default.model_json_schema(), ensure_ascii=False)
+        return f"{cls.model_fields['name'].default}\n{description}\n{schema}"
+
+    def _run_untracked(self, **kwargs):
+        """_run sem registro, orçamento nem guard: subconsulta de uma ferramenta fan_out, que já foi registrada."""
+        return type(self)._run.__wrapped__(self, **kwargs)
+
+    async def _arun_untracked(self, **kwargs):
+        return await type(self)._arun.__wrapped__(self, **kwargs)
+
+    @classmethod
+    def __pydantic_init_subclass__(cls, **kwargs):
+        super().__pydantic_init_subclass__(**kwargs)
+        if "_run" in cls.__dict__:
+            cls._run = _tracked(cls.__dict__["_run"])
+        if "_arun" in cls.__dict__:
+            cls._arun = _atracked(cls.__dict__["_arun"])
+
+
+# ============================================================================
+# HORÁRIOS DO DIA (compartilhado entre a ferramenta e o prefetch.py)
+# ============================================================================
+
+# Mesmas faixas usadas pelo backend em listAvailableSlotsForDay (hora de Brasília)
+PERIOD_RANGES = {
+    'morning': (0, 12),
+    'afternoon': (12, 18),
+    'evening': (18, 24),
+    'all': (0, 24),
+}
+
+# Quanto a ferramenta espera por um prefetch ainda em andamento antes de ir ao backend
+PREFETCH_WAIT_SECONDS = float(os.getenv("PREFETCH_WAIT_SECONDS", "3"))
+
+
+def day_slots_call(user_id: str, date: str, period: str = "all") -> BackendCall:
+    return BackendCall("POST", "/api/google-calendar/available-slots-for-day", json={
+        "userId": user_id,
+        "date": date,
+        "period": period
+    })
+
+
+def fetch_day_slots(user_id: str, date: str, period: str = "all") -> dict:
+    """POST /api/google-calendar/available-slots-for-day e retorna o JSON do backend."""
+    return send_sync(day_slots_call(user_id, date, period)).json()
+
+
+def filter_day_slots(result: dict, period: str) -> dict:
+    """Aplica localmente o filtro de período sobre um resultado buscado com period='all'."""
+    if not result.get("success") or period == "all" or period not in PERIOD_RANGES:
+        return result
+    start, end = PERIOD_RANGES[period]
+    slots = [s for s in result.get("slots", []) if start <= int(s["time"].split(":")[0]) < end]
+    filtered = dict(result)
+    filtered["slots"] = slots
+    filtered["totalSlots"] = len(slots)
+    return filtered
+
+
+def _prefetch_future(request_id: Optional[str], date: str):
+    """(tem_prefetch, future) para a data; registra miss quando há prefetch mas não para esta data."""
+    state = TOOLS_USAGE_STATE.get(request_id) if request_id else None
+    prefetched = state.get("prefetch") if state else None
+    if prefetched is None:
+        return None
+    future = prefetched.get(date)
+    if future is None:
+        metrics.inc("prefetch_miss_total")
+    return future
+
+
+def _prefetch_outcome(result, period, record_hit):
+    if not result or not result.get("success"):
+        metrics.inc("prefetch_miss_total")
+        return None
+    if record_hit:
+        metrics.inc("prefetch_served_total")
+    return filter_day_slots(result, period)
+
+
+def get_prefetched_day_slots(request_id: Optional[str], date: str, period: str = "all", record_hit: bool = True) -> Optional[dict]:
+    """
+    Retorna o resultado do prefetch para esta data (já filtrado pelo período), ou None.
+    Registra acerto/erro do prefetch nas métricas.
+    """
+    future = _prefetch_future(request_id, date)
+    if future is None:
+        return None
+    try:
+        result = future.result(timeout=PREFETCH_WAIT_SECONDS)
+    except Exception:
+        result = None
+    return _prefetch_outcome(result, period, record_hit)
+
+
+async def aget_prefetched_day_slots(request_id: Optional[str], date: str, period: str = "all", record_hit: bool = True) -> Optional[dict]:
+    """Versão assíncrona de get_prefetched_day_slots (não bloqueia o event loop)."""
+    future = _prefetch_future(request_id, date)
+    if future is None:
+        return None
+    try:
+        result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=PREFETCH_WAIT_SECONDS)
+    except Exception:
+        result = None
+    return _prefetch_outcome(result, period, record_hit)
+
+
+def format_day_slots(result: dict, date: str, period: str = "all") -> str:
+    """Formata o resultado de available-slots-for-day no texto devolvido ao agente."""
+    if result.get("success"):
+        slots = result.get("slots", [])
+        day_name = result.get("dayName", "")
+        formatted_date = result.get("formattedDate", date)
+        total = result.get("totalSlots", len(slots))
+        duration = result.get("durationMinutes", 60)
+        
+        if total == 0:
+            message = result.get("message", "Não há horários disponíveis neste dia.")
+            return f"❌ {message}"
+        
+        slot_times = [s['time'] for s in slots]
+        
+        # Group by period for better readability
+        morning_slots = [t for t in slot_times if int(t.split(':')[0]) < 12]
+        afternoon_slots = [t for t in slot_times if 12 <= int(t.split(':')[0]) < 18]
+        evening_slots = [t for t in slot_times if int(t.split(':')[0]) >= 18]
+
+        if TOOL_VERBOSITY != "verbose":
+            groups = [(label, times) for label, times in (("manhã", morning_slots), ("tarde", afternoon_slots), ("noite", evening_slots)) if times]
+            listed = " | ".join(f"{label}: {', '.join(times)}" for label, times in groups)
+            return f"📅 Livres {day_name} {formatted_date} ({duration} min, {total}): {listed}"
+        
+        response_parts = [f"📅 *Horários disponíveis para {day_name}, {formatted_date}*"]
+        response_parts.append(f"\n(⏱️ Duração: {duration} min)\n")
+        
+        if morning_slots:
+            morning_formatted = '\n• '.join(morning_slots)
+            response_parts.append(f"\n🌅 *MANHÃ*\n\n• {morning_formatted}")
+        if afternoon_slots:
+            afternoon_formatted = '\n• '.join(afternoon_slots)
+            response_parts.append(f"\n\n☀️ *TARDE*\n\n• {afternoon_formatted}")
+        if evening_slots:
+            evening_formatted = '\n• '.join(evening_slots)
+            response_parts.append(f"\n\n🌙 *NOITE*\n\n• {evening_formatted}")
+        
+        response_parts.append(f"\n\n✅ *Total:* {total} horários livres.")
+        response_parts.append("\n\nQual desses você prefere? 😊")
+        
+        return "".join(response_parts)
+    else:
+        return f"Erro ao listar horários: {result.get('error', 'Erro desconhecido')}"
+
+
+def customer_events_text_flow(user_id: str, customer_email: str, search_result: Optional[dict] = None):
+    """
+    Consulta somente-leitura dos agendamentos futuros de um cliente (texto para o agente).
+    search_result: resposta já obtida do índice local (event_index.py); sem ela, busca no backend.
+    """
+    try:
+        if search_result is None:
+            search_response = yield BackendCall(
+                "GET", "/api/google-calendar/customer-events",
+                params={"userId": user_id, "customerEmail": customer_email}
+            )
+            search_result = search_response.json()
+    except Exception as e:
+        return f"Erro de conexão com o serviço de calendário: {str(e)}"
+
+    if not search_result.get("success"):
+        return f"Erro ao buscar agendamentos: {search_result.get('error', 'Erro desconhecido')}"
+    events = search_result.get("events", [])
+    if not events:
+        return f"Nenhum agendamento futuro para o e-mail {customer_email}."
+    event_list = "\n".join(f"  {i+1}. {e['summary']} - {e['start']}" for i, e in enumerate(events))
+    return say(f"Agendamentos de {customer_email}:\n{event_list}", f"Agendamentos: {_event_list(events)}")
+
+
+def enqueue_outbound(request_id, channel, path, recipient_key, payload, mark_sent: bool = True) -> bool:
+    """
+    Coloca a mensagem no outbox durável e marca 'sent' (só depois de gravada).
+    mark_sent=False para avisos que não substituem a resposta (ex: aviso de sobrecarga).
+    Retorna False se o outbox estiver desligado ou indisponível (o chamador envia direto).
+    """
+    if not outbox.OUTBOX_ENABLED:
+        return False
+    try:
+        outbox.get_outbox().enqueue(channel, path, recipient_key, payload, request_id=request_id)
+    except Exception as e:
+        print(f"⚠️ Outbox indisponível, enviando direto: {e}")
+        return False
+    if mark_sent and request_id and request_id in TOOLS_USAGE_STATE:
+        TOOLS_USAGE_STATE[request_id]["sent"] = True
+    return True
+
+
 # ============================================================================
 # FERRAMENTAS
 # ============================================================================
 
-class WhatsAppSendTool(BaseTool):
+class WhatsAppSendTool(TrackedTool):
     name: str = "Enviar Mensagem WhatsApp"
     description: str = "Envia uma mensagem de texto para o cliente no WhatsApp. Use o remote_jid fornecido na tarefa para responder."
     args_schema: type[BaseModel] = WhatsAppSendInput
@@ -96,10 +510,14 @@ class WhatsAppSendTool(BaseTool):
     session_id: str = Field(default="instance_1", description="Session ID do WhatsApp")
     # SECURITY: Lock this tool to a specific recipient to prevent hallucination/data leakage
     default_recipient: Optional[str] = Field(default=None, description="Se definido, força envio para este número ignorando o argumento remote_jid")
-    
-    request_id: Optional[str] = Field(default=None, exclude=True)
 
     def _run(self, remote_jid: str, message: str):
+        return run_flow(self._flow(remote_jid, message))
+
+    async def _arun(self, remote_jid: str, message: str):
+        return await arun_flow(self._flow(remote_jid, message))
+
+    def _flow(self, remote_jid: str, message: str):
         """
         Envia mensagem para o WhatsApp.
         
@@ -107,10 +525,6 @@ class WhatsAppSendTool(BaseTool):
             remote_jid: O ID do cliente (ex: 109384344584362@lid ou 5531999527076@s.whatsapp.net)
             message: A mensagem a ser enviada
         """
-        # TRACKING UPDATE
-        if self.request_id and self.request_id in TOOLS_USAGE_STATE:
-            TOOLS_USAGE_STATE[self.request_id]["sent"] = True
-
         # SECURITY OVERRIDE
         if self.default_recipient:
             if remote_jid != self.default_recipient:
@@ -119,15 +533,23 @@ class WhatsAppSendTool(BaseTool):
         else:
             final_remote_jid = remote_jid
 
-        node_api_url = os.getenv("NODE_BACKEND_URL", "http://localhost:3003")
-        
+        payload = {
+            "userId": self.session_id,  # This is the WhatsApp session ID (instance_1, etc)
+            "phoneNumber": final_remote_jid,   # This is the client's JID
+            "message": message
+        }
+
+        # OUTBOX: grava de forma durável e retorna; a entrega (com retries) é feita em background
+        if enqueue_outbound(self.request_id, "whatsapp", "/api/internal/whatsapp/send-text",
+                            f"whatsapp:{self.session_id}:{final_remote_jid}", payload):
+            return f"Mensagem enviada com sucesso para {final_remote_jid}."
+
         try:
-            response = requests.post(f"{node_api_url}/api/internal/whatsapp/send-text", json={
-                "userId": self.session_id,  # This is the WhatsApp session ID (instance_1, etc)
-                "phoneNumber": final_remote_jid,   # This is the client's JID
-                "message": message
-            })
+            response = yield BackendCall("POST", "/api/internal/whatsapp/send-text", json=payload)
             if response.status_code == 200:
+                # TRACKING UPDATE: só depois de confirmado (falha deixa o retry/envio forçado agir)
+                if self.request_id and self.request_id in TOOLS_USAGE_STATE:
+                    TOOLS_USAGE_STATE[self.request_id]["sent"] = True
                 return f"Mensagem enviada com sucesso para {final_remote_jid}."
             else:
                 return f"Falha ao enviar: {response.text}"
@@ -135,7 +557,7 @@ class WhatsAppSendTool(BaseTool):
             return f"Erro de conexão com o WhatsApp: {str(e)}"
 
 
-class InstagramSendTool(BaseTool):
+class InstagramSendTool(TrackedTool):
     name: str = "Enviar Mensagem Instagram"
     description: str = "Envia uma mensagem de texto para o cliente no Instagram DM. Use o sender_id fornecido na tarefa para responder."
     args_schema: type[BaseModel] = InstagramSendInput
@@ -144,11 +566,14 @@ class InstagramSendTool(BaseTool):
     user_id: str = Field(default="", description="Email do usuário conectado")
     # SECURITY: Lock this tool to a specific recipient
     default_recipient: Optional[str] = Field(default=None, description="Se definido, força envio para este ID ignorando o argumento recipient_id")
-    
-    # STATEFUL TRACKING
-    request_id: Optional[str] = Field(default=None, exclude=True)
 
     def _run(self, recipient_id: str, message: str):
+        return run_flow(self._flow(recipient_id, message))
+
+    async def _arun(self, recipient_id: str, message: str):
+        return await arun_flow(self._flow(recipient_id, message))
+
+    def _flow(self, recipient_id: str, message: str):
         """
         Envia mensagem para o Instagram DM.
         
@@ -156,10 +581,6 @@ class InstagramSendTool(BaseTool):
             recipient_id: O ID do cliente no Instagram
             message: A mensagem a ser enviada
         """
-        # TRACKING UPDATE
-        if self.request_id and self.request_id in TOOLS_USAGE_STATE:
-            TOOLS_USAGE_STATE[self.request_id]["sent"] = True
-
         # SECURITY OVERRIDE
         if self.default_recipient:
             if recipient_id != self.default_recipient:
@@ -168,15 +589,23 @@ class InstagramSendTool(BaseTool):
         else:
             final_recipient_id = recipient_id
 
-        node_api_url = os.getenv("NODE_BACKEND_URL", "http://localhost:3003")
-        
+        payload = {
+            "userId": self.user_id,
+            "recipientId": final_recipient_id,
+            "message": message
+        }
+
+        # OUTBOX: grava de forma durável e retorna; a entrega (com retries) é feita em background
+        if enqueue_outbound(self.request_id, "instagram", "/api/internal/instagram/send-dm",
+                            f"instagram:{self.user_id}:{final_recipient_id}", payload):
+            return f"Mensagem Instagram enviada com sucesso para {final_recipient_id}."
+
         try:
-            response = requests.post(f"{node_api_url}/api/internal/instagram/send-dm", json={
-                "userId": self.user_id,
-                "recipientId": final_recipient_id,
-                "message": message
-            })
+            response = yield BackendCall("POST", "/api/internal/instagram/send-dm", json=payload)
             if response.status_code == 200:
+                # TRACKING UPDATE: só depois de confirmado (falha deixa o retry/envio forçado agir)
+                if self.request_id and self.request_id in TOOLS_USAGE_STATE:
+                    TOOLS_USAGE_STATE[self.request_id]["sent"] = True
                 return f"Mensagem Instagram enviada com sucesso para {final_recipient_id}."
             else:
                 return f"Falha ao enviar Instagram DM: {response.text}"
@@ -184,18 +613,24 @@ class InstagramSendTool(BaseTool):
             return f"Erro de conexão com o Instagram: {str(e)}"
 
 
-class WhatsAppSendAudioTool(BaseTool):
+class WhatsAppSendAudioTool(TrackedTool):
     name: str = "Enviar Áudio WhatsApp"
-    description: str = "Envia uma resposta em ÁUDIO (voz) para o cliente no WhatsApp. Use esta ferramenta quando o cliente solicitar áudio especificamente (ex: 'manda áudio') ou quando você julgar que uma resposta falada é melhor. O texto fornecido será convertido em fala."
+    verbose_description: ClassVar[str] = "Envia uma resposta em ÁUDIO (voz) para o cliente no WhatsApp. Use esta ferramenta quando o cliente solicitar áudio especificamente (ex: 'manda áudio') ou quando você julgar que uma resposta falada é melhor. O texto fornecido será convertido em fala."
+    compact_description: ClassVar[str] = "Envia a resposta em áudio (voz) no WhatsApp. Use se o cliente pedir áudio ou se uma resposta falada for melhor."
     args_schema: type[BaseModel] = WhatsAppAudioInput
     
     # Store session_id as instance variable
     session_id: str = Field(default="instance_1", description="Session ID do WhatsApp")
-    request_id: Optional[str] = Field(default=None, exclude=True)
     # SECURITY: Lock this tool to a specific recipient
     default_recipient: Optional[str] = Field(default=None, description="Se definido, força envio para este número ignorando o argumento remote_jid")
 
     def _run(self, remote_jid: str, message: str):
+        return run_flow(self._flow(remote_jid, message))
+
+    async def _arun(self, remote_jid: str, message: str):
+        return await arun_flow(self._flow(remote_jid, message))
+
+    def _flow(self, remote_jid: str, message: str):
         """
         Envia mensagem de áudio (TTS) para o WhatsApp.
         
@@ -203,9 +638,6 @@ class WhatsAppSendAudioTool(BaseTool):
             remote_jid: O ID do cliente (ex: 109384344584362@lid ou 5531...)
             message: O texto que será falado no áudio
         """
-        # TRACKING UPDATE
-        if self.request_id and self.request_id in TOOLS_USAGE_STATE:
-            TOOLS_USAGE_STATE[self.request_id]["sent"] = True
         # SECURITY OVERRIDE
         if self.default_recipient:
             if remote_jid != self.default_recipient:
@@ -214,24 +646,37 @@ class WhatsAppSendAudioTool(BaseTool):
         else:
             final_remote_jid = remote_jid
 
-        node_api_url = os.getenv("NODE_BACKEND_URL", "http://localhost:3003")
-        
+        # ASYNC AUDIO: síntese fora da thread do agente; se estourar o orçamento, sai o texto
+        if audio_dispatch.AUDIO_ASYNC:
+            try:
+                audio_dispatch.get_audio_dispatcher().dispatch(
+                    self.session_id, final_remote_jid, message, request_id=self.request_id
+                )
+                if self.request_id and self.request_id in TOOLS_USAGE_STATE:
+                    TOOLS_USAGE_STATE[self.request_id]["sent"] = True
+                return f"Áudio enviado com sucesso para {final_remote_jid}."
+            except Exception as e:
+                print(f"⚠️ Envio assíncrono de áudio indisponível, enviando direto: {e}")
+
         try:
-            response = requests.post(f"{node_api_url}/api/internal/whatsapp/send-audio", json={
+            response = yield BackendCall("POST", "/api/internal/whatsapp/send-audio", json={
                 "userId": self.session_id,
                 "phoneNumber": final_remote_jid,
                 "message": message
             })
             if response.status_code == 200:
+                # TRACKING UPDATE: só depois de confirmado (falha deixa o retry/envio forçado agir)
+                if self.request_id and self.request_id in TOOLS_USAGE_STATE:
+                    TOOLS_USAGE_STATE[self.request_id]["sent"] = True
                 return f"Áudio enviado com sucesso para {final_remote_jid}."
             else:
                 return f"Falha ao enviar áudio: {response.text}"
         except Exception as e:
             return f"Erro de conexão com o WhatsApp: {str(e)}"
 
-class GoogleCalendarTool(BaseTool):
+class GoogleCalendarTool(TrackedTool):
     name: str = "Agendar Compromisso"
-    description: str = """
+    verbose_description: ClassVar[str] = """
     Ferramenta para agendar compromissos no calendário. Use esta ferramenta quando o cliente 
     quiser marcar uma reunião, consulta, atendimento ou qualquer compromisso.
     
@@ -258,13 +703,25 @@ class GoogleCalendarTool(BaseTool):
     - end_datetime: Data e hora de fim (OPCIONAL - calculado automaticamente se não fornecido)
     - description: Descrição do compromisso (opcional)
     """
+    compact_description: ClassVar[str] = "Agenda um compromisso (cria o evento, com link do Meet se online). Antes, tenha nome, e-mail e início (ISO) e confirme a disponibilidade. A duração é automática: não pergunte; end_datetime é opcional. Se indisponível, devolve sugestões de horário."
     args_schema: type[BaseModel] = GoogleCalendarInput
     
     user_id: str = Field(default="", description="Email do usuário dono do calendário")
     appointment_duration: int = Field(default=60, description="Duração padrão dos agendamentos em minutos")
 
-    def _run(self, customer_name: str, customer_email: str, start_datetime: str, 
+    def _run(self, customer_name: str, customer_email: str, start_datetime: str,
              end_datetime: str = "", description: str = ""):
+        rules = get_rules_cache().load(self.user_id)
+        return run_flow(self._flow(customer_name, customer_email, start_datetime, end_datetime, description, rules))
+
+    async def _arun(self, customer_name: str, customer_email: str, start_datetime: str,
+             end_datetime: str = "", description: str = ""):
+        rules = await get_rules_cache().aload(self.user_id)
+        return await arun_flow(self._flow(customer_name, customer_email, start_datetime, end_datetime, description, rules))
+
+    def _flow(self, customer_name: str, customer_email: str, start_datetime: str, 
+             end_datetime: str = "", description: str = "",
+             rules: Optional[scheduling_rules.SchedulingRules] = None):
         """
         Agenda um compromisso validando horário de funcionamento e disponibilidade.
         
@@ -274,69 +731,47 @@ class GoogleCalendarTool(BaseTool):
             start_datetime: Data e hora de início (formato ISO)
             end_datetime: Data e hora de fim (formato ISO) - opcional, calculado automaticamente
             description: Descrição opcional do compromisso
+            rules: Regras de agendamento do tenant (scheduling_rules.py, opcional)
         """
-        node_api_url = os.getenv("NODE_BACKEND_URL", "http://localhost:3003")
-        
+        from datetime import timedelta
+        start_dt = scheduling_rules.parse_datetime(start_datetime)
+
         # Calculate end_datetime if not provided, using configured appointment_duration
         if not end_datetime:
-            from datetime import datetime, timedelta
-            try:
-                if 'Z' in start_datetime:
-                    start_dt = datetime.fromisoformat(start_datetime.replace('Z', '+00:00'))
-                elif '+' in start_datetime or (start_datetime.count('-') > 2):
-                    start_dt = datetime.fromisoformat(start_datetime)
-                else:
-                    start_dt = datetime.fromisoformat(start_datetime)
-                
-                end_dt = start_dt + timedelta(minutes=self.appointment_duration)
-                end_datetime = end_dt.strftime('%Y-%m-%dT%H:%M:%S')
-            except Exception:
+            if start_dt is not None:
+                duration = rules.appointment_duration if rules else self.appointment_duration
+                end_datetime = (start_dt + timedelta(minutes=duration)).strftime('%Y-%m-%dT%H:%M:%S')
+            else:
                 # If parsing fails, let backend handle it with default duration
                 end_datetime = start_datetime  # Backend will use appointmentDuration from DB
         
-        # Validação de antecedência mínima de 2 horas
-        from datetime import datetime, timedelta, timezone
-        try:
-            # Parse o datetime de início
-            if 'Z' in start_datetime:
-                start_dt = datetime.fromisoformat(start_datetime.replace('Z', '+00:00'))
-            elif '+' in start_datetime or (start_datetime.count('-') > 2):
-                start_dt = datetime.fromisoformat(start_datetime)
-            else:
-                # Sem timezone, assume UTC-3 (Brasil)
-                start_dt = datetime.fromisoformat(start_datetime)
-            
-            # Converter para comparação naive se necessário
-            now = datetime.now()
-            if start_dt.tzinfo:
-                start_dt_naive = start_dt.replace(tzinfo=None)
-            else:
-                start_dt_naive = start_dt
-            
-            min_time = now + timedelta(hours=2)
-            
-            if start_dt_naive < min_time:
-                return f"⚠️ AÇÃO NÃO REALIZADA: O horário solicitado ({start_datetime}) é muito próximo. É necessário agendar com pelo menos 2 horas de antecedência. O horário mínimo disponível agora é {min_time.strftime('%d/%m/%Y às %H:%M')}. Por favor, escolha outro horário."
-        except Exception as parse_error:
-            pass  # Se falhar o parse, deixa o backend validar
+        # Antecedência mínima e funcionamento checados localmente; se falhar o parse, o backend valida
+        rejection = scheduling_rules.validate(start_dt, rules) if start_dt is not None else None
+        if rejection and rejection.reason == scheduling_rules.INSUFFICIENT_ADVANCE_TIME:
+            return _too_soon(start_datetime, rejection, "agendar", "NÃO AGENDADO")
         
         try:
-            response = requests.post(
-                f"{node_api_url}/api/google-calendar/schedule-appointment",
-                json={
-                    "userId": self.user_id,
-                    "customerName": customer_name,
-                    "customerEmail": customer_email,
-                    "requestedStart": start_datetime,
-                    "requestedEnd": end_datetime,
-                    "description": description
-                }
-            )
-            
-            result = response.json()
+            if rejection:
+                result = rejection.as_result()
+            else:
+                response = yield BackendCall(
+                    "POST", "/api/google-calendar/schedule-appointment",
+                    json={
+                        "userId": self.user_id,
+                        "customerName": customer_name,
+                        "customerEmail": customer_email,
+                        "requestedStart": start_datetime,
+                        "requestedEnd": end_datetime,
+                        "description": description
+                    }
+                )
+                
+                result = response.json()
+                get_rules_cache().reconcile(self.user_id, rules, result)
             
             if result.get("success"):
                 # Agendamento bem-sucedido
+                get_event_index().apply(self.user_id, result.get("event"))
                 if result.get("meetLink"):
                     return f"✅ Agendamento confirmado para {customer_name}! Link da reunião online: {result['meetLink']}"
                 elif result.get("address"):
@@ -347,7 +782,10 @@ class GoogleCalendarTool(BaseTool):
             elif result.get("reason") == "outside_business_hours":
                 # Fora do horário de funcionamento
                 formatted_hours = result.get('formattedHours', 'Horários não disponíveis')
-                return f"❌ {result.get('message', 'Horário fora do funcionamento')}\n\nHorário de funcionamento:\n{formatted_hours}"
+                return say(
+                    f"❌ {result.get('message', 'Horário fora do funcionamento')}\n\nHorário de funcionamento:\n{formatted_hours}",
+                    f"❌ {result.get('message', 'Horário fora do funcionamento')} Funcionamento: {_one_line(formatted_hours)}",
+                )
             
             elif result.get("reason") == "calendar_conflict":
                 # Conflito no calendário - sugerir alternativas
@@ -356,7 +794,10 @@ class GoogleCalendarTool(BaseTool):
                     suggestion_text = "\n".join([
                         f"  • {s['formatted']}" for s in suggestions
                     ])
-                    return f"❌ O horário solicitado não está disponível.\n\nSugestões de horários próximos:\n{suggestion_text}"
+                    return say(
+                        f"❌ O horário solicitado não está disponível.\n\nSugestões de horários próximos:\n{suggestion_text}",
+                        f"❌ Indisponível. Sugestões: {_suggestions(suggestions)}",
+                    )
                 else:
                     return "❌ O horário solicitado não está disponível e não encontramos alternativas próximas."
             
@@ -367,9 +808,17 @@ class GoogleCalendarTool(BaseTool):
             return f"Erro de conexão com o serviço de calendário: {str(e)}"
 
 
-class GoogleCalendarRescheduleTool(BaseTool):
+def _reschedule_outside_hours(result: dict) -> str:
+    formatted_hours = result.get('formattedHours', 'Horários não disponíveis')
+    return say(
+        f"⚠️ AÇÃO NÃO REALIZADA: {result.get('message', 'Horário fora do funcionamento')}\n\nHorário de funcionamento:\n{formatted_hours}",
+        f"⚠️ NÃO REAGENDADO: {result.get('message', 'Horário fora do funcionamento')} Funcionamento: {_one_line(formatted_hours)}",
+    )
+
+
+class GoogleCalendarRescheduleTool(TrackedTool):
     name: str = "Reagendar Compromisso"
-    description: str = """
+    verbose_description: ClassVar[str] = """
     Ferramenta para REAGENDAR um compromisso existente no calendário (mudar data/hora).
     USE ESTA FERRAMENTA quando o cliente quiser MUDAR a data ou hora de um agendamento já existente.
     
@@ -394,12 +843,24 @@ class GoogleCalendarRescheduleTool(BaseTool):
     - new_start_datetime: Nova data/hora de INÍCIO (formato ISO: 2026-01-20T14:00:00) (OBRIGATÓRIO)
     - event_index: Número do evento na lista (1, 2, 3...) - use SOMENTE após cliente escolher
     """
+    compact_description: ClassVar[str] = "Muda a data/hora de um agendamento existente (a duração é mantida). Chame com customer_email e new_start_datetime; se voltar uma lista numerada, pergunte o número ao cliente e chame de novo com os mesmos dados + event_index (1, 2, 3...)."
     args_schema: type[BaseModel] = GoogleCalendarRescheduleInput
     
     user_id: str = Field(default="", description="Email do usuário dono do calendário")
     appointment_duration: int = Field(default=60, description="Duração configurada dos agendamentos em minutos")
 
     def _run(self, customer_email: str, new_start_datetime: str, event_index: int = 0):
+        rules = get_rules_cache().load(self.user_id)
+        search_result = get_event_index().load(self.user_id, customer_email)
+        return run_flow(self._flow(customer_email, new_start_datetime, event_index, rules, search_result))
+
+    async def _arun(self, customer_email: str, new_start_datetime: str, event_index: int = 0):
+        rules = await get_rules_cache().aload(self.user_id)
+        search_result = await get_event_index().aload(self.user_id, customer_email)
+        return await arun_flow(self._flow(customer_email, new_start_datetime, event_index, rules, search_result))
+
+    def _flow(self, customer_email: str, new_start_datetime: str, event_index: int = 0,
+              rules: Optional[scheduling_rules.SchedulingRules] = None, search_result: Optional[dict] = None):
         """
         Reagenda um compromisso existente.
         
@@ -407,42 +868,30 @@ class GoogleCalendarRescheduleTool(BaseTool):
             customer_email: E-mail do cliente
             new_start_datetime: Nova data e hora de início (formato ISO)
             event_index: Número do evento na lista (1, 2, 3...) - opcional
+            rules: Regras de agendamento do tenant (scheduling_rules.py, opcional)
+            search_result: Eventos do cliente já obtidos do índice local (event_index.py, opcional)
         """
-        node_api_url = os.getenv("NODE_BACKEND_URL", "http://localhost:3003")
-        
-        # Validação de antecedência mínima de 2 horas
-        from datetime import datetime, timedelta
-        try:
-            if 'Z' in new_start_datetime:
-                start_dt = datetime.fromisoformat(new_start_datetime.replace('Z', '+00:00'))
-            elif '+' in new_start_datetime or (new_start_datetime.count('-') > 2):
-                start_dt = datetime.fromisoformat(new_start_datetime)
-            else:
-                start_dt = datetime.fromisoformat(new_start_datetime)
-            
-            now = datetime.now()
-            if start_dt.tzinfo:
-                start_dt_naive = start_dt.replace(tzinfo=None)
-            else:
-                start_dt_naive = start_dt
-            
-            min_time = now + timedelta(hours=2)
-            
-            if start_dt_naive < min_time:
-                return f"⚠️ AÇÃO NÃO REALIZADA: O horário solicitado ({new_start_datetime}) é muito próximo. É necessário reagendar com pelo menos 2 horas de antecedência. O horário mínimo disponível agora é {min_time.strftime('%d/%m/%Y às %H:%M')}. Por favor, escolha outro horário."
-        except Exception as parse_error:
-            pass  # Se falhar o parse, deixa o backend validar
+        from datetime import timedelta
+        start_dt = scheduling_rules.parse_datetime(new_start_datetime)
+
+        # Antecedência mínima e funcionamento checados localmente, antes de buscar os eventos do cliente
+        rejection = scheduling_rules.validate(start_dt, rules) if start_dt is not None else None
+        if rejection and rejection.reason == scheduling_rules.INSUFFICIENT_ADVANCE_TIME:
+            return _too_soon(new_start_datetime, rejection, "reagendar", "NÃO REAGENDADO")
+        if rejection:
+            return _reschedule_outside_hours(rejection.as_result())
         
         try:
-            # Sempre buscar eventos pelo email primeiro
-            search_response = requests.get(
-                f"{node_api_url}/api/google-calendar/customer-events",
-                params={
-                    "userId": self.user_id,
-                    "customerEmail": customer_email
-                }
-            )
-            search_result = search_response.json()
+            # Sempre buscar eventos pelo email primeiro (se o índice local não respondeu)
+            if search_result is None:
+                search_response = yield BackendCall(
+                    "GET", "/api/google-calendar/customer-events",
+                    params={
+                        "userId": self.user_id,
+                        "customerEmail": customer_email
+                    }
+                )
+                search_result = search_response.json()
             
             if not search_result.get("success"):
                 return f"⚠️ AÇÃO NÃO REALIZADA: Erro ao buscar agendamentos: {search_result.get('error', 'Erro desconhecido')}"
@@ -472,7 +921,7 @@ class GoogleCalendarRescheduleTool(BaseTool):
                     f"  {i+1}. {e['summary']} - {e['start']}" 
                     for i, e in enumerate(events)
                 ])
-                return f"""⚠️ AÇÃO NÃO REALIZADA - PRECISO QUE O CLIENTE ESCOLHA:
+                return say(f"""⚠️ AÇÃO NÃO REALIZADA - PRECISO QUE O CLIENTE ESCOLHA:
 
 Encontrei {len(events)} agendamentos para {customer_email}:
 {event_list}
@@ -483,15 +932,18 @@ Encontrei {len(events)} agendamentos para {customer_email}:
    - new_start_datetime: "{new_start_datetime}"
    - event_index: [número que o cliente escolheu]
 
-ATENÇÃO: O reagendamento NÃO foi feito. Você DEVE chamar a ferramenta novamente."""
+ATENÇÃO: O reagendamento NÃO foi feito. Você DEVE chamar a ferramenta novamente.""",
+                    f"⚠️ NÃO REAGENDADO: {len(events)} agendamentos: {_event_list(events)}. "
+                    "Pergunte qual número reagendar e chame de novo com os mesmos dados + event_index.")
             
             # Calcular horário de término
-            end_dt = start_dt + timedelta(minutes=self.appointment_duration)
+            duration = rules.appointment_duration if rules else self.appointment_duration
+            end_dt = start_dt + timedelta(minutes=duration)
             new_end_datetime = end_dt.strftime('%Y-%m-%dT%H:%M:%S')
             
             # Fazer o reagendamento
-            response = requests.post(
-                f"{node_api_url}/api/google-calendar/reschedule-appointment",
+            response = yield BackendCall(
+                "POST", "/api/google-calendar/reschedule-appointment",
                 json={
                     "userId": self.user_id,
                     "eventId": event_id,
@@ -501,8 +953,14 @@ ATENÇÃO: O reagendamento NÃO foi feito. Você DEVE chamar a ferramenta novame
             )
             
             result = response.json()
+            get_rules_cache().reconcile(self.user_id, rules, result)
             
             if result.get("success"):
+                if result.get("event"):
+                    get_event_index().apply(self.user_id, result["event"])
+                else:
+                    get_event_index().move(self.user_id, event_id, result.get("newStart", new_start_datetime),
+                                           result.get("newEnd", new_end_datetime))
                 meet_link = result.get("meetLink")
                 address = result.get("address")
                 customer_name = result.get("customerName") or selected_event.get('summary', 'Agendamento')
@@ -514,6 +972,9 @@ ATENÇÃO: O reagendamento NÃO foi feito. Você DEVE chamar a ferramenta novame
                     display_date = new_start_datetime
                 
                 # Build response based on service type
+                if TOOL_VERBOSITY != "verbose":
+                    extra = f" Link: {meet_link}" if meet_link else (f" Endereço: {address}" if address else "")
+                    return f"✅ Reagendado: '{customer_name}' para {display_date}.{extra}"
                 if meet_link:
                     # Online appointment
                     return f"✅ REAGENDAMENTO CONCLUÍDO COM SUCESSO!\n\nO compromisso '{customer_name}' foi alterado para {display_date}.\n\nLink da reunião: {meet_link}"
@@ -527,8 +988,7 @@ ATENÇÃO: O reagendamento NÃO foi feito. Você DEVE chamar a ferramenta novame
                 return f"⚠️ AÇÃO NÃO REALIZADA: {result.get('message')}"
             
             elif result.get("reason") == "outside_business_hours":
-                formatted_hours = result.get('formattedHours', 'Horários não disponíveis')
-                return f"⚠️ AÇÃO NÃO REALIZADA: {result.get('message', 'Horário fora do funcionamento')}\n\nHorário de funcionamento:\n{formatted_hours}"
+                return _reschedule_outside_hours(result)
             
             elif result.get("reason") == "calendar_conflict":
                 suggestions = result.get("suggestions", [])
@@ -536,7 +996,10 @@ ATENÇÃO: O reagendamento NÃO foi feito. Você DEVE chamar a ferramenta novame
                     suggestion_text = "\n".join([
                         f"  • {s['formatted']}" for s in suggestions
                     ])
-                    return f"⚠️ AÇÃO NÃO REALIZADA: O novo horário não está disponível.\n\nSugestões de horários próximos:\n{suggestion_text}"
+                    return say(
+                        f"⚠️ AÇÃO NÃO REALIZADA: O novo horário não está disponível.\n\nSugestões de horários próximos:\n{suggestion_text}",
+                        f"⚠️ NÃO REAGENDADO: horário indisponível. Sugestões: {_suggestions(suggestions)}",
+                    )
                 else:
                     return "⚠️ AÇÃO NÃO REALIZADA: O novo horário não está disponível e não encontramos alternativas próximas."
             
@@ -547,9 +1010,9 @@ ATENÇÃO: O reagendamento NÃO foi feito. Você DEVE chamar a ferramenta novame
             return f"⚠️ AÇÃO NÃO REALIZADA: Erro de conexão com o serviço de calendário: {str(e)}"
 
 
-class GoogleCalendarCheckAvailabilityTool(BaseTool):
+class GoogleCalendarCheckAvailabilityTool(TrackedTool):
     name: str = "Verificar Disponibilidade"
-    description: str = """
+    verbose_description: ClassVar[str] = """
     Ferramenta OBRIGATÓRIA para verificar se um horário está livre ANTES de sugerir ou confirmar.
     
     USE ESTA FERRAMENTA QUANDO:
@@ -566,32 +1029,60 @@ class GoogleCalendarCheckAvailabilityTool(BaseTool):
     - requested_date: Data (YYYY-MM-DD)
     - requested_time: Hora (HH:mm)
     """
+    compact_description: ClassVar[str] = "Verifica se um horário (YYYY-MM-DD, HH:mm) está livre: antecedência mínima, funcionamento e conflitos. Obrigatória antes de sugerir ou confirmar um horário e antes de 'Agendar Compromisso'."
     args_schema: type[BaseModel] = GoogleCalendarCheckAvailabilityInput
+    read_only: ClassVar[bool] = True
     
     user_id: str = Field(default="", description="Email do usuário dono do calendário")
 
     def _run(self, requested_date: str, requested_time: str):
+        prefetched = get_prefetched_day_slots(self.request_id, requested_date, record_hit=False)
+        rules = get_rules_cache().load(self.user_id)
+        return run_flow(self._flow(requested_date, requested_time, prefetched, rules))
+
+    async def _arun(self, requested_date: str, requested_time: str):
+        prefetched = await aget_prefetched_day_slots(self.request_id, requested_date, record_hit=False)
+        rules = await get_rules_cache().aload(self.user_id)
+        return await arun_flow(self._flow(requested_date, requested_time, prefetched, rules))
+
+    def _flow(self, requested_date: str, requested_time: str, prefetched: Optional[dict] = None,
+              rules: Optional[scheduling_rules.SchedulingRules] = None):
         """
         Verifica disponibilidade de um horário.
         
         Args:
             requested_date: Data (YYYY-MM-DD)
             requested_time: Hora (HH:mm)
+            prefetched: Horários do dia já buscados pelo prefetch.py (opcional)
+            rules: Regras de agendamento do tenant (scheduling_rules.py, opcional)
         """
-        node_api_url = os.getenv("NODE_BACKEND_URL", "http://localhost:3003")
+        # Se o dia já foi buscado em paralelo (prefetch.py) e o horário está na grade livre,
+        # responde sem ir ao backend. Casos indisponíveis seguem para o backend (motivo + sugestões).
+        if prefetched and any(s.get("time") == requested_time for s in prefetched.get("slots", [])):
+            metrics.inc("prefetch_served_total")
+            return _available(requested_date, requested_time)
+
+        # Antecedência e funcionamento recusados localmente; só conflitos de agenda precisam do backend
+        requested = requested_date if "T" in requested_date else f"{requested_date}T{requested_time}"
+        start_dt = scheduling_rules.parse_datetime(requested)
+        rejection = scheduling_rules.validate(start_dt, rules) if start_dt is not None else None
         
         try:
-            response = requests.post(f"{node_api_url}/api/google-calendar/check-availability", json={
-                "userId": self.user_id,
-                "date": requested_date,
-                "time": requested_time
-            })
-            
-            result = response.json()
+            if rejection:
+                result = {**rejection.as_result(), "success": True, "available": False}
+            else:
+                response = yield BackendCall("POST", "/api/google-calendar/check-availability", json={
+                    "userId": self.user_id,
+                    "date": requested_date,
+                    "time": requested_time
+                })
+                
+                result = response.json()
+                get_rules_cache().reconcile(self.user_id, rules, result)
             
             if result.get("success"):
                 if result.get("available"):
-                     return f"✅ O horário {requested_date} às {requested_time} está DISPONÍVEL! Você deve agora:\n1. Perguntar ao cliente se ele confirma o agendamento\n2. Se ele confirmar, usar a ferramenta 'Agendar Compromisso'"
+                    return _available(requested_date, requested_time)
                 else:
                     reason = result.get("reason", "unknown")
                     message = result.get("message", "Indisponível")
@@ -601,7 +1092,10 @@ class GoogleCalendarCheckAvailabilityTool(BaseTool):
                     
                     elif reason == "outside_business_hours":
                         formatted_hours = result.get('formattedHours', 'Horários não disponíveis')
-                        return f"❌ INDISPONÍVEL: Fora do horário de funcionamento.\nHorários:\n{formatted_hours}"
+                        return say(
+                            f"❌ INDISPONÍVEL: Fora do horário de funcionamento.\nHorários:\n{formatted_hours}",
+                            f"❌ INDISPONÍVEL: fora do funcionamento ({_one_line(formatted_hours)})",
+                        )
                     
                     elif reason == "calendar_conflict":
                         suggestions = result.get("suggestions", [])
@@ -609,7 +1103,10 @@ class GoogleCalendarCheckAvailabilityTool(BaseTool):
                             suggestion_text = "\n".join([
                                 f"  • {s['formatted']}" for s in suggestions
                             ])
-                            return f"❌ INDISPONÍVEL: Já existe um agendamento neste horário.\n\nSugestões próximas:\n{suggestion_text}"
+                            return say(
+                                f"❌ INDISPONÍVEL: Já existe um agendamento neste horário.\n\nSugestões próximas:\n{suggestion_text}",
+                                f"❌ INDISPONÍVEL: ocupado. Sugestões: {_suggestions(suggestions)}",
+                            )
                         else:
                              return "❌ INDISPONÍVEL: Já existe um agendamento e não há horários próximos livres."
                     
@@ -622,9 +1119,9 @@ class GoogleCalendarCheckAvailabilityTool(BaseTool):
             return f"Erro de conexão: {str(e)}"
 
 
-class GoogleCalendarListDaySlotsTool(BaseTool):
+class GoogleCalendarListDaySlotsTool(TrackedTool):
     name: str = "Listar Horários Disponíveis do Dia"
-    description: str = """
+    verbose_description: ClassVar[str] = """
     Lista TODOS os horários disponíveis para um dia específico.
     
     USE ESTA FERRAMENTA QUANDO:
@@ -641,81 +1138,42 @@ class GoogleCalendarListDaySlotsTool(BaseTool):
     - date: Data no formato YYYY-MM-DD (OBRIGATÓRIO)
     - period: 'morning' (manhã), 'afternoon' (tarde), 'evening' (noite), ou 'all' (OPCIONAL, padrão: all)
     """
+    compact_description: ClassVar[str] = "Lista os horários livres de um dia (YYYY-MM-DD), opcionalmente por período: morning, afternoon, evening ou all. Já considera duração, funcionamento e agenda."
     args_schema: type[BaseModel] = GoogleCalendarListDaySlotsInput
+    read_only: ClassVar[bool] = True
     
     user_id: str = Field(default="", description="Email do usuário dono do calendário")
 
     def _run(self, date: str, period: str = "all"):
+        # Se o engine já buscou este dia em paralelo (prefetch.py), usa o resultado
+        prefetched = get_prefetched_day_slots(self.request_id, date, period)
+        return run_flow(self._flow(date, period, prefetched))
+
+    async def _arun(self, date: str, period: str = "all"):
+        prefetched = await aget_prefetched_day_slots(self.request_id, date, period)
+        return await arun_flow(self._flow(date, period, prefetched))
+
+    def _flow(self, date: str, period: str = "all", prefetched: Optional[dict] = None):
         """
         Lista todos os horários disponíveis para um dia.
         
         Args:
             date: Data (YYYY-MM-DD)
             period: 'morning', 'afternoon', 'evening', ou 'all'
+            prefetched: Resultado já buscado pelo prefetch.py (opcional)
         """
-        node_api_url = os.getenv("NODE_BACKEND_URL", "http://localhost:3003")
-        
         try:
-            response = requests.post(f"{node_api_url}/api/google-calendar/available-slots-for-day", json={
-                "userId": self.user_id,
-                "date": date,
-                "period": period
-            })
-            
-            result = response.json()
-            
-            if result.get("success"):
-                slots = result.get("slots", [])
-                day_name = result.get("dayName", "")
-                formatted_date = result.get("formattedDate", date)
-                total = result.get("totalSlots", len(slots))
-                duration = result.get("durationMinutes", 60)
-                
-                if total == 0:
-                    message = result.get("message", "Não há horários disponíveis neste dia.")
-                    return f"❌ {message}"
-                
-                # Format slots nicely
-                period_name = {
-                    'morning': 'pela manhã',
-                    'afternoon': 'à tarde',
-                    'evening': 'à noite',
-                    'all': ''
-                }.get(period, '')
-                
-                slot_times = [s['time'] for s in slots]
-                
-                # Group by period for better readability
-                morning_slots = [t for t in slot_times if int(t.split(':')[0]) < 12]
-                afternoon_slots = [t for t in slot_times if 12 <= int(t.split(':')[0]) < 18]
-                evening_slots = [t for t in slot_times if int(t.split(':')[0]) >= 18]
-                
-                response_parts = [f"📅 *Horários disponíveis para {day_name}, {formatted_date}*"]
-                response_parts.append(f"\n(⏱️ Duração: {duration} min)\n")
-                
-                if morning_slots:
-                    morning_formatted = '\n• '.join(morning_slots)
-                    response_parts.append(f"\n🌅 *MANHÃ*\n\n• {morning_formatted}")
-                if afternoon_slots:
-                    afternoon_formatted = '\n• '.join(afternoon_slots)
-                    response_parts.append(f"\n\n☀️ *TARDE*\n\n• {afternoon_formatted}")
-                if evening_slots:
-                    evening_formatted = '\n• '.join(evening_slots)
-                    response_parts.append(f"\n\n🌙 *NOITE*\n\n• {evening_formatted}")
-                
-                response_parts.append(f"\n\n✅ *Total:* {total} horários livres.")
-                response_parts.append("\n\nQual desses você prefere? 😊")
-                
-                return "".join(response_parts)
-            else:
-                return f"Erro ao listar horários: {result.get('error', 'Erro desconhecido')}"
-                
+            result = prefetched
+            if result is None:
+                response = yield day_slots_call(self.user_id, date, period)
+                result = response.json()
+            return format_day_slots(result, date, period)
         except Exception as e:
             return f"Erro de conexão: {str(e)}"
 
-class GoogleCalendarCancelTool(BaseTool):
+class GoogleCalendarCancelTool(TrackedTool):
     name: str = "Cancelar Agendamento"
-    description: str = """
+    verbose_description: ClassVar[str] = """
     Ferramenta para CANCELAR um compromisso existente no calendário.
     USE ESTA FERRAMENTA quando o cliente quiser CANCELAR (remover) um agendamento.
     
@@ -738,11 +1196,21 @@ class GoogleCalendarCancelTool(BaseTool):
     - event_index: Número do evento na lista (1, 2, 3...) - use SOMENTE após cliente escolher
     - confirmed: True se o cliente já confirmou que deseja cancelar
     """
+    compact_description: ClassVar[str] = "Cancela um agendamento existente. Chame com customer_email; se voltar uma lista, chame de novo com event_index (número da lista). Só cancela com confirmed=True, depois que o cliente confirmar."
     args_schema: type[BaseModel] = GoogleCalendarCancelInput
     
     user_id: str = Field(default="", description="Email do usuário dono do calendário")
 
     def _run(self, customer_email: str, event_index: int = 0, confirmed: bool = False):
+        search_result = get_event_index().load(self.user_id, customer_email)
+        return run_flow(self._flow(customer_email, event_index, confirmed, search_result))
+
+    async def _arun(self, customer_email: str, event_index: int = 0, confirmed: bool = False):
+        search_result = await get_event_index().aload(self.user_id, customer_email)
+        return await arun_flow(self._flow(customer_email, event_index, confirmed, search_result))
+
+    def _flow(self, customer_email: str, event_index: int = 0, confirmed: bool = False,
+              search_result: Optional[dict] = None):
         """
         Cancela um compromisso existente.
         
@@ -750,19 +1218,19 @@ class GoogleCalendarCancelTool(BaseTool):
             customer_email: E-mail do cliente
             event_index: Número do evento na lista (1, 2, 3...) - opcional
             confirmed: Se o cliente confirmou o cancelamento
+            search_result: Eventos do cliente já obtidos do índice local (event_index.py, opcional)
         """
-        node_api_url = os.getenv("NODE_BACKEND_URL", "http://localhost:3003")
-        
         try:
-            # 1. Primeiro, buscar eventos do cliente
-            search_response = requests.get(
-                f"{node_api_url}/api/google-calendar/customer-events",
-                params={
-                    "userId": self.user_id,
-                    "customerEmail": customer_email
-                }
-            )
-            search_result = search_response.json()
+            # 1. Primeiro, buscar eventos do cliente (se o índice local não respondeu)
+            if search_result is None:
+                search_response = yield BackendCall(
+                    "GET", "/api/google-calendar/customer-events",
+                    params={
+                        "userId": self.user_id,
+                        "customerEmail": customer_email
+                    }
+                )
+                search_result = search_response.json()
             
             if not search_result.get("success"):
                 return f"⚠️ AÇÃO NÃO REALIZADA: Erro ao buscar agendamentos: {search_result.get('error', 'Erro desconhecido')}"
@@ -792,7 +1260,7 @@ class GoogleCalendarCancelTool(BaseTool):
                     f"  {i+1}. {e['summary']} - {e['start']}" 
                     for i, e in enumerate(events)
                 ])
-                return f"""⚠️ AÇÃO NÃO REALIZADA - PRECISO QUE O CLIENTE ESCOLHA:
+                return say(f"""⚠️ AÇÃO NÃO REALIZADA - PRECISO QUE O CLIENTE ESCOLHA:
 
 Encontrei {len(events)} agendamentos para {customer_email}:
 {event_list}
@@ -803,11 +1271,13 @@ Encontrei {len(events)} agendamentos para {customer_email}:
    - event_index: [número que o cliente escolheu]
    - confirmed: False (para pedir confirmação)
 
-ATENÇÃO: O cancelamento NÃO foi feito. Você DEVE chamar a ferramenta novamente."""
+ATENÇÃO: O cancelamento NÃO foi feito. Você DEVE chamar a ferramenta novamente.""",
+                    f"⚠️ NÃO CANCELADO: {len(events)} agendamentos: {_event_list(events)}. "
+                    "Pergunte qual número cancelar e chame de novo com event_index (confirmed=False).")
             
             # Pedir confirmação antes de cancelar
             if not confirmed:
-                return f"""⚠️ CONFIRMAÇÃO NECESSÁRIA:
+                return say(f"""⚠️ CONFIRMAÇÃO NECESSÁRIA:
 
 Você deseja realmente cancelar o seguinte agendamento?
 📅 {selected_event['summary']}
@@ -819,11 +1289,13 @@ Você deseja realmente cancelar o seguinte agendamento?
    - event_index: {event_index if event_index > 0 else 1}
    - confirmed: True
 
-ATENÇÃO: O cancelamento NÃO foi feito ainda. Aguarde confirmação do cliente."""
+ATENÇÃO: O cancelamento NÃO foi feito ainda. Aguarde confirmação do cliente.""",
+                    f"⚠️ NÃO CANCELADO: confirme com o cliente o cancelamento de '{selected_event['summary']}' ({selected_event['start']}); "
+                    f"se confirmar, chame de novo com event_index={event_index if event_index > 0 else 1} e confirmed=True.")
             
             # Fazer o cancelamento
-            response = requests.post(
-                f"{node_api_url}/api/google-calendar/cancel-appointment",
+            response = yield BackendCall(
+                "POST", "/api/google-calendar/cancel-appointment",
                 json={
                     "userId": self.user_id,
                     "eventId": event_id
@@ -833,10 +1305,136 @@ ATENÇÃO: O cancelamento NÃO foi feito ainda. Aguarde confirmação do cliente
             result = response.json()
             
             if result.get("success"):
-                return f"✅ Agendamento cancelado com sucesso!\n\nO compromisso '{selected_event['summary']}' foi removido do calendário."
+                get_event_index().remove(self.user_id, event_id)
+                return say(
+                    f"✅ Agendamento cancelado com sucesso!\n\nO compromisso '{selected_event['summary']}' foi removido do calendário.",
+                    f"✅ Cancelado: '{selected_event['summary']}'.",
+                )
             else:
                 return f"❌ Erro ao cancelar: {result.get('error', 'Erro desconhecido')}"
                 
         except Exception as e:
             return f"Erro de conexão com o serviço de calendário: {str(e)}"
 
+
+class GoogleCalendarBatchQueryTool(TrackedTool):
+    name: str = "Consultar Agenda em Lote"
+    verbose_description: ClassVar[str] = """
+    Executa VÁRIAS consultas de agenda de uma vez, em paralelo (somente leitura, não agenda nada).
+    
+    USE ESTA FERRAMENTA QUANDO precisar de mais de uma consulta independente, por exemplo:
+    - horários livres de amanhã E de depois de amanhã
+    - verificar dois horários diferentes que o cliente sugeriu
+    - agendamentos existentes do cliente + horários livres de um dia
+    
+    Cada item de 'queries' tem:
+    - kind: 'slots' (date, period), 'availability' (date, time) ou 'events' (customer_email)
+    """
+    compact_description: ClassVar[str] = "Várias consultas de agenda de uma vez, em paralelo (só leitura). Cada item de queries: kind 'slots' (date, period), 'availability' (date, time) ou 'events' (customer_email)."
+    args_schema: type[BaseModel] = GoogleCalendarBatchQueryInput
+    read_only: ClassVar[bool] = True
+    fan_out: ClassVar[bool] = True
+    
+    user_id: str = Field(default="", description="Email do usuário dono do calendário")
+
+    def _subtool(self, query: dict):
+        """(ferramenta, kwargs) para a consulta, ou (None, mensagem de erro)."""
+        kind = query.get("kind")
+        if kind == "slots":
+            tool = GoogleCalendarListDaySlotsTool(user_id=self.user_id, request_id=self.request_id)
+            return tool, {"date": query.get("date", ""), "period": query.get("period") or "all"}
+        if kind == "availability":
+            tool = GoogleCalendarCheckAvailabilityTool(user_id=self.user_id, request_id=self.request_id)
+            return tool, {"requested_date": query.get("date", ""), "requested_time": query.get("time", "")}
+        if kind == "events":
+            return "events", {"user_id": self.user_id, "customer_email": query.get("customer_email", "")}
+        return None, f"Consulta inválida: kind '{kind}' não reconhecido (use 'slots', 'availability' ou 'events')."
+
+    # As subconsultas não são registradas em tool_calls nem contadas no orçamento:
+    # a chamada do lote (com todos os resultados) já foi
+
+    def _query(self, query: dict) -> str:
+        tool, kwargs = self._subtool(query)
+        if tool is None:
+            return kwargs
+        with _read_only_slot(self.request_id):
+            if tool == "events":
+                indexed = get_event_index().load(**kwargs)
+                return run_flow(customer_events_text_flow(**kwargs, search_result=indexed))
+            return tool._run_untracked(**kwargs)
+
+    async def _aquery(self, query: dict) -> str:
+        tool, kwargs = self._subtool(query)
+        if tool is None:
+            return kwargs
+        async with _async_read_only_slot(self.request_id):
+            if tool == "events":
+                indexed = await get_event_index().aload(**kwargs)
+                return await arun_flow(customer_events_text_flow(**kwargs, search_result=indexed))
+            return await tool._arun_untracked(**kwargs)
+
+    def _worker(self, queries: list) -> list:
+        results = []
+        for query in queries:
+            try:
+                results.append(self._query(query))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    @staticmethod
+    def _normalize(queries) -> list:
+        return [q.model_dump() if isinstance(q, BaseModel) else dict(q) for q in queries or []]
+
+    @staticmethod
+    def _too_many(queries: list) -> Optional[str]:
+        if len(queries) <= BATCH_QUERY_MAX:
+            return None
+        return f"Consultas demais ({len(queries)}): use no máximo {BATCH_QUERY_MAX} por chamada."
+
+    @staticmethod
+    def _join(queries: list, results: list) -> str:
+        parts = []
+        for i, (query, result) in enumerate(zip(queries, results), start=1):
+            label = " ".join(str(query.get(k)) for k in ("kind", "date", "time", "customer_email") if query.get(k))
+            if isinstance(result, Exception):
+                result = f"Erro de conexão: {str(result)}"
+            parts.append(say(f"🔎 Consulta {i} ({label}):\n{result}", f"[{i}] {label}: {result}"))
+        return say("\n\n".join(parts), "\n".join(parts))
+
+    def _run(self, queries: list):
+        """
+        Executa as consultas em paralelo e devolve os resultados na mesma ordem.
+        
+        Args:
+            queries: Lista de consultas (kind, date, time, period, customer_email)
+        """
+        queries = self._normalize(queries)
+        if not queries:
+            return "Nenhuma consulta informada."
+        too_many = self._too_many(queries)
+        if too_many:
+            return too_many
+
+        # Só READ_ONLY_TOOL_CONCURRENCY threads do pool compartilhado por lote (cada uma com
+        # uma fatia das consultas), com o contexto da requisição (prazo) copiado para cada uma
+        workers = min(READ_ONLY_TOOL_CONCURRENCY, len(queries))
+        futures = [
+            _read_only_executor.submit(contextvars.copy_context().run, self._worker, queries[i::workers])
+            for i in range(workers)
+        ]
+        results = [None] * len(queries)
+        for i, future in enumerate(futures):
+            results[i::workers] = future.result()
+        return self._join(queries, results)
+
+    async def _arun(self, queries: list):
+        queries = self._normalize(queries)
+        if not queries:
+            return "Nenhuma consulta informada."
+        too_many = self._too_many(queries)
+        if too_many:
+            return too_many
+        results = await asyncio.gather(*(self._aquery(q) for q in queries), return_exceptions=True)
+        return self._join(queries, results)
+
@@ -1,4 +1,5 @@
 import express from 'express';
+import crypto from 'crypto';
 import {
     getAuthUrl,
     handleCallback,
@@ -11,10 +12,13 @@ import {
     executeCalendarFunction,
     scheduleAppointment,
     findEventsByCustomerEmail,
+    syncEvents,
     rescheduleAppointment,
     checkAvailability,
     cancelAppointment,
-    listAvailableSlotsForDay
+    listAvailableSlotsForDay,
+    formatBusinessHoursForDisplay,
+    MIN_ADVANCE_MINUTES
 } from '../services/googleCalendarService.js';
 import prisma from '../config/prisma.js';
 
@@ -398,6 +402,31 @@ router.get('/customer-events', async (req, res) => {
     }
 });
 
+/**
+ * GET /api/google-calendar/events-sync
+ * Upcoming events for the AI engine's attendee-email index
+ * Query params: userId (required), syncToken (optional - incremental sync since the previous call)
+ * Returns reason 'sync_token_expired' when Google asks for a new full sync
+ */
+router.get('/events-sync', async (req, res) => {
+    try {
+        const { userId, syncToken } = req.query;
+
+        if (!userId) {
+            return res.status(400).json({
+                success: false,
+                error: 'userId is required'
+            });
+        }
+
+        const result = await syncEvents(userId, syncToken || null);
+        res.json(result);
+    } catch (error) {
+        console.error('Events sync error:', error.message);
+        res.status(500).json({ success: false, error: error.message });
+    }
+});
+
 /**
  * POST /api/google-calendar/reschedule-appointment
  * Reschedule an existing appointment
@@ -501,6 +530,53 @@ router.post('/check-availability', async (req, res) => {
     }
 });
 
+/**
+ * GET /api/google-calendar/scheduling-rules
+ * Scheduling rules used by the AI engine to pre-validate requested times locally
+ * Query params: userId (required), version (optional - version already cached by the caller)
+ * Returns { success, version, unchanged } when the rules did not change since `version`
+ */
+router.get('/scheduling-rules', async (req, res) => {
+    try {
+        const { userId, version } = req.query;
+
+        if (!userId) {
+            return res.status(400).json({
+                success: false,
+                error: 'userId is required'
+            });
+        }
+
+        const user = await prisma.user.findFirst({
+            where: { email: userId },
+            select: {
+                businessHours: true,
+                serviceType: true,
+                appointmentDuration: true
+            }
+        });
+
+        const rules = {
+            businessHours: user?.businessHours || null,
+            appointmentDuration: user?.appointmentDuration || 60,
+            serviceType: user?.serviceType || null,
+            minAdvanceMinutes: MIN_ADVANCE_MINUTES,
+            timezone: 'America/Sao_Paulo'
+        };
+        rules.formattedHours = formatBusinessHoursForDisplay(rules.businessHours);
+
+        const currentVersion = crypto.createHash('sha1').update(JSON.stringify(rules)).digest('hex').slice(0, 16);
+        if (version && version === currentVersion) {
+            return res.json({ success: true, version: currentVersion, unchanged: true });
+        }
+
+        res.json({ success: true, version: currentVersion, rules });
+    } catch (error) {
+        console.error('Scheduling rules error:', error.message);
+        res.status(500).json({ success: false, error: error.message });
+    }
+});
+
 /**
  * POST /api/google-calendar/cancel-appointment
  * Cancel an existing appointment
@@ -69,7 +69,7 @@ router.post('/instagram/send-dm', async (req, res) => {
 // Called by Python AI Engine to send AUDIO messages (TTS)
 router.post('/whatsapp/send-audio', async (req, res) => {
     try {
-        const { userId, phoneNumber, message } = req.body;
+        const { userId, phoneNumber, message, deadlineAt } = req.body;
 
         if (!userId || !phoneNumber || !message) {
             return res.status(400).json({
@@ -79,7 +79,8 @@ router.post('/whatsapp/send-audio', async (req, res) => {
         }
 
         // Call sendMessageToUser with forceAudio option
-        await sendMessageToUser(userId, phoneNumber, message, 'text', { forceAudio: true });
+        // deadlineAt (epoch ms): skip sending if synthesis finishes after the caller's latency budget
+        await sendMessageToUser(userId, phoneNumber, message, 'text', { forceAudio: true, deadlineAt });
 
         logger.info(`Audio message (TTS) sent via internal tool to ${phoneNumber} (Session: ${userId})`);
 
@@ -88,6 +89,14 @@ router.post('/whatsapp/send-audio', async (req, res) => {
             message: 'Audio message sent successfully'
         });
     } catch (error) {
+        if (error.code === 'AUDIO_DEADLINE_EXCEEDED') {
+            logger.warn(`Audio for ${req.body.phoneNumber} missed its deadline; not sent`);
+            return res.status(409).json({
+                success: false,
+                reason: 'deadline_exceeded',
+                error: error.message
+            });
+        }
         logger.error(`Error sending audio via internal tool: ${error.message}`);
         res.status(500).json({
             success: false,
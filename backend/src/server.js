@@ -15,6 +15,7 @@ import userRoutes from './routes/userRoutes.js';
 import { initGoogleCalendarService } from './services/googleCalendarService.js';
 import { initWhatsAppService, getSessionStatus, setAgentPrompt, cleanup as cleanupWhatsApp } from './services/whatsappService.js';
 import { PROMPTS } from './prompts/agentPrompts.js';
+import { getAudioCacheStats } from './utils/audioCache.js';
 
 const app = express();
 const httpServer = createServer(app);
@@ -155,7 +156,8 @@ app.get('/api/status', (req, res) => {
   res.json({
     success: true,
     status: 'online',
-    timestamp: new Date().toISOString()
+    timestamp: new Date().toISOString(),
+    audioCache: getAudioCacheStats()
   });
 });
 
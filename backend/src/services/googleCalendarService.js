@@ -87,6 +87,9 @@ const updateConnectionMappingStatus = async (userId, status) => {
 const DEFAULT_TIMEZONE = 'America/Sao_Paulo';
 const TIMEZONE_OFFSET = '-03:00';
 
+// Minimum advance time for appointments (also served to the AI engine via /scheduling-rules)
+export const MIN_ADVANCE_MINUTES = 120;
+
 /**
  * Ensure datetime has timezone offset appended
  * If already has timezone (ends with Z or +/-HH:MM), return as-is
@@ -1021,7 +1024,7 @@ export const findAlternativeSlots = async (userId, requestedDateTime, businessHo
 
                     // Skip past times (with 2 hour minimum advance)
                     const now = new Date();
-                    const minAdvanceMs = 2 * 60 * 60 * 1000;
+                    const minAdvanceMs = MIN_ADVANCE_MINUTES * 60 * 1000;
                     if (currentStart.getTime() < now.getTime() + minAdvanceMs) {
                         currentStart = new Date(currentStart.getTime() + (30 * 60 * 1000));
                         continue;
@@ -1140,7 +1143,7 @@ export const listAvailableSlotsForDay = async (userId, date, durationMinutes = 6
         // Calculate available slots
         const availableSlots = [];
         const now = new Date();
-        const minAdvanceMs = 2 * 60 * 60 * 1000; // 2 hours minimum
+        const minAdvanceMs = MIN_ADVANCE_MINUTES * 60 * 1000; // 2 hours minimum
 
         // Period filters
         const periodRanges = {
@@ -1354,7 +1357,7 @@ export const scheduleAppointment = async (userId, appointmentData, businessConte
 
     // Step 0: Validate minimum advance time (2 hours)
     const now = new Date();
-    const minAdvanceMs = 2 * 60 * 60 * 1000; // 2 hours in milliseconds
+    const minAdvanceMs = MIN_ADVANCE_MINUTES * 60 * 1000; // 2 hours in milliseconds
     const minValidTime = new Date(now.getTime() + minAdvanceMs);
 
     if (startDate < minValidTime) {
@@ -1524,6 +1527,98 @@ export const findEventsByCustomerEmail = async (userId, customerEmail, fromDate
     }
 };
 
+// Max pages (250 events each) read in a single events sync
+const SYNC_MAX_PAGES = 20;
+
+const isSyncTokenExpired = (error) => /\b410\b|fullSyncRequired|sync ?token/i.test(String(error || ''));
+
+/**
+ * Event shape used by the AI engine's attendee index
+ * Cancelled events from an incremental sync only carry id and status
+ */
+const toIndexedEvent = (e) => ({
+    id: e.id,
+    summary: e.summary,
+    start: e.start?.dateTime || e.start?.date,
+    end: e.end?.dateTime || e.end?.date,
+    status: e.status,
+    meetLink: e.hangoutLink || e.conferenceData?.entryPoints?.[0]?.uri,
+    attendees: (e.attendees || []).map(a => a.email?.toLowerCase()).filter(Boolean)
+});
+
+/**
+ * Sync upcoming events for the AI engine's attendee index (Google Calendar incremental sync)
+ * Without syncToken: full sync of events from now on. With syncToken: only what changed since then,
+ * including deleted events (status "cancelled").
+ * @param {string} userId - User's email (calendar owner)
+ * @param {string} [syncToken] - nextSyncToken returned by the previous sync
+ * Fails (reason "too_many_pages") rather than returning a truncated result.
+ * @returns {Promise<{success: boolean, fullSync?: boolean, events?: Array, nextSyncToken?: string, reason?: string, error?: string}>}
+ */
+export const syncEvents = async (userId, syncToken = null) => {
+    const status = await getConnectionStatus(userId, true);
+    if (!status.isConnected) {
+        return { success: false, error: 'Google Calendar not connected' };
+    }
+
+    const items = [];
+    let pageToken = null;
+    let nextSyncToken = null;
+
+    try {
+        for (let page = 0; page < SYNC_MAX_PAGES; page++) {
+            // Google rejects time_min/order_by together with sync_token
+            const args = syncToken
+                ? { sync_token: syncToken, single_events: true, max_results: 250 }
+                : { time_min: new Date().toISOString(), single_events: true, max_results: 250 };
+            if (pageToken) args.page_token = pageToken;
+
+            const result = await composio.tools.execute(
+                'GOOGLECALENDAR_EVENTS_LIST',
+                {
+                    connectedAccountId: status.connectionId,
+                    userId: userId,
+                    dangerouslySkipVersionCheck: true,
+                    arguments: args
+                }
+            );
+
+            if (!result.successful) {
+                if (syncToken && isSyncTokenExpired(result.error)) {
+                    return { success: false, reason: 'sync_token_expired', error: result.error };
+                }
+                return { success: false, error: result.error || 'Failed to sync events' };
+            }
+
+            const data = result.data || {};
+            items.push(...(data.items || (Array.isArray(data) ? data : [])));
+            nextSyncToken = data.nextSyncToken || nextSyncToken;
+            pageToken = data.nextPageToken;
+            if (!pageToken) break;
+        }
+    } catch (error) {
+        if (syncToken && isSyncTokenExpired(error.message)) {
+            return { success: false, reason: 'sync_token_expired', error: error.message };
+        }
+        console.error('Sync events error:', error.message);
+        return { success: false, error: error.message };
+    }
+
+    // Stopped at SYNC_MAX_PAGES with pages left: the index would be incomplete, so the
+    // AI engine falls back to /customer-events instead
+    if (pageToken) {
+        console.warn(`⚠️ Event sync for ${userId} exceeded ${SYNC_MAX_PAGES} pages`);
+        return { success: false, reason: 'too_many_pages', error: `More than ${SYNC_MAX_PAGES} pages of events` };
+    }
+
+    return {
+        success: true,
+        fullSync: !syncToken,
+        nextSyncToken,
+        events: items.map(toIndexedEvent)
+    };
+};
+
 /**
  * Delete a calendar event
  * @param {string} userId - User's email (calendar owner)
@@ -1766,7 +1861,7 @@ export const rescheduleAppointment = async (userId, eventId, newStart, newEnd, b
 
     // 2. Validate minimum advance time (2 hours)
     const now = new Date();
-    const minAdvanceMs = 2 * 60 * 60 * 1000; // 2 hours
+    const minAdvanceMs = MIN_ADVANCE_MINUTES * 60 * 1000; // 2 hours
     const minValidTime = new Date(now.getTime() + minAdvanceMs);
 
     if (startDate < minValidTime) {
@@ -1892,7 +1987,7 @@ export const checkAvailability = async (userId, requestedDate, requestedTime, du
 
     // 0. Validate minimum advance time (2 hours)
     const now = new Date();
-    const minAdvanceMs = 2 * 60 * 60 * 1000;
+    const minAdvanceMs = MIN_ADVANCE_MINUTES * 60 * 1000;
     const minValidTime = new Date(now.getTime() + minAdvanceMs);
 
     if (startDt < minValidTime) {
@@ -2064,7 +2159,7 @@ function isWithinBusinessHours(startDateTime, endDateTime, businessHours) {
  * @param {object} businessHours 
  * @returns {string}
  */
-function formatBusinessHoursForDisplay(businessHours) {
+export function formatBusinessHoursForDisplay(businessHours) {
     if (!businessHours) return "24 horas";
 
     // New format with Portuguese keys
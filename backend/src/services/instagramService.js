@@ -1,6 +1,7 @@
 import { Composio } from '@composio/core';
 import dotenv from 'dotenv';
 import axios from 'axios';
+import { postWebhookWithDelta } from '../utils/webhookDelta.js';
 import fs from 'fs';
 import path from 'path';
 
@@ -488,12 +489,12 @@ export const startPolling = (userId, intervalMs = 15000) => {
                     // Forward to AI Engine
                     const aiServiceUrl = process.env.AI_SERVICE_URL || 'http://localhost:8000';
                     try {
-                        await axios.post(`${aiServiceUrl}/webhook/instagram`, {
-                            userId,
-                            senderId,
-                            message: messageText,
+                        await postWebhookWithDelta(`${aiServiceUrl}/webhook/instagram`, {
+                            conversationKey: historyKey,
+                            tenantKey: userId,
+                            base: { userId, senderId, message: messageText, receivedAt: Date.now() },
                             history: history.map(h => ({ role: h.role, content: h.content })),
-                            agentPrompt
+                            config: { agentPrompt }
                         });
                         console.log(`✅ Forwarded to AI Engine for ${senderId}`);
                     } catch (aiError) {
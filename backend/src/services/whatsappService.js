@@ -9,6 +9,8 @@ import fs from 'fs';
 import { getSessionConfig, isTtsEnabled, getTtsVoice, getTtsRules } from './sessionConfigService.js';
 import { generateAudio } from './ttsService.js';
 import { convertWavToOgg } from '../utils/audioConverter.js';
+import { audioCacheKey, getCachedAudio, setCachedAudio } from '../utils/audioCache.js';
+import { postWebhookWithDelta } from '../utils/webhookDelta.js';
 import { GoogleGenerativeAI } from "@google/generative-ai";
 import { getConversationHistory, saveMessage } from './historyService.js';
 import prisma from '../config/prisma.js';
@@ -1002,7 +1004,8 @@ const createSession = async (sessionId, socket, io, phoneNumber = null, userId =
                         appointmentDuration: appointmentDurations.get(sessionId) || 60,
                         serviceType: serviceTypes.get(sessionId) || 'online',
                         businessAddress: businessAddresses.get(sessionId) || null,
-                        apiKey: geminiApiKeys.get(sessionId) || null
+                        apiKey: geminiApiKeys.get(sessionId) || null,
+                        receivedAt: Date.now() // First buffered message: start of the engine's response deadline
                     });
                 }
 
@@ -1055,7 +1058,7 @@ const processBufferedMessages = async (contactId, io) => {
         return;
     }
 
-    const { messages, lastIncomingType, sessionId, sock, socket, agentPrompt: bufferAgentPrompt, remoteJid, userEmail, appointmentDuration, serviceType, businessAddress, apiKey } = buffer;
+    const { messages, lastIncomingType, sessionId, sock, socket, agentPrompt: bufferAgentPrompt, remoteJid, userEmail, appointmentDuration, serviceType, businessAddress, apiKey, receivedAt } = buffer;
 
     // Se o buffer foi marcado para refresh, buscar novo prompt do DB
     let agentPrompt = bufferAgentPrompt;
@@ -1136,21 +1139,29 @@ const processBufferedMessages = async (contactId, io) => {
             }
         }
 
-        await axios.post(`${aiServiceUrl}/webhook/whatsapp`, {
-            userId: sessionId,
-            remoteJid: remoteJid,
-            message: combinedMessage,
+        // Delta protocol: history and tenant config are only sent in full when the engine doesn't have them cached
+        await postWebhookWithDelta(`${aiServiceUrl}/webhook/whatsapp`, {
+            conversationKey: `${sessionId}:${remoteJid}`,
+            tenantKey: sessionId,
+            base: {
+                userId: sessionId,
+                remoteJid: remoteJid,
+                message: combinedMessage,
+                incomingMessageType: lastIncomingType,
+                instancePhone: instancePhone,
+                customerPhone: customerPhone,
+                receivedAt: receivedAt
+            },
             history: historyForAI,
-            agentPrompt: agentPrompt,
-            incomingMessageType: lastIncomingType,
-            instancePhone: instancePhone,
-            customerPhone: customerPhone,
-            userEmail: userEmail,  // Email do usuário para Google Calendar
-            appointmentDuration: appointmentDuration,  // Duração padrão dos agendamentos
-            serviceType: serviceType,  // Tipo de serviço (online/presencial)
-            businessAddress: businessAddress,  // Endereço do estabelecimento
-            calendarConnected: calendarConnected,  // Se o Google Calendar está conectado
-            apiKey: apiKey // Pass user provided API Key
+            config: {
+                agentPrompt: agentPrompt,
+                userEmail: userEmail,  // Email do usuário para Google Calendar
+                appointmentDuration: appointmentDuration,  // Duração padrão dos agendamentos
+                serviceType: serviceType,  // Tipo de serviço (online/presencial)
+                businessAddress: businessAddress,  // Endereço do estabelecimento
+                calendarConnected: calendarConnected,  // Se o Google Calendar está conectado
+                apiKey: apiKey // Pass user provided API Key
+            }
         });
 
         console.log(`✅ Buffered messages forwarded to AI Engine for ${remoteJid}`);
@@ -1430,12 +1441,29 @@ export const sendMessageToUser = async (sessionId, phoneNumber, message, incomin
                 await sock.sendPresenceUpdate('recording', remoteJid);
 
                 const voice = options.voice || config.ttsVoice || 'Kore';
-                console.log(`🎤 Generating audio with voice: ${voice}`);
-                const ttsResult = await generateAudio(textForTts, voice, config.apiKey || process.env.GEMINI_API_KEY);
 
-                // Convert WAV to OGG for WhatsApp
-                const wavBuffer = Buffer.from(ttsResult.audioContent, 'base64');
-                const oggBuffer = await convertWavToOgg(wavBuffer);
+                // Repeated phrases (greetings, confirmations) skip TTS + ffmpeg entirely
+                const cacheKey = audioCacheKey(voice, textForTts);
+                let oggBuffer = getCachedAudio(cacheKey);
+                if (oggBuffer) {
+                    console.log(`🎤 Audio cache hit for voice ${voice}`);
+                } else {
+                    console.log(`🎤 Generating audio with voice: ${voice}`);
+                    const ttsResult = await generateAudio(textForTts, voice, config.apiKey || process.env.GEMINI_API_KEY);
+
+                    // Convert WAV to OGG for WhatsApp
+                    const wavBuffer = Buffer.from(ttsResult.audioContent, 'base64');
+                    oggBuffer = await convertWavToOgg(wavBuffer);
+                    setCachedAudio(cacheKey, oggBuffer);
+                }
+
+                // Past the caller's latency budget: don't send the audio. The route answers 409 and
+                // the AI Engine sends the text version only after receiving it
+                if (options.deadlineAt && Date.now() > options.deadlineAt) {
+                    const deadlineError = new Error('Audio synthesis exceeded the latency budget');
+                    deadlineError.code = 'AUDIO_DEADLINE_EXCEEDED';
+                    throw deadlineError;
+                }
 
                 // Send as voice message (ptt = push-to-talk)
                 await sock.sendMessage(remoteJid, {
@@ -1462,6 +1490,10 @@ export const sendMessageToUser = async (sessionId, phoneNumber, message, incomin
                     console.log(`✅ Links sent as text to ${remoteJid}`);
                 }
             } catch (ttsError) {
+                if (ttsError.code === 'AUDIO_DEADLINE_EXCEEDED') {
+                    await sock.sendPresenceUpdate('paused', remoteJid);
+                    throw ttsError;
+                }
                 console.error('⚠️ TTS failed, falling back to text:', ttsError.message);
 
                 // Indicate "paused" before falling back
@@ -0,0 +1,65 @@
+/**
+ * Audio Cache Utility
+ *
+ * In-memory LRU cache of synthesized voice messages (OGG/Opus), keyed by a
+ * content hash of voice + text. Repeated phrases (greetings, confirmations)
+ * go out without calling TTS or ffmpeg again.
+ */
+
+import crypto from 'crypto';
+
+const MAX_ENTRIES = parseInt(process.env.AUDIO_CACHE_MAX_ENTRIES || '200', 10);
+const TTL_MS = parseInt(process.env.AUDIO_CACHE_TTL_MS || String(24 * 60 * 60 * 1000), 10);
+
+// Map preserves insertion order: oldest entries are evicted first
+const cache = new Map();
+const stats = { hits: 0, misses: 0 };
+
+/**
+ * Content hash used as cache key
+ * @param {string} voice - TTS voice name
+ * @param {string} text - Text that was synthesized
+ * @returns {string}
+ */
+export function audioCacheKey(voice, text) {
+    return crypto.createHash('sha256').update(`${voice}\u0000${text.trim()}`).digest('hex');
+}
+
+/**
+ * Get a cached OGG buffer (refreshes its LRU position)
+ * @param {string} key
+ * @returns {Buffer|null}
+ */
+export function getCachedAudio(key) {
+    const entry = cache.get(key);
+    if (!entry || Date.now() - entry.createdAt > TTL_MS) {
+        if (entry) cache.delete(key);
+        stats.misses++;
+        return null;
+    }
+    cache.delete(key);
+    cache.set(key, entry);
+    stats.hits++;
+    return entry.buffer;
+}
+
+/**
+ * Store an OGG buffer, evicting the least recently used entries
+ * @param {string} key
+ * @param {Buffer} buffer
+ */
+export function setCachedAudio(key, buffer) {
+    cache.delete(key);
+    cache.set(key, { buffer, createdAt: Date.now() });
+    while (cache.size > MAX_ENTRIES) {
+        cache.delete(cache.keys().next().value);
+    }
+}
+
+/**
+ * Hit/miss counters and size, reported by GET /api/status
+ * @returns {{hits: number, misses: number, entries: number, maxEntries: number}}
+ */
+export function getAudioCacheStats() {
+    return { ...stats, entries: cache.size, maxEntries: MAX_ENTRIES };
+}
@@ -0,0 +1,141 @@
+/**
+ * Webhook Delta Utility
+ *
+ * Sends conversation history and tenant configuration to the AI Engine as
+ * deltas: after the first full payload, only the new history items and the
+ * config version hash are sent. The engine answers 409 { reason: 'cache_miss' }
+ * when it does not have the referenced version (restart, eviction), and the
+ * full payload is resent.
+ *
+ * The history hash must match history_version() in ai_engine/conversation_cache.py.
+ */
+
+import crypto from 'crypto';
+import axios from 'axios';
+
+const DELTA_ENABLED = process.env.WEBHOOK_DELTA !== '0';
+const MAX_TRACKED = parseInt(process.env.WEBHOOK_DELTA_MAX_TRACKED || '5000', 10);
+
+// conversationKey -> last history sent; tenantKey -> last config version sent
+const sentHistory = new Map();
+const sentConfig = new Map();
+
+/**
+ * Version hash of a history window (sha256 of "role\0content\1" per item)
+ * @param {Array<{role: string, content: string}>} history
+ * @returns {string}
+ */
+export function historyVersion(history) {
+    const hash = crypto.createHash('sha256');
+    for (const item of history) {
+        hash.update(`${item.role}\u0000${item.content}\u0001`, 'utf8');
+    }
+    return hash.digest('hex').slice(0, 16);
+}
+
+/**
+ * Version hash of a tenant configuration object
+ * @param {Object} config
+ * @returns {string}
+ */
+export function configVersion(config) {
+    const canonical = JSON.stringify(Object.keys(config).sort().map(key => [key, config[key] ?? null]));
+    return crypto.createHash('sha256').update(canonical, 'utf8').digest('hex').slice(0, 16);
+}
+
+const sameItem = (a, b) => a.role === b.role && a.content === b.content;
+
+/**
+ * Smallest number of oldest items to drop from `previous` so that it becomes a
+ * prefix of `current` (the DB window slides as the conversation grows)
+ * @returns {number|null} null when the windows do not overlap
+ */
+function overlapDrop(previous, current) {
+    for (let drop = 0; drop < previous.length; drop++) {
+        const remaining = previous.length - drop;
+        if (remaining > current.length) continue;
+        let matches = true;
+        for (let i = 0; i < remaining; i++) {
+            if (!sameItem(previous[drop + i], current[i])) {
+                matches = false;
+                break;
+            }
+        }
+        if (matches) return drop;
+    }
+    return null;
+}
+
+function remember(map, key, value) {
+    map.delete(key);
+    map.set(key, value);
+    while (map.size > MAX_TRACKED) {
+        map.delete(map.keys().next().value);
+    }
+}
+
+function buildPayload({ conversationKey, tenantKey, base, history, config }, forceFull) {
+    const payload = { ...base, historyVersion: historyVersion(history) };
+    const cfgVersion = configVersion(config);
+    payload.configVersion = cfgVersion;
+
+    const previous = sentHistory.get(conversationKey);
+    const drop = !forceFull && previous ? overlapDrop(previous.history, history) : null;
+    if (drop !== null) {
+        payload.historyBaseVersion = previous.version;
+        payload.historyDrop = drop;
+        payload.historyAppend = history.slice(previous.history.length - drop);
+    } else {
+        payload.history = history;
+    }
+
+    if (forceFull || sentConfig.get(tenantKey) !== cfgVersion) {
+        // null (not undefined) so the engine sees every config field as present
+        for (const [key, value] of Object.entries(config)) {
+            payload[key] = value ?? null;
+        }
+    }
+    return payload;
+}
+
+/**
+ * POST a webhook payload to the AI Engine using the delta protocol
+ * @param {string} url - Engine webhook URL
+ * @param {Object} params
+ * @param {string} params.conversationKey - e.g. `${sessionId}:${remoteJid}`
+ * @param {string} params.tenantKey - Key of the tenant config (session / user id)
+ * @param {Object} params.base - Per-message fields (userId, message, ...)
+ * @param {Array} params.history - Full history window
+ * @param {Object} params.config - Tenant config fields (agentPrompt, ...)
+ */
+export async function postWebhookWithDelta(url, params) {
+    if (!DELTA_ENABLED) {
+        return axios.post(url, { ...params.base, history: params.history, ...params.config });
+    }
+
+    const rememberSent = () => {
+        remember(sentHistory, params.conversationKey, { version: historyVersion(params.history), history: params.history });
+        remember(sentConfig, params.tenantKey, configVersion(params.config));
+    };
+
+    try {
+        const response = await axios.post(url, buildPayload(params, false));
+        rememberSent();
+        return response;
+    } catch (error) {
+        if (error.response?.status === 409 && error.response.data?.detail?.reason === 'cache_miss') {
+            console.log(`🔁 AI Engine cache miss (${error.response.data.detail.missing}); resending full payload`);
+            const response = await axios.post(url, buildPayload(params, true));
+            rememberSent();
+            return response;
+        }
+        if (error.response) {
+            // Engine received the payload (and cached it) even though processing failed
+            rememberSent();
+        } else {
+            sentHistory.delete(params.conversationKey);
+            sentConfig.delete(params.tenantKey);
+        }
+        throw error;
+    }
+}